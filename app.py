@@ -1,36 +1,242 @@
 import sys
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
 import os
+import time
+import uuid
 from werkzeug.utils import secure_filename
-import subprocess
-import shutil
+from werkzeug.security import safe_join
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import ffmpeg
 import json
+import math
 import traceback
-from demucs import __version__ as demucs_version
+from utils.separator import SeparationEngine, validate_stems
+from utils.jobs import JobManager, BrokerJobManager, QueueFullError
+from utils.broker import connect as connect_broker
+from utils.ffmpeg_utils import probe_duration, run_with_progress, audio_fingerprint, decode_to_shared_memory
+from utils.cache import ResultCache
+from utils.storage import StorageManager
+from utils.serving import MediaSender
+from utils.exporter import stem_loudness, precompute_loudness, mix_gains, build_mix, pcm_input, export_key
+from utils.preview import PreviewMix, CHUNK_FORMATS
+from utils.stems import (
+    source_paths, sources_info, encode_layout, stem_layout, iter_mix, StemEncoder, FORMATS, MIMETYPES
+)
+from utils.uploads import UploadManager, UploadError, UploadOffsetError, CHUNK_SIZE
+from utils.metrics import (
+    registry, Gauge, SamplingProfiler, stage, log_event,
+    REQUESTS, REQUEST_SECONDS, CACHE_REQUESTS, BYTES_PROCESSED
+)
 
 app = Flask(__name__)
 app.config.update({
     'UPLOAD_FOLDER': 'static/uploads',
     'SEPARATED_FOLDER': 'static/separated',
     'EXPORT_FOLDER': 'static/exports',
+    'TEMP_FOLDER': 'static/temp',
     'ALLOWED_EXTENSIONS': {'mp3', 'mp4', 'wav'},
     'ALLOWED_EXPORT_EXTENSIONS': {'mp4'},
     'MAX_CONTENT_LENGTH': 100 * 1024 * 1024,
+    'MAX_UPLOAD_SIZE': int(os.environ.get('MAX_UPLOAD_SIZE', 1024 * 1024 * 1024)),
     'MAX_EXPORT_DURATION': 3600,
+    'SEPARATION_MODEL': 'htdemucs',
+    'SEPARATION_MODELS': ('htdemucs', 'htdemucs_6s', 'htdemucs_ft'),
+    'WARM_MODELS': os.environ.get('WARM_MODELS', 'htdemucs').split(','),
+    'MODEL_MEMORY_BUDGET': int(os.environ.get('MODEL_MEMORY_BUDGET', 1024 * 1024 * 1024)),
+    'SEPARATION_WORKERS': int(os.environ.get('SEPARATION_WORKERS', 1)),
+    'SEPARATION_DEVICE': os.environ.get('SEPARATION_DEVICE', 'cpu'),
+    'SEPARATION_TIMEOUT': 600,
+    # الملفات الأطول تأخذ مهلة تتناسب مع مدتها: ثوانٍ من المعالجة لكل ثانية صوت
+    'SEPARATION_TIMEOUT_PER_SECOND': float(os.environ.get('SEPARATION_TIMEOUT_PER_SECOND', 3.0)),
+    # فترات الصمت الطويلة (أهدأ من العتبة لمدة لا تقل عن الحد الأدنى) لا تمر بالنموذج
+    'SKIP_SILENCE': os.environ.get('SKIP_SILENCE', '1') == '1',
+    'SILENCE_THRESHOLD_DB': float(os.environ.get('SILENCE_THRESHOLD_DB', -50.0)),
+    'SILENCE_MIN_DURATION': float(os.environ.get('SILENCE_MIN_DURATION', 4.0)),
+    'INGEST_SAMPLERATE': 44100,
+    'INGEST_CHANNELS': 2,
+    'STREAMING_MIN_DURATION': 600,
+    'STREAMING_SEGMENT': 60,
+    'STREAMING_OVERLAP': 5,
+    'CACHE_FOLDER': 'static/separated/cache',
+    'CACHE_MAX_BYTES': int(os.environ.get('CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024)),
+    'STORAGE_QUOTA': int(os.environ.get('STORAGE_QUOTA', 10 * 1024 * 1024 * 1024)),
+    'STORAGE_JANITOR_INTERVAL': int(os.environ.get('STORAGE_JANITOR_INTERVAL', 300)),
+    # مدة الاحتفاظ بعد آخر استخدام بالثواني لكل منطقة
+    'STORAGE_TTL': {
+        'uploads': 24 * 3600,
+        'separated': 7 * 24 * 3600,
+        'cache': 30 * 24 * 3600,
+        'temp': 3600,
+        'exports': 24 * 3600,
+        'profiles': 7 * 24 * 3600
+    },
+    'MAX_BATCH_FILES': 50,
+    'MAX_PREVIEW_CHUNK': 30,
+    'ENCODE_WORKERS': int(os.environ.get('ENCODE_WORKERS', 2)),
+    'JOB_WORKERS': int(os.environ.get('JOB_WORKERS', 2)),
+    'JOB_QUEUE_SIZE': int(os.environ.get('JOB_QUEUE_SIZE', 8)),
+    # وسيط مشترك لتشغيل المهام على عقد معالجة منفصلة (worker.py)، مثل sqlite:///jobs.db
+    # أو redis://host:6379/0. فارغ = المهام تعمل في خيوط هذه العملية
+    'JOB_BROKER': os.environ.get('JOB_BROKER', ''),
+    'JOB_LEASE': int(os.environ.get('JOB_LEASE', 60)),
+    'JOB_MAX_ATTEMPTS': int(os.environ.get('JOB_MAX_ATTEMPTS', 3)),
+    'JOB_MAX_PENDING': int(os.environ.get('JOB_MAX_PENDING', 100)),
+    'PROFILING_ENABLED': os.environ.get('PROFILING_ENABLED') == '1',
+    'PROFILE_FOLDER': 'profiles',
+    # تسليم /static عبر الخادم الأمامي: '' أو x-accel (nginx) أو x-sendfile (Apache)
+    'STATIC_OFFLOAD': os.environ.get('STATIC_OFFLOAD', ''),
+    'STATIC_ACCEL_PREFIX': os.environ.get('STATIC_ACCEL_PREFIX', '/_protected/static/'),
+    'USE_X_SENDFILE': os.environ.get('STATIC_OFFLOAD') == 'x-sendfile',
+    'STATIC_MAX_AGE': 365 * 24 * 3600,
     'SECRET_KEY': 'your-secret-key-here'
 })
 
-# Print Demucs version at startup
-print(f"\n[INIT] Demucs version: {demucs_version}\n")
+if app.config['JOB_BROKER']:
+    # كل العقد تشارك مجلد static/ (نفس المسار)، والوسيط يحمل المهام وحالتها بينها
+    jobs = BrokerJobManager(
+        connect_broker(app.config['JOB_BROKER']),
+        max_pending=app.config['JOB_MAX_PENDING'],
+        max_attempts=app.config['JOB_MAX_ATTEMPTS']
+    )
+else:
+    jobs = JobManager(
+        max_workers=app.config['JOB_WORKERS'],
+        max_queue=app.config['JOB_QUEUE_SIZE']
+    )
+
+storage = StorageManager(app.config['STORAGE_QUOTA'], app.config['STORAGE_JANITOR_INTERVAL'])
+
+cache = ResultCache(app.config['CACHE_FOLDER'], app.config['CACHE_MAX_BYTES'], in_use=storage.in_use)
+
+# حالة جلسات الرفع على القرص بجانب الملفات: أي عملية ويب تستقبل الأجزاء التالية
+uploads = UploadManager(app.config['MAX_UPLOAD_SIZE'], os.path.join(app.config['UPLOAD_FOLDER'], '.sessions'))
+
+def upload_in_progress(path):
+    upload_folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    path = os.path.abspath(path)
+    if path == uploads.state_dir:
+        # الجلسات المنتهية يحذفها UploadManager نفسه بعد ttl
+        return True
+    return os.path.dirname(path) == upload_folder and uploads.is_pending(os.path.basename(path))
+
+# كل ما يُكتب على القرص له مدة صلاحية وحصة مشتركة، ولا يُحذف ما تستخدمه مهمة أو رفع قيد التنفيذ
+storage.protect(jobs.in_use)
+storage.protect(upload_in_progress)
+storage_ttl = app.config['STORAGE_TTL']
+storage.add_area('uploads', app.config['UPLOAD_FOLDER'], storage_ttl['uploads'])
+storage.add_area('separated', app.config['SEPARATED_FOLDER'], storage_ttl['separated'])
+storage.add_area(
+    'cache', app.config['CACHE_FOLDER'], storage_ttl['cache'],
+    remove=lambda path: cache.remove(os.path.basename(path))
+)
+storage.add_area('temp', app.config['TEMP_FOLDER'], storage_ttl['temp'])
+storage.add_area('exports', app.config['EXPORT_FOLDER'], storage_ttl['exports'])
+storage.add_area('profiles', app.config['PROFILE_FOLDER'], storage_ttl['profiles'])
+
+encoder = StemEncoder(app.config['ENCODE_WORKERS'])
+
+media = MediaSender(app.config['STATIC_OFFLOAD'], app.static_folder, app.config['STATIC_ACCEL_PREFIX'])
+
+registry.register(Gauge('separator_queue_depth', 'Jobs queued or running', callback=jobs.pending))
+
+_engine = None
+
+def silence_settings():
+    """(عتبة الصمت، أقل مدة) لتخطي النموذج في الصمت الطويل، أو None إذا كان التخطي معطلاً"""
+    if not app.config['SKIP_SILENCE']:
+        return None
+    return (app.config['SILENCE_THRESHOLD_DB'], app.config['SILENCE_MIN_DURATION'])
+
+def get_engine():
+    """Return the resident separation engine, creating the worker pool on first use"""
+    global _engine
+    if _engine is None:
+        _engine = SeparationEngine(
+            model_name=app.config['SEPARATION_MODEL'],
+            workers=app.config['SEPARATION_WORKERS'],
+            device=app.config['SEPARATION_DEVICE'],
+            warm_models=app.config['WARM_MODELS'],
+            memory_budget=app.config['MODEL_MEMORY_BUDGET'],
+            silence=silence_settings()
+        )
+    return _engine
+
+def warmup():
+    """تشغيل عمليات الفصل وتحميل النماذج قبل قبول أول طلب (تُستدعى من wsgi.py)"""
+    with stage('warmup', models=','.join(app.config['WARM_MODELS'])) as fields:
+        fields['pids'] = get_engine().warmup()
+
+def shutdown():
+    """إيقاف مجموعات العمليات والخيوط الخلفية عند خروج عملية الخادم"""
+    storage.stop()
+    jobs.shutdown(wait=False)
+    encoder.shutdown(wait=False)
+    if _engine is not None:
+        _engine.shutdown(wait=False)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def upload_path(filename):
+    """مسار ملف مرفوع، أو None إذا لم يكن الاسم اسم ملف مباشر داخل مجلد الرفع"""
+    if not isinstance(filename, str) or filename in ('', '.', '..') or os.path.basename(filename) != filename:
+        return None
+    return os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    # ?profile=1 أو X-Profile: 1 لتشغيل محلل الأداء على هذا الطلب فقط
+    profile = request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1'
+    if app.config['PROFILING_ENABLED'] and profile:
+        g.profiler = SamplingProfiler().start()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    if g.get('profiler') is not None:
+        response.headers['X-Profile'] = save_profile(g.profiler.stop(), f"{endpoint}_{time.time():.0f}")
+    return response
+
+@app.after_request
+def touch_static_artifact(response):
+    # تحميل الملف يُعتبر استخداماً له (سياسة LRU في StorageManager)
+    if request.endpoint == 'static' and response.status_code < 400:
+        storage.touch(os.path.join('static', request.view_args['filename']))
+    return response
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def home():
-    return render_template('index.html')
+    return render_template(
+        'index.html',
+        models=app.config['SEPARATION_MODELS'],
+        default_model=app.config['SEPARATION_MODEL']
+    )
+
+def separation_options(data):
+    """
+    النموذج والمسارات المطلوبة من بيانات الطلب
+
+    stems: مسار أو عدة مسارات (drums+bass) لعزلها عن الباقي (الافتراضي vocals)، أو 'all' لكل مسارات النموذج
+
+    :raises ValueError: عند طلب نموذج أو مسار غير مدعوم
+    """
+    model = data.get('model') or app.config['SEPARATION_MODEL']
+    stems = data.get('stems') or 'vocals'
+    if not isinstance(model, str) or model not in app.config['SEPARATION_MODELS']:
+        raise ValueError(f"Unknown model: {model}")
+    if not isinstance(stems, str):
+        raise ValueError("stems must be a string such as 'vocals' or 'drums+bass'")
+    two_stems = validate_stems(model, None if stems == 'all' else stems)
+    return {'model': model, 'two_stems': two_stems}
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -48,7 +254,10 @@ def upload_file():
         filename = secure_filename(f"{datetime.now().timestamp()}_{file.filename}")
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        file.save(filepath)
+        with stage('upload_save', filename=filename):
+            file.save(filepath)
+        storage.track(filepath, f"client:{request.remote_addr}")
+        BYTES_PROCESSED.inc(os.path.getsize(filepath), kind='upload')
         
         return jsonify({
             'success': True,
@@ -58,6 +267,376 @@ def upload_file():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def upload_error_response(e):
+    body = {"error": str(e)}
+    if isinstance(e, UploadOffsetError):
+        body["offset"] = e.offset
+    return jsonify(body), e.status
+
+@app.route('/upload/init', methods=['POST'])
+def upload_init():
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('filename'), str) or type(data.get('size')) is not int:
+        return jsonify({"error": "Invalid request data"}), 400
+
+    if not allowed_file(data['filename']):
+        return jsonify({'error': 'File type not allowed'}), 400
+
+    filename = secure_filename(f"{datetime.now().timestamp()}_{data['filename']}")
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    try:
+        upload = uploads.create(filename, filepath, data['size'])
+    except UploadError as e:
+        return upload_error_response(e)
+    storage.track(filepath, f"client:{request.remote_addr}")
+
+    return jsonify({
+        **upload.to_dict(),
+        "chunk_size": CHUNK_SIZE,
+        "upload_url": f"/upload/{upload.id}"
+    }), 201
+
+@app.route('/upload/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    upload = uploads.get(upload_id)
+    if upload is None:
+        return jsonify({"error": "Upload not found"}), 404
+    return jsonify(upload.to_dict())
+
+@app.route('/upload/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    upload = uploads.get(upload_id)
+    if upload is None:
+        return jsonify({"error": "Upload not found"}), 404
+
+    try:
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "Invalid offset"}), 400
+
+    # الجزء يُقرأ من تدفق الطلب ويُكتب في مكانه مباشرة دون تخزين مؤقت
+    received_before = upload.received
+    try:
+        with stage('upload_chunk', upload_id=upload.id, offset=offset):
+            uploads.write(upload, offset, request.stream)
+    except UploadError as e:
+        return upload_error_response(e)
+    finally:
+        BYTES_PROCESSED.inc(max(0, upload.received - received_before), kind='upload')
+
+    return jsonify(upload.to_dict())
+
+@app.route('/upload/<upload_id>', methods=['DELETE'])
+def upload_abort(upload_id):
+    upload = uploads.get(upload_id)
+    if upload is None:
+        return jsonify({"error": "Upload not found"}), 404
+    uploads.abort(upload)
+    return jsonify({"success": True})
+
+@app.route('/upload/<upload_id>/finalize', methods=['POST'])
+def upload_finalize(upload_id):
+    upload = uploads.get(upload_id)
+    if upload is None:
+        return jsonify({"error": "Upload not found"}), 404
+
+    try:
+        uploads.finalize(upload)
+    except UploadError as e:
+        return upload_error_response(e)
+
+    # بدء الفصل فوراً دون انتظار طلب /process منفصل
+    data = request.get_json(silent=True) or {}
+    if data.get('process'):
+        try:
+            options = separation_options(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        input_path = os.path.abspath(upload.path)
+        return submit_job('process', run_process_job, upload.filename, input_path, options, uses=[input_path])
+
+    return jsonify({
+        'success': True,
+        'filename': upload.filename,
+        'filepath': f"/static/uploads/{upload.filename}"
+    })
+
+def to_static_url(path):
+    rel_path = os.path.relpath(path, start=os.path.abspath('static'))
+    return "/static/" + rel_path.replace('\\', '/')
+
+def commit_layout(report, cache_key, output_dir, stem_paths, sources_key=None, sources=None, two_stems=None):
+    # قياس الجهارة مرة واحدة الآن بدلاً من تشغيل loudnorm عند كل تصدير
+    report(stage='analyze')
+    try:
+        with stage('loudness'):
+            precompute_loudness(stem_paths)
+    except (ffmpeg.Error, ValueError) as e:
+        log_event('loudness_failed', error=str(e))
+
+    BYTES_PROCESSED.inc(sum(os.path.getsize(path) for path in stem_paths.values()), kind='stems')
+    # ربط كل مسار بمخرجات النموذج التي جُمع منها (للتصدير والترميز من PCM مباشرة)
+    meta = {}
+    if sources_key and sources:
+        meta = {'sources': sources_key, 'layout': stem_layout(list(sources), two_stems)}
+    return cache.commit(cache_key, output_dir, stem_paths, meta)
+
+def cached_layout(track_path):
+    """
+    معلومات تجميعة المسارات التي ينتمي إليها ملف داخل الذاكرة المؤقتة
+
+    :return: (المفتاح, اسم المسار, {اسم المسار: (مسار MP3, [ملفات float16] أو None)}) أو None
+    """
+    directory = os.path.dirname(os.path.abspath(track_path))
+    key = os.path.basename(directory)
+    if directory != cache.path(key):
+        return None
+    stem_paths = cache.get(key)
+    manifest = cache.manifest(key)
+    if not stem_paths or manifest is None:
+        return None
+
+    name = next((stem for stem, path in stem_paths.items() if os.path.samefile(path, track_path)), None)
+    if name is None:
+        return None
+
+    meta = manifest.get('meta') or {}
+    sources = cache.get(meta['sources']) if meta.get('sources') else None
+    stems = {}
+    for stem, path in stem_paths.items():
+        parts = meta['layout'].get(stem) if sources else None
+        stems[stem] = (path, [sources[part] for part in parts] if parts else None)
+    return key, name, stems
+
+def track_sources(track_path):
+    """ملفات float16 التي جُمع منها مسار في الذاكرة المؤقتة، أو None"""
+    layout = cached_layout(track_path)
+    return layout[2][layout[1]][1] if layout else None
+
+def derive_layout(report, sources, cache_key, sources_key, options):
+    """ترميز تجميعة مسارات جديدة من مخرجات النموذج المحفوظة دون تشغيله مرة أخرى"""
+    output_dir = cache.staging_dir()
+    report(progress=10, stage='derive')
+    try:
+        with stage('derive_layout', model=options['model'], two_stems=options['two_stems']):
+            stem_paths = encode_layout(sources, output_dir, options['two_stems'], mp3_bitrate=192)
+    except Exception:
+        cache.discard(output_dir)
+        raise
+    return commit_layout(report, cache_key, output_dir, stem_paths, sources_key, sources, options['two_stems'])
+
+def separation_timeout(duration):
+    """مهلة الفصل بالثواني: SEPARATION_TIMEOUT كحد أدنى، وأطول للملفات الطويلة بحسب مدتها"""
+    timeout = app.config['SEPARATION_TIMEOUT']
+    if duration:
+        timeout = max(timeout, duration * app.config['SEPARATION_TIMEOUT_PER_SECOND'])
+    return timeout
+
+def separate_uncached(job, report, input_path, cache_key, sources_key, options, pcm=None, segment=None,
+                      duration=None):
+    output_dir = cache.staging_dir()
+    timeout = separation_timeout(duration)
+    # مخرجات النموذج الكاملة تُحفظ لاشتقاق أي تجميعة أخرى لاحقاً، إلا للملفات الطويلة جداً
+    sources_dir = None if segment else cache.staging_dir()
+
+    report(progress=10, stage='separate')
+
+    try:
+        with stage('separate', model=options['model'], streaming=bool(segment), output=output_dir):
+            stem_paths = get_engine().separate(
+                input_path,
+                output_dir,
+                model=options['model'],
+                two_stems=options['two_stems'],
+                mp3_bitrate=192,
+                timeout=timeout,
+                progress=lambda percent: report(progress=10 + percent * 0.88),
+                cancelled=lambda: job.cancelled,
+                segment=segment,
+                overlap=app.config['STREAMING_OVERLAP'],
+                partial=lambda stems: report(
+                    partial={stem: to_static_url(path) for stem, path in stems.items()}
+                ),
+                pcm=pcm,
+                sources_dir=sources_dir
+            )
+    except FutureTimeoutError:
+        cache.discard(output_dir)
+        cache.discard(sources_dir)
+        raise Exception(f"Processing timed out ({timeout / 60:.0f} minutes)")
+    except Exception:
+        cache.discard(output_dir)
+        cache.discard(sources_dir)
+        raise
+
+    sources = None
+    if sources_dir:
+        sources = cache.commit(sources_key, sources_dir, source_paths(sources_dir))
+    return commit_layout(report, cache_key, output_dir, stem_paths, sources_key, sources, options['two_stems'])
+
+def separate_file(job, filename, input_path, report, options):
+    # ملفات الفيديو تُشغّل مباشرة من الملف المرفوع ولا حاجة لنسخة منها
+    video_url = f"/static/uploads/{filename}"
+    samplerate, channels = app.config['INGEST_SAMPLERATE'], app.config['INGEST_CHANNELS']
+
+    # الملفات الطويلة تُفصل على شكل مقاطع متداخلة حتى تبقى الذاكرة ثابتة
+    with stage('probe'):
+        duration = probe_duration(input_path)
+    segment = None
+    if duration and duration > app.config['STREAMING_MIN_DURATION']:
+        segment = app.config['STREAMING_SEGMENT']
+
+    # فك ترميز واحد: نفس القراءة تعطي البصمة والصوت الجاهز للنموذج
+    report(stage='decode')
+    shm = None
+    pcm = None
+    try:
+        with stage('decode', streaming=bool(segment), duration=duration, segment=segment):
+            if segment:
+                fingerprint = audio_fingerprint(input_path, samplerate, channels)
+            else:
+                shm, frames, fingerprint = decode_to_shared_memory(
+                    input_path, samplerate, channels,
+                    progress=lambda percent: report(progress=percent * 0.1),
+                    job=job
+                )
+                pcm = (shm.name, frames, samplerate, channels)
+                BYTES_PROCESSED.inc(frames * channels * 4, kind='decode')
+    except ffmpeg.Error as e:
+        job.check_cancelled()
+        error_msg = e.stderr.decode('utf8') if e.stderr else str(e)
+        log_event('decode_failed', path=input_path, error=error_msg)
+        raise Exception(f"Audio decoding failed: {error_msg}")
+
+    try:
+        # تخطي الصمت يغير مخرجات النموذج، لذلك إعداداته جزء من المفتاح
+        silence = silence_settings()
+        cache_key = ResultCache.make_key(
+            fingerprint,
+            model=options['model'],
+            two_stems=options['two_stems'],
+            mp3_bitrate=192,
+            silence=silence
+        )
+        # مخرجات النموذج الكاملة لا تعتمد على تجميعة المسارات المطلوبة
+        sources_key = ResultCache.make_key(fingerprint, model=options['model'], silence=silence)
+
+        # نفس المفتاح لا يُحسب مرتين: الطلب الثاني ينتظر ثم يجد النتيجة في الذاكرة المؤقتة
+        with cache.lock(cache_key):
+            stem_paths = cache.get(cache_key)
+            if stem_paths:
+                log_event('cache', result='hit', key=cache_key)
+                CACHE_REQUESTS.inc(result='hit')
+            else:
+                job.check_cancelled()
+                with cache.lock(sources_key):
+                    sources = cache.get(sources_key)
+                    if sources:
+                        log_event('cache', result='derived', key=cache_key, sources=sources_key)
+                        CACHE_REQUESTS.inc(result='derived')
+                        stem_paths = derive_layout(report, sources, cache_key, sources_key, options)
+                        storage.track(cache.path(cache_key), f"job:{job.id}")
+                    else:
+                        log_event('cache', result='miss', key=cache_key)
+                        CACHE_REQUESTS.inc(result='miss')
+                        stem_paths = separate_uncached(
+                            job, report, input_path, cache_key, sources_key, options, pcm, segment, duration
+                        )
+                        storage.track(cache.path(cache_key), f"job:{job.id}")
+                        storage.track(cache.path(sources_key), f"job:{job.id}")
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    # Find output files
+    report(stage='collect')
+    output_files = {}
+    with stage('stem_discovery') as fields:
+        for stem, audio_path in (stem_paths or {}).items():
+            output_files[stem] = to_static_url(audio_path)
+        fields['stems'] = list(output_files)
+
+    if not output_files:
+        raise Exception("No output files created")
+
+    return {
+        "success": True,
+        "tracks": output_files,
+        "video_url": video_url
+    }
+
+def run_process_job(job, filename, input_path, options):
+    return separate_file(job, filename, input_path, job.update, options)
+
+def run_batch_job(job, files, options):
+    # كل ملف يمر بنفس الذاكرة المؤقتة ونفس العمليات العاملة التي تحمل النموذج مسبقاً
+    file_progress = {filename: 0.0 for filename, _ in files}
+
+    def reporter(filename):
+        def report(progress=None, stage=None, partial=None):
+            if progress is not None:
+                file_progress[filename] = progress
+                job.update(progress=sum(file_progress.values()) / len(file_progress))
+        return report
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=get_engine().workers) as executor:
+        futures = {
+            executor.submit(separate_file, job, filename, input_path, reporter(filename), options): filename
+            for filename, input_path in files
+        }
+        job.update(stage='separate')
+        for future in as_completed(futures):
+            filename = futures[future]
+            file_progress[filename] = 100.0
+            try:
+                results[filename] = future.result()
+            except Exception as e:
+                job.check_cancelled()
+                log_event('batch_file_failed', id=job.id, filename=filename, error=str(e))
+                results[filename] = {"success": False, "error": str(e)}
+
+    return {
+        "success": True,
+        "files": results
+    }
+
+def save_profile(profiler, name):
+    folder = app.config['PROFILE_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    path = profiler.dump(os.path.join(folder, f"{name}.folded"))
+    log_event('profile', name=name, path=path, samples=sum(profiler.samples.values()))
+    return os.path.basename(path)
+
+def profiled(kind, func):
+    """Run a job under the sampling profiler and save the stacks as <kind>_<job id>.folded"""
+    def run(job, *args):
+        profiler = SamplingProfiler().start()
+        try:
+            return func(job, *args)
+        finally:
+            save_profile(profiler.stop(), f"{kind}_{job.id}")
+    return run
+
+def submit_job(kind, func, *args, uses=()):
+    # مع الوسيط تعمل المهمة في عقدة أخرى، فلا يمكن تحليلها من هنا
+    profile = g.get('profiler') is not None and not app.config['JOB_BROKER']
+    if profile:
+        func = profiled(kind, func)
+    try:
+        job = jobs.submit(kind, func, *args, uses=uses)
+    except QueueFullError:
+        return jsonify({"error": "Server is busy, please retry later"}), 429
+    response = {
+        "success": True,
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}"
+    }
+    if profile:
+        response["profile"] = f"{kind}_{job.id}.folded"
+    return jsonify(response), 202
+
 @app.route('/process', methods=['POST'])
 def process_file():
     try:
@@ -65,147 +644,187 @@ def process_file():
         if not data or 'filename' not in data:
             return jsonify({"error": "Invalid request data"}), 400
 
+        try:
+            options = separation_options(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         filename = data['filename']
-        input_path = os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        original_video_url = None
-        
-        print(f"\n[DEBUG] Processing file: {input_path}")
-        print(f"[DEBUG] File exists: {os.path.exists(input_path)}")
-        
+        input_path = upload_path(filename)
+        if input_path is None:
+            return jsonify({"error": "Invalid filename"}), 400
+
         if not os.path.exists(input_path):
             return jsonify({"error": f"File not found at {input_path}"}), 404
 
-        # Handle video files
-        if filename.lower().endswith('.mp4'):
-            try:
-                # Create a copy of original video for playback
-                original_video_filename = f"original_{filename}"
-                original_video_path = os.path.join(app.config['UPLOAD_FOLDER'], original_video_filename)
-                
-                print(f"[DEBUG] Copying original video: {input_path} -> {original_video_path}")
-                
-                (
-                    ffmpeg.input(input_path)
-                    .output(original_video_path, vcodec='copy', acodec='copy')
-                    .run(overwrite_output=True, quiet=True)
-                )
-                
-                original_video_url = f"/static/uploads/{original_video_filename}"
-                
-                # Convert audio to WAV for processing
-                wav_filename = f"{os.path.splitext(filename)[0]}.wav"
-                wav_path = os.path.join(app.config['UPLOAD_FOLDER'], wav_filename)
-                
-                print(f"[DEBUG] Extracting audio to WAV: {input_path} -> {wav_path}")
-                
-                (
-                    ffmpeg.input(input_path)
-                    .output(wav_path, acodec='pcm_s16le', ac=2, ar='44100')
-                    .run(overwrite_output=True, quiet=True)
-                )
-                input_path = wav_path
-                filename = wav_filename
-            except ffmpeg.Error as e:
-                error_msg = e.stderr.decode('utf8') if e.stderr else str(e)
-                print(f"[FFMPEG ERROR] {error_msg}")
-                return jsonify({"error": f"Video processing failed: {error_msg}"}), 500
-            except Exception as e:
-                return jsonify({"error": f"Video processing failed: {str(e)}"}), 500
+        if uploads.is_pending(filename):
+            return jsonify({"error": "File upload is not finished"}), 409
+
+        return submit_job('process', run_process_job, filename, input_path, options, uses=[input_path])
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/process/batch', methods=['POST'])
+def process_batch():
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('filenames'), list) or not data['filenames']:
+            return jsonify({"error": "Invalid request data"}), 400
+
+        if len(data['filenames']) > app.config['MAX_BATCH_FILES']:
+            return jsonify({"error": f"Too many files (max {app.config['MAX_BATCH_FILES']})"}), 400
 
-        track_name = os.path.splitext(filename)[0]
-        output_base = os.path.abspath(app.config['SEPARATED_FOLDER'])
-        
-        print(f"[DEBUG] Output folder: {output_base}")
-        print(f"[DEBUG] Track name: {track_name}")
-
-        # Clean previous results
-        model_path = os.path.join(output_base, 'htdemucs')
-        if os.path.exists(model_path):
-            print(f"[DEBUG] Cleaning folder: {model_path}")
-            shutil.rmtree(model_path, ignore_errors=True)
-
-        # Run Demucs command
-        command = [
-            "python", "-m", "demucs",
-            "--two-stems=vocals",
-            "--mp3",
-            "--mp3-bitrate", "192",
-            "-n", "htdemucs",
-            "--out", output_base,
-            input_path
-        ]
-
-        print(f"\n[DEBUG] Executing: {' '.join(command)}\n")
-        
         try:
-            result = subprocess.run(
-                command,
-                capture_output=True,
-                text=True,
-                check=True,
-                timeout=600
-            )
-            print("[DEBUG] Command output:")
-            print(result.stdout)
-            
-            # Check if output files were created
-            output_dir = os.path.join(model_path, track_name)
-            if not os.path.exists(output_dir):
-                raise Exception("Demucs failed to create output files")
-                
-        except subprocess.TimeoutExpired:
-            return jsonify({"error": "Processing timed out (10 minutes)"}), 500
-        except subprocess.CalledProcessError as e:
-            error_msg = f"Command failed (return code {e.returncode}):\n{e.stderr}"
-            print(f"[ERROR] {error_msg}")
-            return jsonify({"error": error_msg}), 500
-        except Exception as e:
-            error_msg = f"Processing failed: {str(e)}"
-            print(f"[ERROR] {error_msg}")
-            return jsonify({"error": error_msg}), 500
+            options = separation_options(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # Find output files
-        output_files = {}
-        stems = ['vocals', 'no_vocals']
-        
-        for stem in stems:
-            audio_path = os.path.join(model_path, track_name, f"{stem}.mp3")
-            if os.path.exists(audio_path):
-                rel_path = os.path.relpath(audio_path, start=os.path.abspath('static'))
-                output_files[stem] = "/static/" + rel_path.replace('\\', '/')
-                print(f"[DEBUG] Found: {output_files[stem]}")
+        invalid = [filename for filename in data['filenames'] if upload_path(filename) is None]
+        if invalid:
+            return jsonify({"error": "Invalid filenames", "invalid": invalid}), 400
+
+        files = []
+        missing = []
+        for filename in dict.fromkeys(data['filenames']):
+            input_path = upload_path(filename)
+            if os.path.exists(input_path) and not uploads.is_pending(filename):
+                files.append((filename, input_path))
             else:
-                print(f"[WARNING] Missing: {audio_path}")
-
-        if not output_files:
-            error_details = {
-                "error": "No output files created",
-                "command": ' '.join(command),
-                "output_folder": output_base,
-                "content": str(os.listdir(output_base))
-            }
-            return jsonify(error_details), 500
-
-        response_data = {
-            "success": True,
-            "tracks": output_files,
-            "video_url": original_video_url if original_video_url else f"/static/uploads/{filename}"
-        }
+                missing.append(filename)
+
+        if missing:
+            return jsonify({"error": "Files not found", "missing": missing}), 404
 
-        return jsonify(response_data)
+        return submit_job('batch', run_batch_job, files, options, uses=[input_path for _, input_path in files])
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
 # ... (الاستيرادات تبقى كما هي)
 
+def export_filename(export_key):
+    return f"export_{export_key}.mp4"
+
+def export_response(output_filename, output_path):
+    return {
+        "success": True,
+        "download_url": f"/static/exports/{output_filename}",
+        "file_size": os.path.getsize(output_path)
+    }
+
+def run_export_job(job, video_path, valid_tracks, volumes, export_key):
+    # إعداد مجلد التصدير
+    output_dir = os.path.abspath(app.config['EXPORT_FOLDER'])
+    os.makedirs(output_dir, exist_ok=True)
+    output_filename = export_filename(export_key)
+    output_path = os.path.join(output_dir, output_filename)
+    # إعادة تشغيل مهمة انتهت محاولتها السابقة بعد كتابة الملف
+    if os.path.exists(output_path):
+        return export_response(output_filename, output_path)
+
+    # قياسات الجهارة محفوظة منذ إنشاء المسارات، لذلك لا حاجة لتمرير loudnorm على كامل الصوت
+    job.update(stage='analyze')
+    loudness = {}
+    with stage('loudness', tracks=len(valid_tracks), volumes=volumes):
+        for track_name, track_path in valid_tracks.items():
+            try:
+                loudness[track_name] = stem_loudness(track_path)
+            except (ffmpeg.Error, ValueError) as e:
+                log_event('export_warning', reason='loudness_unavailable', track=track_name, error=str(e))
+                loudness[track_name] = {'input_i': float('-inf'), 'input_tp': float('-inf')}
+    job.check_cancelled()
+
+    # مزج المسارات الصوتية بمعاملات خطية في مرور واحد
+    coefficients, limit = mix_gains(loudness, volumes)
+
+    # مسارات الفصل تُمزج من مخرجات النموذج المحفوظة مباشرة بدل فك ترميز MP3 مرة ثانية
+    file_tracks = {}
+    pcm_parts = []
+    for track_name, track_path in valid_tracks.items():
+        parts = track_sources(track_path)
+        if parts:
+            pcm_parts.extend((part, coefficients[track_name]) for part in parts)
+        else:
+            file_tracks[track_name] = track_path
+
+    pcm = feed = None
+    if pcm_parts:
+        info = sources_info(os.path.dirname(pcm_parts[0][0]))
+        pcm = pcm_input(info['samplerate'], info['channels'])
+        feed = (block.tobytes() for block in iter_mix(pcm_parts))
+    mixed_audio = build_mix(file_tracks, coefficients, limit, pcm=pcm)
+
+    # تصدير الفيديو مع الصوت الجديد (إلى ملف مؤقت ثم إعادة تسمية ذرية)
+    # اسم فريد لكل محاولة: عقدتان قد تشغلان نفس المهمة إذا انتهى حجز الأولى وهي ما زالت تعمل
+    tmp_path = os.path.join(output_dir, f".{job.id}-{uuid.uuid4().hex[:8]}.mp4")
+    try:
+        job.update(stage='encode')
+        with stage('export_encode', tracks=len(valid_tracks), limit=limit, output=output_path):
+            run_with_progress(
+                ffmpeg.output(
+                    # مسار الفيديو اختياري: الملفات المرفوعة قد تكون صوتية فقط (mp3/wav)
+                    ffmpeg.input(video_path)['v?'],
+                    mixed_audio,
+                    tmp_path,
+                    vcodec='copy',
+                    acodec='aac',
+                    audio_bitrate='192k',
+                    preset='fast',
+                    movflags='faststart'
+                ),
+                duration=probe_duration(video_path),
+                progress=lambda percent: job.update(progress=percent),
+                job=job,
+                feed=feed
+            )
+        os.replace(tmp_path, output_path)
+        storage.track(output_path, f"job:{job.id}")
+        BYTES_PROCESSED.inc(os.path.getsize(output_path), kind='export')
+    except ffmpeg.Error as e:
+        job.check_cancelled()
+        error_msg = e.stderr.decode('utf8') if e.stderr else str(e)
+        log_event('export_error', reason='ffmpeg', error=error_msg)
+        raise Exception(
+            "Video export failed: " + (error_msg.splitlines()[0] if error_msg else "Unknown ffmpeg error")
+        )
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # التحقق من وجود الملف المصدر
+    if not os.path.exists(output_path):
+        raise Exception("Export failed - output file not created")
+
+    log_event('export_done', path=output_path, size=os.path.getsize(output_path))
+    return export_response(output_filename, output_path)
+
+# دوال المهام حسب النوع، تستخدمها عقد المعالجة لتشغيل المهام القادمة من الوسيط
+TASKS = {
+    'process': run_process_job,
+    'batch': run_batch_job,
+    'export': run_export_job
+}
+
 @app.route('/export', methods=['POST'])
 def export_video():
     try:
-        # تسجيل بيانات الطلب الواردة لأغراض التصحيح
-        print(f"\n[EXPORT] Received request with data: {request.data}")
-        
         # التحقق من نوع المحتوى
         if request.content_type != 'application/json':
             return jsonify({"error": "Content-Type must be application/json"}), 400
@@ -213,14 +832,12 @@ def export_video():
         try:
             data = request.get_json()
         except Exception as e:
-            print(f"[EXPORT ERROR] JSON parsing failed: {str(e)}")
+            log_event('export_rejected', reason='invalid_json', error=str(e))
             return jsonify({
                 "error": "Invalid JSON data",
                 "details": str(e)
             }), 400
 
-        print(f"[EXPORT] Parsed data: {data}")
-
         # التحقق من الحقول المطلوبة
         required_fields = ['video_url', 'tracks']
         for field in required_fields:
@@ -243,95 +860,177 @@ def export_video():
             normalized_url = track_url.replace('http://localhost:5000', '') if 'http://localhost:5000' in track_url else track_url
             
             if not isinstance(normalized_url, str) or not normalized_url.startswith('/static/'):
-                print(f"[EXPORT WARNING] Invalid track URL for {track_name}: {track_url}")
+                log_event('export_warning', reason='invalid_track_url', track=track_name, url=track_url)
                 continue
                 
             track_path = os.path.abspath('.' + normalized_url)
             if os.path.exists(track_path):
                 valid_tracks[track_name] = track_path
             else:
-                print(f"[EXPORT WARNING] Track file not found: {track_path}")
+                log_event('export_warning', reason='track_not_found', track=track_name, path=track_path)
 
         if not valid_tracks:
             return jsonify({"error": "No valid audio tracks found"}), 400
 
-        # إعداد مجلد التصدير
-        output_dir = os.path.abspath(app.config['EXPORT_FOLDER'])
-        os.makedirs(output_dir, exist_ok=True)
-        output_filename = f"export_{datetime.now().timestamp()}.mp4"
-        output_path = os.path.join(output_dir, output_filename)
-        
         # معالجة مستويات الصوت
-        audio_inputs = []
-        volumes = data.get('volumes', {})
-        
-        for track_name, track_path in valid_tracks.items():
+        volumes = {}
+        requested_volumes = data.get('volumes') or {}
+        for track_name in valid_tracks:
             try:
-                volume = float(volumes.get(track_name, 1.0))
-                audio_inputs.append(
-                    ffmpeg.input(track_path).filter('volume', volume)
-                )
-                print(f"[EXPORT] Processing track: {track_name} with volume {volume}")
+                volumes[track_name] = float(requested_volumes.get(track_name, 1.0))
             except (ValueError, TypeError) as e:
-                print(f"[EXPORT WARNING] Invalid volume for {track_name}, using default. Error: {str(e)}")
-                audio_inputs.append(ffmpeg.input(track_path))
+                log_event('export_warning', reason='invalid_volume', track=track_name, error=str(e))
+                volumes[track_name] = 1.0
 
-        # مزج المسارات الصوتية
-        if len(audio_inputs) == 1:
-            mixed_audio = audio_inputs[0]
-        else:
-            mixed_audio = ffmpeg.filter(audio_inputs, 'amix')
+        # نفس الفيديو والمسارات ومستويات الصوت => نفس الملف المصدر سابقاً
+        key = export_key(video_path, valid_tracks, volumes)
+        output_path = os.path.join(os.path.abspath(app.config['EXPORT_FOLDER']), export_filename(key))
+        if os.path.exists(output_path):
+            log_event('export_reused', path=output_path)
+            storage.touch(output_path)
+            return jsonify(export_response(export_filename(key), output_path))
 
-        # تطبيع الصوت
-        mixed_audio = mixed_audio.filter('loudnorm')
+        uses = [video_path, *valid_tracks.values()]
+        for track_path in valid_tracks.values():
+            uses.extend(track_sources(track_path) or ())
+        return submit_job('export', run_export_job, video_path, valid_tracks, volumes, key, uses=uses)
 
-        # تصدير الفيديو مع الصوت الجديد
-        try:
-            print(f"[EXPORT] Starting video export to {output_path}")
-            (
-                ffmpeg.input(video_path)
-                .output(
-                    mixed_audio,
-                    output_path,
-                    vcodec='copy',
-                    acodec='aac',
-                    audio_bitrate='192k',
-                    preset='fast',
-                    movflags='faststart'
-                )
-                .run(overwrite_output=True, quiet=True)
-            )
-            print("[EXPORT] Video export completed successfully")
-        except ffmpeg.Error as e:
-            error_msg = e.stderr.decode('utf8') if e.stderr else str(e)
-            print(f"[EXPORT ERROR] FFmpeg failed: {error_msg}")
-            return jsonify({
-                "error": "Video export failed",
-                "details": error_msg.splitlines()[0] if error_msg else "Unknown ffmpeg error"
-            }), 500
-
-        # التحقق من وجود الملف المصدر
-        if not os.path.exists(output_path):
-            error_msg = "Export failed - output file not created"
-            print(f"[EXPORT ERROR] {error_msg}")
-            return jsonify({"error": error_msg}), 500
-
-        print(f"[EXPORT] Export successful. File size: {os.path.getsize(output_path)} bytes")
-        return jsonify({
-            "success": True,
-            "download_url": f"/static/exports/{output_filename}",
-            "file_size": os.path.getsize(output_path)
-        })
-        
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
-        print(f"[EXPORT CRITICAL ERROR] {error_msg}")
+        log_event('export_error', reason='unexpected', error=error_msg)
         traceback.print_exc()
         return jsonify({
             "error": "Internal server error",
             "details": error_msg
         }), 500
 
+def static_path(url):
+    """Map a /static/... URL to a file path inside the static folder, or None if it escapes it"""
+    if not isinstance(url, str):
+        return None
+    url = url.replace('http://localhost:5000', '')
+    if not url.startswith('/static/'):
+        return None
+    static_root = os.path.abspath('static')
+    path = os.path.abspath('.' + url)
+    if os.path.commonpath([static_root, path]) != static_root:
+        return None
+    return path
+
+def count_preview_pcm(pcm_path):
+    """ملف PCM المفكوك للمعاينة يُحسب ضمن حجم النتيجة في الذاكرة المؤقتة (LRU والحد الأقصى)"""
+    directory = os.path.dirname(os.path.abspath(pcm_path))
+    if directory == cache.path(os.path.basename(directory)):
+        cache.refresh_size(os.path.basename(directory))
+
+@app.route('/preview', methods=['GET'])
+def preview_mix():
+    try:
+        tracks = json.loads(request.args.get('tracks', '{}'))
+        volumes = json.loads(request.args.get('volumes', '{}'))
+        if not isinstance(tracks, dict) or not isinstance(volumes, dict):
+            raise ValueError("tracks and volumes must be JSON objects")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid preview parameters: {str(e)}"}), 400
+
+    # مقطع قصير مضغوط يبدأ من start: المشغل في صفحة النتائج يطلب المقاطع المتتالية أثناء التشغيل
+    fmt = request.args.get('format')
+    chunk = fmt in CHUNK_FORMATS
+    if fmt not in (None, 'wav') and not chunk:
+        return jsonify({"error": f"Unsupported preview format: {fmt}"}), 400
+    if chunk:
+        try:
+            start = float(request.args.get('start', 0))
+            duration = float(request.args.get('duration', 5))
+        except ValueError:
+            return jsonify({"error": "Invalid start or duration"}), 400
+        # inf و nan تمر من float() لكنها لا تتحول إلى عدد إطارات
+        if not (math.isfinite(start) and math.isfinite(duration)) or duration <= 0:
+            return jsonify({"error": "Invalid start or duration"}), 400
+        start = max(0.0, start)
+        duration = min(duration, app.config['MAX_PREVIEW_CHUNK'])
+
+    # مسارات الذاكرة المؤقتة تُمزج من مخرجات النموذج (float16) مباشرة دون فك ترميز
+    stems = {}
+    for track_name, track_url in tracks.items():
+        track_path = static_path(track_url)
+        if track_path and os.path.exists(track_path):
+            stems[track_name] = (track_path, track_sources(track_path))
+
+    if not stems:
+        return jsonify({"error": "No valid audio tracks found"}), 400
+
+    try:
+        mix = PreviewMix(stems, volumes, on_decoded=count_preview_pcm)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid volume: {str(e)}"}), 400
+    except ffmpeg.Error as e:
+        error_msg = e.stderr.decode('utf8') if e.stderr else str(e)
+        return jsonify({"error": f"Preview decoding failed: {error_msg}"}), 500
+
+    if chunk:
+        if start >= mix.duration:
+            return jsonify({"error": "Start is past the end of the mix"}), 416
+        try:
+            audio = mix.encode(start, duration, fmt)
+        except ffmpeg.Error as e:
+            error_msg = e.stderr.decode('utf8') if e.stderr else str(e)
+            return jsonify({"error": f"Preview encoding failed: {error_msg}"}), 500
+        return Response(audio, mimetype=MIMETYPES[fmt], headers={'Cache-Control': 'no-store'})
+
+    # ملف WAV افتراضي كامل الطول يدعم التقديم عبر HTTP Range (لأدوات لا تدعم المقاطع)
+    headers = {'Accept-Ranges': 'bytes', 'Cache-Control': 'no-store'}
+    start, stop, status = 0, mix.size, 200
+    if request.range is not None:
+        bounds = request.range.range_for_length(mix.size)
+        if bounds is None:
+            headers['Content-Range'] = f"bytes */{mix.size}"
+            return Response(status=416, headers=headers)
+        start, stop = bounds
+        status = 206
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{mix.size}"
+    headers['Content-Length'] = str(stop - start)
+
+    return Response(
+        stream_with_context(mix.iter_bytes(start, stop)),
+        status=status,
+        mimetype='audio/wav',
+        headers=headers
+    )
+
+@app.route('/download', methods=['GET'])
+def download_stem():
+    """تحميل مسار بالصيغة المطلوبة؛ كل صيغة تُرمّز مرة واحدة عند أول طلب ثم تُحفظ"""
+    fmt = request.args.get('format', 'mp3')
+    if fmt not in FORMATS:
+        return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+
+    track_path = static_path(request.args.get('track'))
+    layout = cached_layout(track_path) if track_path and os.path.exists(track_path) else None
+    if layout is None:
+        return jsonify({"error": "Track not found"}), 404
+    key, name, stems = layout
+    used = [path for stem_path, parts in stems.values() for path in [stem_path, *(parts or ())]]
+
+    try:
+        with storage.pin(*used), cache.lock(key):
+            with stage('encode_format', format=fmt, stems=len(stems)):
+                outputs = encoder.encode(stems, fmt)
+            cache.refresh_size(key)
+    except (RuntimeError, ffmpeg.Error) as e:
+        log_event('encode_failed', key=key, format=fmt, error=str(e))
+        return jsonify({"error": f"Encoding to {fmt} failed"}), 500
+
+    # نفس المفتاح ونفس الصيغة => نفس المحتوى دائماً
+    return media.send(
+        outputs[name],
+        mimetype=MIMETYPES[fmt],
+        as_attachment=True,
+        download_name=f"{name}.{fmt}",
+        max_age=app.config['STATIC_MAX_AGE'],
+        immutable=True
+    )
+
 @app.route('/results')
 def results():
     try:
@@ -352,20 +1051,44 @@ def results():
         return render_template(
             'results.html',
             tracks=tracks_data,
+            formats=FORMATS,
             video_url=video_url if video_url != 'undefined' else None
         )
     except Exception as e:
         return jsonify({"error": f"Results processing failed: {str(e)}"}), 400
 
-@app.route('/static/<path:filename>')
+def immutable_static(path):
+    """
+    ملفات لا يتغير محتواها تحت نفس الرابط: مفاتيح محتوى أو أسماء فريدة بختم زمني
+
+    ما زال يُكتب لا يُعتبر ثابتاً: رفع لم يكتمل، ومجلدات staging والملفات المؤقتة المخفية
+    (مثل المسارات الجزئية أثناء الفصل المتدفق).
+    """
+    path = os.path.abspath(path)
+    for root in (cache.root, os.path.abspath(app.config['EXPORT_FOLDER']), os.path.abspath(app.config['UPLOAD_FOLDER'])):
+        if os.path.commonpath([root, path]) != root:
+            continue
+        if any(part.startswith('.') for part in os.path.relpath(path, root).split(os.sep)):
+            return False
+        return not upload_in_progress(path)
+    return False
+
+@app.endpoint('static')
 def static_files(filename):
     # Security check
     if '..' in filename or filename.startswith('/'):
         return jsonify({"error": "Invalid file path"}), 400
-        
-    return send_from_directory('static', filename)
+
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"error": "File not found"}), 404
+
+    immutable = immutable_static(path)
+    return media.send(path, max_age=app.config['STATIC_MAX_AGE'] if immutable else None, immutable=immutable)
 
 if __name__ == "__main__":
     import os
+    # خيط التنظيف يبدأ في عملية الخادم فقط، لا في العمليات العاملة التي تستورد هذا الملف عند spawn
+    storage.start()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=True)
@@ -0,0 +1,300 @@
+"""
+قياس أداء مراحل المعالجة: الاستيراد، الفصل، المعالجة الصوتية، التصدير والدمج
+
+يولّد ملفات اختبار محلياً عبر ffmpeg (sine / anoisesrc / testsrc) ويقيس كل مرحلة
+في عملية منفصلة: زمن التنفيذ، زمن المعالج، أقصى ذاكرة، وحجم الملفات المكتوبة.
+
+    python -m benchmarks.run --model stub --duration 30 --output bench.json
+    python -m benchmarks.run --compare old.json new.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+# === الملفات التجريبية ===
+def make_fixtures(workdir, duration):
+    """توليد ملف صوتي (نغمة + ضجيج) وفيديو testsrc بنفس الصوت"""
+    audio_path = os.path.join(workdir, 'fixture.wav')
+    video_path = os.path.join(workdir, 'fixture.mp4')
+    subprocess.run([
+        'ffmpeg', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f"sine=frequency=220:duration={duration}:sample_rate=44100",
+        '-f', 'lavfi', '-i', f"anoisesrc=duration={duration}:amplitude=0.05:sample_rate=44100",
+        '-filter_complex', 'amix=inputs=2,aformat=channel_layouts=stereo',
+        audio_path
+    ], check=True)
+    subprocess.run([
+        'ffmpeg', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc=duration={duration}:size=640x360:rate=25",
+        '-i', audio_path,
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest',
+        video_path
+    ], check=True)
+    # نفس الإشارة لكن مسموعة 5 ثوانٍ من كل 20 (مثل محاضرة أو تسجيل بفترات صمت طويلة)
+    sparse_path = os.path.join(workdir, 'fixture_sparse.wav')
+    subprocess.run([
+        'ffmpeg', '-loglevel', 'error', '-y',
+        '-i', audio_path,
+        '-af', "volume=volume='if(lt(mod(t,20),5),1,0)':eval=frame",
+        sparse_path
+    ], check=True)
+    return {'audio': audio_path, 'video': video_path, 'sparse': sparse_path}
+
+
+# === المراحل ===
+def stage_ingest(ctx):
+    from utils.ffmpeg_utils import decode_to_shared_memory
+
+    shm, frames, fingerprint = decode_to_shared_memory(ctx['video'])
+    shm.close()
+    shm.unlink()
+    return {'frames': frames}
+
+
+def stage_ingest_wav(ctx):
+    """المسار القديم: فك ترميز الفيديو إلى WAV على القرص"""
+    import ffmpeg
+
+    (
+        ffmpeg.input(ctx['video'])
+        .output(os.path.join(ctx['stage_dir'], 'extract.wav'), acodec='pcm_s16le', ac=2, ar='44100')
+        .run(overwrite_output=True, quiet=True)
+    )
+
+
+def stage_separation(ctx, audio_key='audio'):
+    from utils.separator import SeparationEngine
+
+    engine = SeparationEngine(ctx['model'], workers=1, silence=(-50.0, 4.0))
+    try:
+        started = time.perf_counter()
+        engine.warmup()
+        load_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        stems = engine.separate(ctx[audio_key], ctx['stage_dir'], two_stems='vocals', mp3_bitrate=192)
+        separate_seconds = time.perf_counter() - started
+    finally:
+        # انتظار العمليات العاملة حتى يُحتسب استهلاكها في RUSAGE_CHILDREN
+        engine.shutdown(wait=True)
+
+    return {
+        'model_load_s': round(load_seconds, 3),
+        'separate_s': round(separate_seconds, 3),
+        'realtime_factor': round(ctx['duration'] / separate_seconds, 2),
+        'stems': sorted(stems)
+    }
+
+
+def stage_separation_sparse(ctx):
+    """الفصل على ملف معظمه صمت: يقيس ما يوفره تخطي النموذج في فترات الصمت"""
+    return stage_separation(ctx, 'sparse')
+
+
+def stage_stem_discovery(ctx):
+    from utils.cache import ResultCache
+
+    cache = ResultCache(os.path.join(ctx['stage_dir'], 'cache'), 1 << 40)
+    staging = cache.staging_dir()
+    stems = {}
+    for name in ('vocals', 'no_vocals'):
+        stems[name] = os.path.join(staging, f"{name}.mp3")
+        shutil.copy(ctx['audio'], stems[name])
+    cache.commit('bench', staging, stems)
+
+    started = time.perf_counter()
+    for _ in range(1000):
+        cache.get('bench')
+    return {'lookup_us': round((time.perf_counter() - started) * 1000, 2)}
+
+
+def stage_dsp(ctx):
+    from utils.audio_utils import separate_tracks
+
+    success, tracks = separate_tracks(ctx['audio'], ctx['stage_dir'], 'fixture.wav')
+    if not success:
+        raise RuntimeError("separate_tracks failed")
+    return {'tracks': len(tracks)}
+
+
+def stage_export(ctx):
+    import ffmpeg
+    from utils.exporter import precompute_loudness, mix_gains, build_mix
+
+    tracks = {}
+    for name in ('vocals', 'no_vocals'):
+        tracks[name] = os.path.join(ctx['stage_dir'], f"{name}.wav")
+        shutil.copy(ctx['audio'], tracks[name])
+
+    started = time.perf_counter()
+    loudness = precompute_loudness(tracks)
+    analyze_seconds = time.perf_counter() - started
+
+    coefficients, limit = mix_gains(loudness, {'vocals': 1.0, 'no_vocals': 0.5})
+    (
+        ffmpeg.output(
+            ffmpeg.input(ctx['video']).video,
+            build_mix(tracks, coefficients, limit),
+            os.path.join(ctx['stage_dir'], 'export.mp4'),
+            vcodec='copy', acodec='aac', audio_bitrate='192k', movflags='faststart'
+        )
+        .run(overwrite_output=True, quiet=True)
+    )
+    return {'analyze_s': round(analyze_seconds, 3)}
+
+
+def stage_merge(ctx):
+    from utils.video_merger import merge_tracks
+
+    merge_tracks(ctx['video'], [ctx['audio']], ctx['stage_dir'])
+
+
+STAGES = {
+    'ingest': stage_ingest,
+    'ingest_wav': stage_ingest_wav,
+    'separation': stage_separation,
+    'separation_sparse': stage_separation_sparse,
+    'stem_discovery': stage_stem_discovery,
+    'dsp': stage_dsp,
+    'export': stage_export,
+    'merge': stage_merge,
+}
+
+
+# === القياس ===
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def _cpu_seconds():
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self_usage.ru_utime + self_usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _measure(name, ctx, queue):
+    """تشغيل مرحلة واحدة داخل عملية جديدة حتى تكون أقصى ذاكرة خاصة بها"""
+    os.makedirs(ctx['stage_dir'], exist_ok=True)
+    cpu_before = _cpu_seconds()
+    started = time.perf_counter()
+    try:
+        extra = STAGES[name](ctx) or {}
+        result = {'ok': True}
+    except Exception as e:
+        extra = {}
+        result = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result.update({
+        'wall_s': round(time.perf_counter() - started, 3),
+        'cpu_s': round(_cpu_seconds() - cpu_before, 3),
+        # ru_maxrss بالكيلوبايت على لينكس
+        'peak_rss_mb': round(max(self_usage.ru_maxrss, children.ru_maxrss) / 1024, 1),
+        'bytes_written': _dir_size(ctx['stage_dir']),
+        **extra
+    })
+    queue.put(result)
+
+
+def run_stage(name, ctx):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(name, {**ctx, 'stage_dir': os.path.join(ctx['workdir'], name)}, queue))
+    process.start()
+    process.join()
+    if queue.empty():
+        return {'ok': False, 'error': f"stage process exited with code {process.exitcode}"}
+    return queue.get()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path):
+    """طباعة نسبة التغير لكل مرحلة بين تشغيلين"""
+    with open(old_path, encoding='utf8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf8') as f:
+        new = json.load(f)
+    print(f"{'stage':<16}{'metric':<16}{old.get('commit') or 'old':>12}{new.get('commit') or 'new':>12}{'change':>10}")
+    for stage, metrics in new['stages'].items():
+        previous = old['stages'].get(stage, {})
+        for metric in ('wall_s', 'cpu_s', 'peak_rss_mb', 'bytes_written'):
+            if metric in metrics and metric in previous and previous[metric]:
+                change = (metrics[metric] - previous[metric]) / previous[metric] * 100
+                print(f"{stage:<16}{metric:<16}{previous[metric]:>12}{metrics[metric]:>12}{change:>9.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ingest/separation/DSP/export hot paths")
+    parser.add_argument('--duration', type=float, default=30, help="Fixture length in seconds")
+    parser.add_argument('--model', default='stub', help="Separation model ('stub' runs offline without weights)")
+    parser.add_argument('--stages', default=','.join(STAGES), help="Comma separated list of stages")
+    parser.add_argument('--output', help="Write results to this JSON file")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Compare two result files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        ctx = {'workdir': workdir, 'duration': args.duration, 'model': args.model}
+        ctx.update(make_fixtures(workdir, args.duration))
+
+        results = {
+            'commit': git_commit(),
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'params': {'duration': args.duration, 'model': args.model},
+            'stages': {}
+        }
+        for name in args.stages.split(','):
+            result = run_stage(name, ctx)
+            results['stages'][name] = result
+            status = f"{result['wall_s']}s wall, {result['peak_rss_mb']} MB" if result['ok'] else result['error']
+            print(f"[BENCH] {name}: {status}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
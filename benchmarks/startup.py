@@ -0,0 +1,151 @@
+"""
+قياس زمن بدء التطبيق والذاكرة: استيراد app.py في عملية جديدة مع -X importtime
+
+يُظهر المكتبات الثقيلة التي حُمّلت والوحدات الأبطأ استيراداً. مع --rev تُقاس نسخة
+سابقة من المستودع (عبر git archive) بنفس الطريقة للمقارنة قبل/بعد.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --rev HEAD~1 --repeat 5
+    python -m benchmarks.startup --module utils.audio_utils --output startup.json
+"""
+import io
+import os
+import sys
+import json
+import shutil
+import tarfile
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# مكتبات يجب ألا تُحمّل في عملية الويب (مكانها عمليات الفصل والمعالجة فقط)
+HEAVY_MODULES = ('torch', 'demucs', 'librosa', 'scipy', 'noisereduce', 'pydub', 'numpy')
+
+# الاستيراد فقط: بدون خيط تنظيف أو تحميل نماذج
+ENV = {'STORAGE_JANITOR_INTERVAL': '0', 'WARMUP': '0'}
+
+PROBE = """
+import sys, time, json, resource
+started = time.perf_counter()
+import {module}
+print(json.dumps({{
+    'import_s': time.perf_counter() - started,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': sorted(sys.modules)
+}}))
+"""
+
+
+def parse_importtime(stderr):
+    """{اسم الوحدة: (الزمن الذاتي، الزمن التراكمي) بالميكروثانية} من مخرجات -X importtime"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def measure_once(source_dir, module):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(module=module)],
+        cwd=source_dir,
+        env={**os.environ, **ENV},
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        raise RuntimeError(error[-1] if error else f"exit code {result.returncode}")
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    probe['importtime'] = parse_importtime(result.stderr)
+    return probe
+
+
+def measure(source_dir, module, repeat, top):
+    runs = [measure_once(source_dir, module) for _ in range(repeat)]
+    last = runs[-1]
+    slowest = sorted(
+        ((name, cumulative) for name, (_, cumulative) in last['importtime'].items() if name != module),
+        key=lambda item: item[1],
+        reverse=True
+    )[:top]
+    return {
+        'import_s': round(statistics.median(run['import_s'] for run in runs), 3),
+        'import_s_min': round(min(run['import_s'] for run in runs), 3),
+        'rss_mb': round(statistics.median(run['rss_mb'] for run in runs), 1),
+        'modules': len(last['modules']),
+        'heavy': [name for name in HEAVY_MODULES if name in last['modules']],
+        'slowest': [(name, round(cumulative / 1000, 1)) for name, cumulative in slowest]
+    }
+
+
+def export_revision(rev, workdir):
+    """نسخة من ملفات المستودع كما كانت في rev (بدون ملفات static الكبيرة)"""
+    archive = subprocess.run(
+        ['git', 'archive', '--format=tar', rev, '--', '.', ':(exclude)static'],
+        cwd=ROOT, capture_output=True, check=True
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(workdir)
+    return workdir
+
+
+def report(label, result):
+    if 'error' in result:
+        print(f"[STARTUP] {label}: failed - {result['error']}")
+        return
+    print(
+        f"[STARTUP] {label}: import {result['import_s']}s (min {result['import_s_min']}s), "
+        f"{result['rss_mb']} MB, {result['modules']} modules, heavy: {', '.join(result['heavy']) or 'none'}"
+    )
+    for name, milliseconds in result['slowest']:
+        print(f"    {milliseconds:>9.1f} ms  {name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold import time and memory of the web app")
+    parser.add_argument('--module', default='app', help="Module to import (default: app)")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of fresh interpreters per measurement")
+    parser.add_argument('--top', type=int, default=10, help="Number of slowest imports to show")
+    parser.add_argument('--rev', help="Also measure this git revision (e.g. HEAD~1) for a before/after comparison")
+    parser.add_argument('--output', help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    targets = {}
+    workdir = None
+    try:
+        if args.rev:
+            workdir = tempfile.mkdtemp(prefix='startup-')
+            targets[args.rev] = export_revision(args.rev, workdir)
+        targets['working tree'] = ROOT
+
+        results = {}
+        for label, source_dir in targets.items():
+            try:
+                results[label] = measure(source_dir, args.module, max(1, args.repeat), args.top)
+            except (RuntimeError, ValueError) as e:
+                results[label] = {'error': str(e)}
+            report(label, results[label])
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.rev and all('error' not in result for result in results.values()):
+        before, after = results[args.rev], results['working tree']
+        for metric in ('import_s', 'rss_mb'):
+            change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+            print(f"[STARTUP] {metric}: {before[metric]} -> {after[metric]} ({change:+.1f}%)")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump({'module': args.module, 'python': sys.version.split()[0], 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
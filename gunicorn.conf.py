@@ -0,0 +1,33 @@
+import os
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+
+# جلسات الرفع على القرص، والمهام في JOB_BROKER إذا وُجد، فيمكن لأي عملية ويب خدمة أي طلب.
+# بدون وسيط تبقى المهام في ذاكرة العملية (ومعها مجموعات عمليات الفصل)، لذلك عملية واحدة بعدة خيوط:
+# العمل الثقيل يتم في مجموعات عمليات الفصل والترميز، والخيوط هنا تنتظر فقط.
+job_broker = os.environ.get('JOB_BROKER', '')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, os.cpu_count() or 1) if job_broker else 1))
+if workers > 1 and not job_broker:
+    # طلب /status قد يصل إلى عملية لا تعرف المهمة
+    raise RuntimeError("WEB_CONCURRENCY > 1 requires JOB_BROKER (jobs are kept in process memory without it)")
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
+
+# تحميل التطبيق بعد fork: torch ومجموعات العمليات لا تعمل بشكل صحيح إذا أُنشئت قبله
+preload_app = False
+
+# يشمل وقت تحميل النماذج في wsgi.py قبل أول طلب
+timeout = int(os.environ.get('WEB_TIMEOUT', 300))
+graceful_timeout = 30
+keepalive = 5
+
+# ملفات send_file تُرسل بـ sendfile() بدون نسخ إلى ذاكرة بايثون
+sendfile = True
+
+accesslog = '-'
+errorlog = '-'
+
+
+def worker_exit(server, worker):
+    from app import shutdown
+    shutdown()
@@ -1,8 +1,20 @@
+// المزيج يُشغّل كمقاطع قصيرة مضغوطة من /preview بدل ملف WAV كامل الطول
+// طول كل مقطع بالثواني، ومتى يُطلب المقطع التالي قبل الحاجة إليه
+const PREVIEW_CHUNK = 10;
+const PREVIEW_LOOKAHEAD = 4;
+// تداخل بين المقاطع المتتالية (ومدة الانتقال عند تغيير المستوى) لإخفاء أي فرق عند الحدود
+const PREVIEW_FADE = 0.03;
 
-export class AudioEditor {
+class AudioEditor {
     constructor() {
         this.video = document.getElementById('mainVideo');
         this.tracks = {};
+        // Opus يُفك بلا فجوات بين المقاطع؛ MP3 للمتصفحات التي لا تدعمه
+        this.format = new Audio().canPlayType('audio/ogg; codecs=opus') ? 'opus' : 'mp3';
+        this.context = null;
+        this.sources = [];
+        this.session = 0;
+        this.mixTimer = null;
         this.initTracks();
         this.setupEventListeners();
     }
@@ -14,20 +26,22 @@ export class AudioEditor {
                 `/static/separated/${trackName}.mp3`;
 
             this.tracks[trackName] = {
-                element: new Audio(trackUrl),
+                url: trackUrl,
                 muteBtn: trackElement.querySelector('.mute-btn'),
                 volumeSlider: trackElement.querySelector('.volume-slider'),
+                volume: 1,
                 isMuted: false
             };
         });
     }
 
     setupEventListeners() {
-        // أحداث الفيديو
-        this.video.addEventListener('play', () => this.syncPlayback());
-        this.video.addEventListener('pause', () => this.pauseAll());
-        this.video.addEventListener('seeked', () => this.syncTime());
-        this.video.addEventListener('timeupdate', () => this.syncTime());
+        // أحداث الفيديو: الفيديو هو الساعة المرجعية والمزيج يتبعه
+        this.video.addEventListener('play', () => this.startMix());
+        this.video.addEventListener('pause', () => this.stopMix());
+        this.video.addEventListener('seeking', () => this.stopMix());
+        this.video.addEventListener('seeked', () => this.startMix());
+        this.video.addEventListener('ended', () => this.stopMix());
 
         // أحداث التحكم في المسارات
         Object.keys(this.tracks).forEach(trackName => {
@@ -40,10 +54,6 @@ export class AudioEditor {
             track.volumeSlider.addEventListener('input', (e) => {
                 this.setVolume(trackName, e.target.value);
             });
-
-            track.element.addEventListener('error', () => {
-                this.handleTrackError(trackName);
-            });
         });
 
         // زر التصدير
@@ -52,32 +62,155 @@ export class AudioEditor {
         });
     }
 
-    syncPlayback() {
-        this.syncTime();
-        Object.values(this.tracks).forEach(track => {
-            track.element.play().catch(e => console.error('Play error:', e));
+    trackUrls() {
+        const tracksData = {};
+        Object.keys(this.tracks).forEach(trackName => {
+            // الحصول على المسار النسبي فقط (إزالة النطاق إذا موجود)
+            tracksData[trackName] = this.tracks[trackName].url.replace(window.location.origin, '');
         });
+        return tracksData;
+    }
+
+    trackVolumes() {
+        const volumesData = {};
+        Object.keys(this.tracks).forEach(trackName => {
+            const track = this.tracks[trackName];
+            volumesData[trackName] = track.isMuted ? 0 : Number(track.volume);
+        });
+        return volumesData;
+    }
+
+    updateMix(delay = 150) {
+        // تجميع الحركات السريعة للمؤشر في طلب واحد؛ المقطع الحالي يستمر حتى يصل المقطع بالمستويات الجديدة
+        clearTimeout(this.mixTimer);
+        this.mixTimer = setTimeout(() => this.startMix(false), delay);
+    }
+
+    startMix(stopCurrent = true) {
+        if (this.video.paused || this.video.seeking) {
+            return;
+        }
+        if (!this.context) {
+            this.context = new (window.AudioContext || window.webkitAudioContext)();
+        }
+        this.context.resume();
+        if (stopCurrent) {
+            this.stopSources(this.sources);
+        }
+        const session = ++this.session;
+        this.pump(session, this.video.currentTime).catch(error => this.handleMixError(session, error));
+    }
+
+    stopMix() {
+        this.session++;
+        this.stopSources(this.sources);
     }
 
-    pauseAll() {
-        Object.values(this.tracks).forEach(track => {
-            track.element.pause();
+    stopSources(sources, when = 0) {
+        sources.forEach(source => {
+            if (when) {
+                // انتقال قصير إلى المقطع الجديد بدل قطع مفاجئ
+                source.gain.gain.cancelScheduledValues(when);
+                source.gain.gain.setTargetAtTime(0, when, PREVIEW_FADE / 3);
+                source.node.stop(when + PREVIEW_FADE);
+            } else {
+                source.node.stop();
+            }
         });
+        this.sources = this.sources.filter(source => !sources.includes(source));
     }
 
-    syncTime() {
-        const currentTime = this.video.currentTime;
-        Object.values(this.tracks).forEach(track => {
-            if (Math.abs(track.element.currentTime - currentTime) > 0.1) {
-                track.element.currentTime = currentTime;
+    async pump(session, position) {
+        // base يحول زمن الفيديو إلى زمن AudioContext؛ يُحسب مرة واحدة حتى تتصل المقاطع دون فجوات
+        let base = null;
+        while (session === this.session) {
+            const buffer = await this.fetchChunk(position);
+            if (session !== this.session || !buffer) {
+                return;
+            }
+            if (base === null) {
+                base = this.context.currentTime - this.video.currentTime;
             }
+            this.schedule(buffer, base + position, session);
+            position += PREVIEW_CHUNK;
+            await this.waitForVideo(position - PREVIEW_LOOKAHEAD, session);
+        }
+    }
+
+    async fetchChunk(position) {
+        const params = new URLSearchParams({
+            tracks: JSON.stringify(this.trackUrls()),
+            volumes: JSON.stringify(this.trackVolumes()),
+            format: this.format,
+            start: position.toFixed(3),
+            duration: PREVIEW_CHUNK + PREVIEW_FADE
+        });
+        const response = await fetch(`/preview?${params}`);
+        if (response.status === 416) {
+            // نهاية المزيج
+            return null;
+        }
+        if (!response.ok) {
+            throw new Error(`Preview request failed (${response.status})`);
+        }
+        return this.context.decodeAudioData(await response.arrayBuffer());
+    }
+
+    schedule(buffer, when, session) {
+        const context = this.context;
+        let offset = 0;
+        if (when < context.currentTime) {
+            // وصل المقطع بعد موعده: يبدأ من الموضع الحالي للفيديو
+            offset = context.currentTime - when;
+            when = context.currentTime;
+        }
+        const length = Math.min(buffer.duration, PREVIEW_CHUNK + PREVIEW_FADE) - offset;
+        if (length <= PREVIEW_FADE) {
+            return;
+        }
+
+        // مقاطع الجلسة السابقة (قبل تغيير المستوى) تتلاشى عند بدء هذا المقطع
+        this.stopSources(this.sources.filter(source => source.session !== session), when);
+
+        const gain = context.createGain();
+        const node = context.createBufferSource();
+        node.buffer = buffer;
+        node.connect(gain);
+        gain.connect(context.destination);
+
+        const end = when + length;
+        gain.gain.setValueAtTime(0, when);
+        gain.gain.linearRampToValueAtTime(1, when + PREVIEW_FADE);
+        gain.gain.setValueAtTime(1, end - PREVIEW_FADE);
+        gain.gain.linearRampToValueAtTime(0, end);
+        node.start(when, offset);
+        node.stop(end);
+
+        const source = { node, gain, session };
+        node.onended = () => {
+            this.sources = this.sources.filter(item => item !== source);
+        };
+        this.sources.push(source);
+    }
+
+    waitForVideo(time, session) {
+        // ينتهي عند وصول الفيديو إلى time أو عند إيقافه أو بدء جلسة جديدة
+        const events = ['timeupdate', 'pause', 'seeking'];
+        return new Promise(resolve => {
+            const check = () => {
+                if (session !== this.session || this.video.paused || this.video.currentTime >= time) {
+                    events.forEach(name => this.video.removeEventListener(name, check));
+                    resolve();
+                }
+            };
+            events.forEach(name => this.video.addEventListener(name, check));
+            check();
         });
     }
 
     toggleMute(trackName) {
         const track = this.tracks[trackName];
         track.isMuted = !track.isMuted;
-        track.element.muted = track.isMuted;
 
         const icon = track.muteBtn.querySelector('i');
         if (track.isMuted) {
@@ -89,20 +222,22 @@ export class AudioEditor {
             icon.classList.add('icon-volume-high');
             track.muteBtn.classList.remove('active');
         }
+        this.updateMix();
     }
 
     setVolume(trackName, volume) {
-        this.tracks[trackName].element.volume = volume;
+        this.tracks[trackName].volume = volume;
+        this.updateMix();
     }
 
-    handleTrackError(trackName) {
-        console.error(`Error loading track: ${trackName}`);
-        const trackElement = document.querySelector(`.track[data-track="${trackName}"]`);
-        if (trackElement) {
-            trackElement.style.opacity = '0.5';
-            trackElement.querySelector('.mute-btn').disabled = true;
-            trackElement.querySelector('.volume-slider').disabled = true;
+    handleMixError(session, error) {
+        if (session !== this.session) {
+            return;
         }
+        console.error('Error loading preview mix:', error);
+        document.querySelectorAll('.track').forEach(trackElement => {
+            trackElement.style.opacity = '0.5';
+        });
     }
 
     async exportVideo() {
@@ -111,46 +246,20 @@ export class AudioEditor {
         exportBtn.innerHTML = '<i class="icon-spinner"></i> جاري التصدير...';
 
         try {
-            // إنشاء كائن يحتوي على جميع المسارات ومستويات الصوت
-            const tracksData = {};
-            Object.keys(this.tracks).forEach(trackName => {
-                // الحصول على المسار النسبي فقط (إزالة النطاق إذا موجود)
-                let trackUrl = this.tracks[trackName].element.src;
-                if (trackUrl.includes(window.location.origin)) {
-                    trackUrl = trackUrl.replace(window.location.origin, '');
-                }
-
-                tracksData[trackName] = trackUrl;
-            });
-
-            // إنشاء كائن مستويات الصوت
-            const volumesData = {};
-            Object.keys(this.tracks).forEach(trackName => {
-                volumesData[trackName] = this.tracks[trackName].element.volume;
-            });
-
             // الحصول على مسار الفيديو (إزالة النطاق إذا موجود)
             let videoUrl = this.video.querySelector('source').src;
             if (videoUrl.includes(window.location.origin)) {
                 videoUrl = videoUrl.replace(window.location.origin, '');
             }
 
-            const response = await fetch('/export', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    video_url: videoUrl,
-                    tracks: tracksData,
-                    volumes: volumesData
-                })
+            const result = await new JobPoller().submit('/export', {
+                video_url: videoUrl,
+                tracks: this.trackUrls(),
+                volumes: this.trackVolumes()
+            }, (progress) => {
+                exportBtn.innerHTML = `<i class="icon-spinner"></i> جاري التصدير... ${Math.round(progress)}%`;
             });
 
-            const result = await response.json();
-
-            if (!response.ok) {
-                throw new Error(result.error || 'فشل في التصدير');
-            }
-
             if (result.success) {
                 // تنزيل الملف
                 const a = document.createElement('a');
@@ -0,0 +1,56 @@
+class JobPoller {
+    constructor(interval = 1000) {
+        this.interval = interval;
+    }
+
+    async submit(url, payload, onProgress) {
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(payload)
+        });
+
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'فشل في إرسال الطلب');
+        }
+
+        // النتيجة جاهزة مسبقاً (مثل تصدير مكرر)
+        if (!data.job_id) {
+            return data;
+        }
+
+        return this.wait(data.job_id, onProgress);
+    }
+
+    async wait(jobId, onProgress) {
+        while (true) {
+            const response = await fetch(`/jobs/${jobId}`);
+            const job = await response.json();
+
+            if (!response.ok) {
+                throw new Error(job.error || 'تعذر قراءة حالة المهمة');
+            }
+
+            if (onProgress) {
+                onProgress(job.progress, job.stage, job.status);
+            }
+
+            if (job.status === 'done') {
+                return job.result;
+            }
+            if (job.status === 'failed') {
+                throw new Error(job.error || 'فشلت المهمة');
+            }
+            if (job.status === 'cancelled') {
+                throw new Error('تم إلغاء المهمة');
+            }
+
+            await new Promise(resolve => setTimeout(resolve, this.interval));
+        }
+    }
+
+    async cancel(jobId) {
+        await fetch(`/jobs/${jobId}`, { method: 'DELETE' });
+    }
+}
@@ -7,7 +7,10 @@ class FileUploader {
         this.progressFill = document.getElementById('progressFill');
         this.progressText = document.getElementById('progressText');
         this.progressPercent = document.getElementById('progressPercent');
+        this.modelSelect = document.getElementById('modelSelect');
+        this.stemsSelect = document.getElementById('stemsSelect');
         this.currentFile = null;
+        this.poller = new JobPoller();
 
         this.initEventListeners();
     }
@@ -63,11 +66,11 @@ class FileUploader {
             this.processBtn.disabled = true;
             this.processBtn.innerHTML = '<i class="icon-spinner"></i> جاري المعالجة...';
 
-            this.updateProgress(20, 'جاري رفع الملف...', '20%');
+            this.updateProgress(0, 'جاري رفع الملف...', '0%');
             const uploadResponse = await this.uploadFile(this.currentFile);
             
-            this.updateProgress(50, 'جاري فصل المسارات...', '50%');
-            const processResponse = await this.processFileOnServer(uploadResponse.filename);
+            this.updateProgress(30, 'جاري فصل المسارات...', '30%');
+            const processResponse = await this.processFileOnServer(uploadResponse);
             
             this.updateProgress(100, 'اكتمل الفصل بنجاح!', '100%');
             
@@ -87,35 +90,74 @@ class FileUploader {
     }
 
     async uploadFile(file) {
-        const formData = new FormData();
-        formData.append('file', file);
-
-        const response = await fetch('/upload', {
+        // رفع مجزأ قابل للاستئناف: كل جزء يُرسل من آخر موضع استلمه الخادم
+        const init = await this.requestJson('/upload/init', {
             method: 'POST',
-            body: formData
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size })
         });
 
-        if (!response.ok) {
-            const errorData = await response.json();
-            throw new Error(errorData.error || 'فشل في رفع الملف');
+        let offset = init.offset;
+        let failures = 0;
+        while (offset < file.size) {
+            const end = Math.min(offset + init.chunk_size, file.size);
+            try {
+                const status = await this.requestJson(`${init.upload_url}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: file.slice(offset, end)
+                });
+                offset = status.offset;
+                failures = 0;
+            } catch (error) {
+                // أخطاء الملف نفسه (نوع غير مدعوم، حجم زائد) لا يفيد معها إعادة المحاولة
+                if (error.status && error.status !== 409 && error.status < 500) throw error;
+                if (++failures > 5) throw error;
+                await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+                const status = await this.requestJson(init.upload_url).catch(() => null);
+                if (status) offset = status.offset;
+            }
+
+            const percent = Math.round(offset / file.size * 30);
+            this.updateProgress(percent, 'جاري رفع الملف...', `${percent}%`);
         }
 
-        return await response.json();
-    }
-
-    async processFileOnServer(filename) {
-        const response = await fetch('/process', {
+        // إنهاء الرفع وبدء الفصل مباشرة في نفس الطلب
+        return this.requestJson(`${init.upload_url}/finalize`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ filename })
+            body: JSON.stringify({ process: true, ...this.separationOptions() })
         });
+    }
 
+    async requestJson(url, options = {}) {
+        const response = await fetch(url, options);
+        const data = await response.json();
         if (!response.ok) {
-            const errorData = await response.json();
-            throw new Error(errorData.error || 'فشل في فصل المسارات');
+            const error = new Error(data.error || 'فشل في رفع الملف');
+            error.status = response.status;
+            throw error;
         }
+        return data;
+    }
+
+    async processFileOnServer(uploadResponse) {
+        const onProgress = (progress) => {
+            const percent = Math.round(30 + progress * 0.7);
+            this.updateProgress(percent, 'جاري فصل المسارات...', `${percent}%`);
+        };
+
+        if (uploadResponse.job_id) {
+            return this.poller.wait(uploadResponse.job_id, onProgress);
+        }
+        return this.poller.submit('/process', { filename: uploadResponse.filename, ...this.separationOptions() }, onProgress);
+    }
 
-        return await response.json();
+    separationOptions() {
+        return {
+            model: this.modelSelect.value,
+            stems: this.stemsSelect.value
+        };
     }
 
     updateProgress(percent, text, percentText) {
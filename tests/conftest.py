@@ -0,0 +1,5 @@
+import os
+import sys
+
+# الاختبارات تستورد وحدات المشروع (utils.*) من جذر المستودع
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from utils.activity import active_regions, edge_weights, rms_envelope
+
+RATE = 1000
+
+
+def signal(*parts, channels=2):
+    """(المدة بالثواني، مسموع؟) -> مصفوفة (قنوات، إطارات)"""
+    blocks = []
+    for seconds, loud in parts:
+        frames = int(seconds * RATE)
+        block = np.full(frames, 0.5 if loud else 0.0, dtype=np.float32)
+        blocks.append(block)
+    return np.tile(np.concatenate(blocks), (channels, 1))
+
+
+def test_rms_envelope():
+    samples = signal((1, True), (0.5, False))
+    envelope = rms_envelope(samples, RATE)
+    assert envelope.shape == (30,)
+    assert envelope[:20] == pytest.approx(20 * np.log10(0.5), abs=1e-3)
+    assert (envelope[20:] < -100).all()
+
+
+def test_partial_last_window_is_averaged_over_window():
+    samples = signal((1.02, True))
+    envelope = rms_envelope(samples, RATE)
+    assert len(envelope) == 21
+    assert envelope[-1] == pytest.approx(10 * np.log10(0.25 * 20 / 50), abs=1e-3)
+
+
+def test_all_silent():
+    assert active_regions(signal((10, False)), RATE) == []
+
+
+def test_all_loud():
+    samples = signal((3.01, True))
+    assert active_regions(samples, RATE) == [(0, samples.shape[-1])]
+
+
+def test_empty_input():
+    assert active_regions(np.zeros((2, 0), dtype=np.float32), RATE) == []
+
+
+def test_long_silence_splits_with_margin():
+    samples = signal((2, True), (5, False), (3, True))
+    assert active_regions(samples, RATE, min_silence=4.0, margin=0.5) == [(0, 2500), (6500, 10000)]
+
+
+def test_short_silence_is_kept():
+    samples = signal((2, True), (3, False), (3, True))
+    assert active_regions(samples, RATE, min_silence=4.0) == [(0, 8000)]
+
+
+def test_silence_at_edges_loses_margin_only_inside():
+    samples = signal((5, False), (2, True), (6, False))
+    assert active_regions(samples, RATE, min_silence=4.0, margin=0.5) == [(4500, 7500)]
+
+
+def test_short_silence_at_edges_is_kept():
+    samples = signal((1, False), (2, True), (1, False))
+    assert active_regions(samples, RATE, min_silence=4.0) == [(0, 4000)]
+
+
+def test_margin_wider_than_silence_keeps_everything():
+    samples = signal((2, True), (5, False), (3, True))
+    assert active_regions(samples, RATE, min_silence=4.0, margin=3.0) == [(0, 10000)]
+
+
+def test_threshold():
+    samples = signal((2, True), (5, True), (3, True))
+    samples[:, 2000:7000] *= 0.001
+    # المقطع الهادئ عند -66 dBFS
+    assert active_regions(samples, RATE, threshold_db=-50.0) == [(0, 2500), (6500, 10000)]
+    assert active_regions(samples, RATE, threshold_db=-80.0) == [(0, 10000)]
+
+
+def test_edge_weights():
+    weights = edge_weights(10, 3)
+    assert weights.dtype == np.float32
+    assert weights.tolist() == [0.0, 0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.0]
+    assert edge_weights(6, 3, fade_in=False).tolist() == [1.0, 1.0, 1.0, 1.0, 0.5, 0.0]
+    assert edge_weights(6, 3, fade_out=False).tolist() == [0.0, 0.5, 1.0, 1.0, 1.0, 1.0]
+    assert edge_weights(4, 0).tolist() == [1.0] * 4
+
+
+def test_edge_weights_shorter_than_fades():
+    assert edge_weights(3, 10).tolist() == [0.0, 1.0, 0.0]
+    assert edge_weights(1, 10).tolist() == [1.0]
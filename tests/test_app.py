@@ -0,0 +1,265 @@
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    # المسارات في إعدادات التطبيق نسبية لجذر المستودع
+    monkeypatch.chdir(ROOT)
+    import app as app_module
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    os.makedirs(tmp_path / 'uploads')
+    return app_module
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize('body', [
+    {'model': ['htdemucs']},
+    {'model': 5},
+    {'model': 'unknown'},
+    {'stems': ['vocals']},
+    {'stems': 3},
+    {'stems': 'vocals+kazoo'},
+    {'model': 'htdemucs', 'stems': {'vocals': True}},
+])
+def test_invalid_separation_options(client, body):
+    response = client.post('/process', json={'filename': 'song.mp3', **body})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_separation_options(app_module):
+    options = app_module.separation_options({'model': 'htdemucs_6s', 'stems': 'bass+drums'})
+    assert options == {'model': 'htdemucs_6s', 'two_stems': 'drums+bass'}
+    assert app_module.separation_options({'stems': 'all'}) == {'model': 'htdemucs', 'two_stems': None}
+
+
+@pytest.mark.parametrize('filename', ['../../app.py', '../uploads/song.mp3', '/etc/passwd', '', 5, ['song.mp3'], None])
+def test_batch_rejects_invalid_filenames(client, app_module, filename):
+    open(os.path.join(app_module.app.config['UPLOAD_FOLDER'], 'song.mp3'), 'wb').close()
+    response = client.post('/process/batch', json={'filenames': ['song.mp3', filename]})
+    assert response.status_code == 400
+    assert response.get_json()['invalid'] == [filename]
+
+
+@pytest.mark.parametrize('filename', ['../../app.py', '/etc/passwd', 5, ['song.mp3']])
+def test_process_rejects_invalid_filename(client, filename):
+    assert client.post('/process', json={'filename': filename}).status_code == 400
+
+
+def test_batch_reports_missing_files(client, app_module):
+    open(os.path.join(app_module.app.config['UPLOAD_FOLDER'], 'song.mp3'), 'wb').close()
+    response = client.post('/process/batch', json={'filenames': ['song.mp3', 'other.mp3']})
+    assert response.status_code == 404
+    assert response.get_json()['missing'] == ['other.mp3']
+
+
+def make_media(path, *inputs, **kwargs):
+    ffmpeg = pytest.importorskip('ffmpeg')
+    streams = [ffmpeg.input(source, f='lavfi', t=2) for source in inputs]
+    ffmpeg.output(*streams, str(path), **kwargs).run(quiet=True, overwrite_output=True)
+    return str(path)
+
+
+@pytest.fixture
+def exports(app_module, tmp_path, monkeypatch):
+    import shutil
+    if shutil.which('ffmpeg') is None:
+        pytest.skip("ffmpeg is not installed")
+    monkeypatch.setitem(app_module.app.config, 'EXPORT_FOLDER', str(tmp_path / 'exports'))
+    return tmp_path / 'exports'
+
+
+def streams(path):
+    """أنواع المسارات في الملف من مخرجات ffmpeg -i (بدون الحاجة إلى ffprobe)"""
+    import re
+    import subprocess
+    info = subprocess.run(['ffmpeg', '-hide_banner', '-i', path], capture_output=True, text=True).stderr
+    return sorted(kind.lower() for kind in re.findall(r'Stream #\S+.*?: (Audio|Video):', info))
+
+
+@pytest.mark.parametrize('upload, expected', [
+    ('song.mp3', ['audio']),
+    ('clip.mp4', ['audio', 'video']),
+])
+def test_export(app_module, exports, tmp_path, monkeypatch, upload, expected):
+    from utils.jobs import Job
+
+    # المدة تُستخدم لحساب نسبة التقدم فقط
+    monkeypatch.setattr(app_module, 'probe_duration', lambda path: 2.0)
+
+    if upload.endswith('.mp4'):
+        video = make_media(tmp_path / upload, 'testsrc=size=64x64:rate=10', 'sine=frequency=220', vcodec='mpeg4')
+    else:
+        video = make_media(tmp_path / upload, 'sine=frequency=220')
+    stems = tmp_path / 'stems'
+    stems.mkdir()
+    tracks = {
+        'vocals': make_media(stems / 'vocals.mp3', 'sine=frequency=440'),
+        'no_vocals': make_media(stems / 'no_vocals.mp3', 'sine=frequency=880')
+    }
+    volumes = {'vocals': 1.0, 'no_vocals': 0.5}
+
+    result = app_module.run_export_job(Job('export'), video, tracks, volumes, 'testkey')
+    output = os.path.join(exports, 'export_testkey.mp4')
+    assert result['success'] and result['download_url'] == '/static/exports/export_testkey.mp4'
+    assert streams(output) == expected
+
+
+@pytest.mark.parametrize('start, duration', [('inf', '5'), ('0', 'nan'), ('-inf', '5'), ('0', '0'), ('x', '5')])
+def test_preview_chunk_rejects_invalid_window(client, start, duration):
+    response = client.get('/preview', query_string={
+        'tracks': '{"vocals": "/static/missing.mp3"}', 'format': 'mp3', 'start': start, 'duration': duration
+    })
+    assert response.status_code == 400
+    assert response.get_json()['error'] == "Invalid start or duration"
+
+
+@pytest.fixture
+def preview_track(app_module, exports, tmp_path, monkeypatch):
+    track = make_media(tmp_path / 'vocals.wav', 'sine=frequency=440', ac=2, ar=44100)
+    monkeypatch.setattr(app_module, 'static_path', lambda url: track if url == '/static/vocals.wav' else None)
+    monkeypatch.setattr(app_module, 'track_sources', lambda path: None)
+    return track
+
+
+def preview_chunk(client, **params):
+    return client.get('/preview', query_string={
+        'tracks': '{"vocals": "/static/vocals.wav"}', 'volumes': '{"vocals": 1}', **params
+    })
+
+
+@pytest.mark.parametrize('fmt, mimetype, magic', [('opus', 'audio/ogg', b'OggS'), ('mp3', 'audio/mpeg', None)])
+def test_preview_chunk_formats(client, preview_track, tmp_path, fmt, mimetype, magic):
+    response = preview_chunk(client, format=fmt, start='0.5', duration='1')
+    assert response.status_code == 200
+    assert response.mimetype == mimetype
+    if magic:
+        assert response.data.startswith(magic)
+
+    # المقطع المضغوط يغطي النافذة المطلوبة فقط، لا المسار كاملاً
+    import subprocess
+    chunk = tmp_path / f"chunk.{fmt}"
+    chunk.write_bytes(response.data)
+    pcm = subprocess.run(
+        ['ffmpeg', '-loglevel', 'error', '-i', str(chunk), '-f', 's16le', '-ac', '1', '-ar', '1000', '-'],
+        capture_output=True, check=True
+    ).stdout
+    assert abs(len(pcm) // 2 - 1000) < 100
+
+
+def test_preview_chunk_past_end(client, preview_track):
+    assert preview_chunk(client, format='opus', start='2', duration='1').status_code == 416
+    assert preview_chunk(client, format='opus', start='1.5', duration='10').status_code == 200
+
+
+def test_preview_rejects_unknown_format(client):
+    response = client.get('/preview', query_string={'tracks': '{"vocals": "/static/vocals.wav"}', 'format': 'flac'})
+    assert response.status_code == 400
+
+
+def test_separation_timeout_scales_with_duration(app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'SEPARATION_TIMEOUT', 600)
+    monkeypatch.setitem(app_module.app.config, 'SEPARATION_TIMEOUT_PER_SECOND', 3.0)
+    assert app_module.separation_timeout(None) == 600
+    assert app_module.separation_timeout(120) == 600
+    # الملفات المتدفقة أطول من STREAMING_MIN_DURATION دائماً
+    assert app_module.separation_timeout(1200) == 3600
+
+
+def test_streaming_separation_gets_scaled_timeout(app_module, tmp_path, monkeypatch):
+    from concurrent.futures import TimeoutError as FutureTimeoutError
+    from utils.cache import ResultCache
+    from utils.jobs import Job
+
+    class Engine:
+        def separate(self, *args, timeout=None, **kwargs):
+            self.timeout = timeout
+            raise FutureTimeoutError()
+
+    engine = Engine()
+    cache = ResultCache(str(tmp_path / 'cache'), 10 ** 9)
+    monkeypatch.setattr(app_module, 'cache', cache)
+    monkeypatch.setattr(app_module, 'get_engine', lambda: engine)
+    monkeypatch.setitem(app_module.app.config, 'SEPARATION_TIMEOUT_PER_SECOND', 3.0)
+
+    options = {'model': 'htdemucs', 'two_stems': 'vocals'}
+    with pytest.raises(Exception, match=r"timed out \(60 minutes\)"):
+        app_module.separate_uncached(
+            Job('process'), lambda **kwargs: None, 'song.mp3', 'key', 'sources', options, segment=60, duration=1200
+        )
+    assert engine.timeout == 3600
+    # المجلدات المؤقتة تُحذف بعد انتهاء المهلة
+    assert os.listdir(cache.root) == []
+
+
+def test_layouts_are_derived_from_saved_sources(app_module, exports, tmp_path, monkeypatch):
+    np = pytest.importorskip('numpy')
+    from utils.cache import ResultCache
+    from utils.jobs import Job
+    from utils.separator import MODELS
+    from utils.stems import LayoutEncoder, iter_mix
+
+    names = MODELS['htdemucs']
+    rng = np.random.default_rng(0)
+    model_sources = {name: rng.uniform(-0.2, 0.2, (44100, 2)).astype(np.float32) for name in names}
+
+    class Engine:
+        """يكتب مخرجات نموذج ثابتة بنفس طريقة SeparationEngine"""
+        runs = 0
+
+        def separate(self, input_path, output_dir, two_stems=None, sources_dir=None, **kwargs):
+            self.runs += 1
+            encoder = LayoutEncoder(names, output_dir, two_stems, 44100, 2, 192, sources_dir)
+            encoder.write(model_sources)
+            return encoder.close()
+
+    engine = Engine()
+    cache = ResultCache(str(tmp_path / 'cache'), 10 ** 9)
+    monkeypatch.setattr(app_module, 'cache', cache)
+    monkeypatch.setattr(app_module, 'get_engine', lambda: engine)
+    from utils import ffmpeg_utils
+    for module in (app_module, ffmpeg_utils):
+        monkeypatch.setattr(module, 'probe_duration', lambda path: 2.0)
+    song = make_media(tmp_path / 'song.wav', 'sine=frequency=440', ac=2, ar=44100)
+
+    def separate(stems):
+        options = {'model': 'htdemucs', 'two_stems': stems}
+        result = app_module.separate_file(Job('process'), 'song.wav', song, lambda **kwargs: None, options)
+        # الذاكرة المؤقتة هنا خارج static/، فالروابط نسبية إلى مجلد الاختبار
+        static = os.path.abspath('static')
+        return {
+            stem: os.path.normpath(os.path.join(static, url[len('/static/'):]))
+            for stem, url in result['tracks'].items()
+        }
+
+    vocals = separate('vocals')
+    assert engine.runs == 1
+    # التجميعة الثانية تُشتق من مخرجات النموذج المحفوظة: أي تشغيل للنموذج يفشل الاختبار
+    monkeypatch.setattr(app_module, 'get_engine', lambda: pytest.fail("the model ran again"))
+    rhythm = separate('drums+bass')
+    assert set(vocals) == {'vocals', 'no_vocals'}
+    assert set(rhythm) == {'drums+bass', 'no_drums+bass'}
+
+    def stem_sum(layout):
+        parts = [(path, 1.0) for path in layout]
+        return np.concatenate(list(iter_mix(parts)))
+
+    vocals_parts = [app_module.track_sources(path) for path in vocals.values()]
+    rhythm_parts = [app_module.track_sources(path) for path in rhythm.values()]
+    assert sorted(map(len, vocals_parts)) == [1, 3] and sorted(map(len, rhythm_parts)) == [2, 2]
+
+    # مجموع مسارات كل تجميعة يساوي مجموع مخرجات النموذج (بعد float16)
+    expected = sum(source.astype(np.float16).astype(np.float32) for source in model_sources.values())
+    for layout in (vocals_parts, rhythm_parts):
+        total = sum(stem_sum(parts) for parts in layout)
+        np.testing.assert_allclose(total, expected, atol=1e-6)
+    for path in [*vocals.values(), *rhythm.values()]:
+        assert streams(path) == ['audio']
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+signal = pytest.importorskip('scipy.signal')
+
+from utils import audio_utils
+from utils.audio_utils import BANDS, apply_eq, butter_sos, filter_bands, sosfilt_into
+
+SR = 44100
+
+
+def noise(seconds=2.0, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal(int(SR * seconds)) * 0.1).astype(np.float32)
+
+
+def tone(frequency, seconds=2.0):
+    t = np.arange(int(SR * seconds)) / SR
+    return np.sin(2 * np.pi * frequency * t).astype(np.float32)
+
+
+def rms(x):
+    return float(np.sqrt(np.mean(np.square(x, dtype=np.float64))))
+
+
+@pytest.mark.parametrize('band', [band for band in BANDS if band != (10, 2000)])
+def test_stable_bands_match_transfer_function_form(band):
+    y = noise()
+    b, a = signal.butter(5, [band[0] / (SR / 2), band[1] / (SR / 2)], btype='band')
+    expected = signal.lfilter(b, a, y)
+    out = filter_bands(y, SR, [band])
+    assert out.shape == (1, len(y)) and out.dtype == np.float32
+    # الفرق الباقي من تخزين الناتج بدقة float32
+    np.testing.assert_allclose(out[0], expected, atol=2e-5)
+
+
+def test_low_band_is_stable():
+    # صيغة b/a القديمة لهذا النطاق تنفجر عددياً؛ صيغة SOS مستقرة وتمرر النطاق بكسب قريب من 1
+    y = tone(500) + tone(10000)
+    b, a = signal.butter(5, [10 / (SR / 2), 2000 / (SR / 2)], btype='band')
+    with np.errstate(all='ignore'):
+        assert not np.abs(signal.lfilter(b, a, y)).max() < 10
+
+    out = filter_bands(y, SR, [(10, 2000)])[0]
+    assert np.isfinite(out).all()
+    settled = out[SR // 2:]
+    assert rms(settled) == pytest.approx(rms(tone(500)), rel=0.02)
+    assert rms(filter_bands(tone(10000), SR, [(10, 2000)])[0][SR // 2:]) < 1e-3
+
+
+def test_blocks_match_single_pass(monkeypatch):
+    monkeypatch.setattr(audio_utils, 'BLOCK_SIZE', 1000)
+    y = noise(0.5)
+    sos = butter_sos(SR, 80, 5000)
+    out = sosfilt_into(sos, y, np.empty_like(y))
+    np.testing.assert_allclose(out, signal.sosfilt(sos, y), atol=1e-6)
+
+
+def test_filter_bands_rows_match_separate_calls():
+    y = noise(1.0)
+    out = filter_bands(y, SR, BANDS)
+    for row, (low, high) in zip(out, BANDS):
+        np.testing.assert_allclose(row, signal.sosfilt(butter_sos(SR, low, high), y), atol=1e-6)
+
+
+def test_designs_are_cached():
+    assert butter_sos(SR, 80, 5000) is butter_sos(SR, 80, 5000)
+    assert butter_sos(SR, highcut=100, order=4).shape == (2, 6)
+
+
+def test_apply_eq_sums_shelves():
+    y = noise(0.5)
+    expected = (
+        signal.sosfilt(butter_sos(SR, highcut=100, order=4), y) * 2.0
+        + signal.sosfilt(butter_sos(SR, lowcut=5000, order=4), y) * 0.5
+    )
+    np.testing.assert_allclose(apply_eq(y, SR, bass_boost=2.0, treble_boost=0.5), expected, atol=1e-6)
@@ -0,0 +1,243 @@
+import time
+import threading
+
+import pytest
+
+from utils.broker import Broker, LOST_ERROR, RedisBroker, SQLiteBroker
+from utils.jobs import BrokerJobManager, QueueFullError, Worker
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def broker(request, tmp_path):
+    if request.param == 'sqlite':
+        broker = SQLiteBroker(str(tmp_path / 'jobs.db'))
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa')
+        broker = RedisBroker(client=fakeredis.FakeRedis(decode_responses=True))
+    yield broker
+    broker.close()
+
+
+def test_incomplete_backend_cannot_be_created():
+    class Partial(Broker):
+        def enqueue(self, kind, args, uses=(), key=None, max_attempts=3, max_pending=None):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_enqueue_and_get(broker):
+    record = broker.enqueue('export', ['/a.mp4', {'vocals': 1.0}], uses=['/a.mp4'])
+    stored = broker.get(record['id'])
+    assert stored['status'] == 'queued'
+    assert stored['args'] == ['/a.mp4', {'vocals': 1.0}]
+    assert stored['uses'] == ['/a.mp4']
+    assert stored['attempts'] == 0 and stored['cancel'] is False
+    assert [job['id'] for job in broker.active()] == [record['id']]
+    assert broker.pending() == 1
+    assert broker.get('missing') is None
+
+
+def test_same_key_returns_pending_job(broker):
+    first = broker.enqueue('process', [1], key='k')
+    assert broker.enqueue('process', [1], key='k')['id'] == first['id']
+    assert broker.pending() == 1
+
+    # بعد انتهاء المهمة يُنشئ نفس المفتاح مهمة جديدة
+    claimed = broker.claim('w1', 60)
+    broker.finish(claimed['id'], 'w1', 'done', {'ok': True})
+    assert broker.enqueue('process', [1], key='k')['id'] != first['id']
+
+
+def test_max_pending(broker):
+    broker.enqueue('process', [1], key='a', max_pending=2)
+    broker.enqueue('process', [2], key='b', max_pending=2)
+    with pytest.raises(QueueFullError):
+        broker.enqueue('process', [3], key='c', max_pending=2)
+    # إعادة إرسال مهمة موجودة مسموحة حتى عند امتلاء الطابور
+    assert broker.enqueue('process', [1], key='a', max_pending=2)['args'] == [1]
+    assert broker.pending() == 2
+
+
+def test_claim_heartbeat_finish(broker):
+    first = broker.enqueue('process', [1])
+    second = broker.enqueue('process', [2])
+
+    claimed = broker.claim('w1', 60)
+    assert claimed['id'] == first['id']
+    assert (claimed['status'], claimed['worker'], claimed['attempts']) == ('running', 'w1', 1)
+    assert broker.claim('w2', 60)['id'] == second['id']
+    assert broker.claim('w3', 60) is None
+
+    assert broker.heartbeat(first['id'], 'w1', 60, 42.5, 'separate', {'vocals': '/v.mp3'}) is False
+    stored = broker.get(first['id'])
+    assert (stored['progress'], stored['stage'], stored['partial']) == (42.5, 'separate', {'vocals': '/v.mp3'})
+
+    assert broker.finish(first['id'], 'w2', 'done', {'x': 1}) is False
+    assert broker.finish(first['id'], 'w1', 'done', {'x': 1}) is True
+    stored = broker.get(first['id'])
+    assert (stored['status'], stored['result'], stored['progress']) == ('done', {'x': 1}, 100.0)
+    assert stored['finished_at'] is not None
+    assert broker.heartbeat(first['id'], 'w1', 60, 50, None, None) is None
+    assert [job['id'] for job in broker.active()] == [second['id']]
+
+
+def test_cancel(broker):
+    queued = broker.enqueue('process', [1])
+    running = broker.enqueue('process', [2])
+    assert broker.claim('w1', 60)['id'] == queued['id']
+    broker.cancel(queued['id'])
+    assert broker.heartbeat(queued['id'], 'w1', 60, 10, None, None) is True
+    assert broker.finish(queued['id'], 'w1', 'cancelled')
+    assert broker.get(queued['id'])['status'] == 'cancelled'
+
+    assert broker.cancel(running['id'])['status'] == 'cancelled'
+    assert broker.claim('w1', 60) is None
+    assert broker.pending() == 0
+
+
+def test_expired_lease_is_requeued(broker):
+    record = broker.enqueue('process', [1])
+    assert broker.claim('dead', 0.05)['attempts'] == 1
+    time.sleep(0.1)
+
+    # العقدة الأولى توقفت دون تجديد: عقدة أخرى تأخذ المهمة
+    retried = broker.claim('alive', 60)
+    assert (retried['id'], retried['worker'], retried['attempts']) == (record['id'], 'alive', 2)
+    assert broker.heartbeat(record['id'], 'dead', 60, 99, None, None) is None
+    assert broker.finish(record['id'], 'dead', 'done', {'from': 'dead'}) is False
+    assert broker.finish(record['id'], 'alive', 'done', {'from': 'alive'}) is True
+    assert broker.get(record['id'])['result'] == {'from': 'alive'}
+
+
+def test_lost_job_fails_after_max_attempts(broker):
+    record = broker.enqueue('process', [1], max_attempts=2)
+    for _ in range(2):
+        assert broker.claim('dead', 0.01) is not None
+        time.sleep(0.05)
+    assert broker.claim('w', 60) is None
+    stored = broker.get(record['id'])
+    assert (stored['status'], stored['error']) == ('failed', LOST_ERROR)
+
+
+def test_expired_cancelled_job_is_not_retried(broker):
+    record = broker.enqueue('process', [1])
+    broker.claim('dead', 0.01)
+    broker.cancel(record['id'])
+    time.sleep(0.05)
+    assert broker.claim('w', 60) is None
+    assert broker.get(record['id'])['status'] == 'cancelled'
+
+
+def run_worker(broker, tasks, **kwargs):
+    worker = Worker(broker, tasks, lease=5, poll=0.01, heartbeat=0.02, **kwargs)
+    thread = threading.Thread(target=worker.run, daemon=True)
+    thread.start()
+    return worker, thread
+
+
+def wait_finished(manager, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job.finished:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_worker_runs_jobs_and_reports(tmp_path):
+    manager = BrokerJobManager(SQLiteBroker(str(tmp_path / 'jobs.db')), max_pending=10)
+    release = threading.Event()
+
+    def add(job, a, b):
+        job.update(progress=50, stage='adding')
+        release.wait(5)
+        return {'sum': a + b}
+
+    def explode(job):
+        raise ValueError("boom")
+
+    worker, thread = run_worker(manager.broker, {'add': add, 'explode': explode}, concurrency=2)
+    try:
+        job = manager.submit('add', add, 2, 3, uses=[str(tmp_path / 'in.wav')])
+        assert manager.submit('add', add, 2, 3).id == job.id
+
+        deadline = time.time() + 5
+        while manager.get(job.id).stage != 'adding' and time.time() < deadline:
+            time.sleep(0.01)
+        running = manager.get(job.id)
+        assert (running.status, running.progress) == ('running', 50.0)
+        assert manager.in_use(str(tmp_path)) and not manager.in_use(str(tmp_path / 'other'))
+
+        release.set()
+        done = wait_finished(manager, job.id)
+        assert (done.status, done.result, done.attempts) == ('done', {'sum': 5}, 1)
+
+        failed = wait_finished(manager, manager.submit('explode', explode).id)
+        assert (failed.status, failed.error) == ('failed', 'boom')
+
+        unknown = wait_finished(manager, manager.submit('missing', None).id)
+        assert unknown.status == 'failed'
+    finally:
+        worker.stop()
+        thread.join(5)
+
+
+def test_worker_cancels_running_job(tmp_path):
+    manager = BrokerJobManager(SQLiteBroker(str(tmp_path / 'jobs.db')))
+    cancelled = threading.Event()
+
+    def wait(job):
+        job.on_cancel(cancelled.set)
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+
+    worker, thread = run_worker(manager.broker, {'wait': wait})
+    try:
+        job = manager.submit('wait', wait)
+        while manager.get(job.id).status != 'running':
+            time.sleep(0.01)
+        manager.cancel(job.id)
+        assert wait_finished(manager, job.id).status == 'cancelled'
+        assert cancelled.is_set()
+    finally:
+        worker.stop()
+        thread.join(5)
+
+
+def test_worker_takes_over_job_of_dead_worker(tmp_path):
+    broker = SQLiteBroker(str(tmp_path / 'jobs.db'))
+    manager = BrokerJobManager(broker)
+    job = manager.submit('add', None, 1, 2)
+    # عقدة حجزت المهمة ثم توقفت دون heartbeat
+    assert broker.claim('dead-node', 0.05)['id'] == job.id
+
+    worker, thread = run_worker(broker, {'add': lambda job, a, b: a + b})
+    try:
+        done = wait_finished(manager, job.id)
+        assert (done.status, done.result, done.attempts) == ('done', 3, 2)
+    finally:
+        worker.stop()
+        thread.join(5)
+
+
+def test_stop_drains_running_job(tmp_path):
+    manager = BrokerJobManager(SQLiteBroker(str(tmp_path / 'jobs.db')))
+    started = threading.Event()
+
+    def slow(job):
+        started.set()
+        time.sleep(0.2)
+        return 'finished'
+
+    worker, thread = run_worker(manager.broker, {'slow': slow})
+    job = manager.submit('slow', slow)
+    assert started.wait(5)
+    worker.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert manager.get(job.id).result == 'finished'
@@ -0,0 +1,175 @@
+import os
+import threading
+
+from utils.cache import LOCKS, MANIFEST, KeyLock, ResultCache
+
+
+def write_stems(cache, sizes):
+    staging = cache.staging_dir()
+    stems = {}
+    for name, size in sizes.items():
+        stems[name] = os.path.join(staging, f"{name}.mp3")
+        with open(stems[name], 'wb') as f:
+            f.write(b'\0' * size)
+    return staging, stems
+
+
+def store(cache, key, size, used_at=None):
+    staging, stems = write_stems(cache, {'vocals': size})
+    paths = cache.commit(key, staging, stems)
+    if used_at is not None:
+        os.utime(os.path.join(cache.path(key), MANIFEST), (used_at, used_at))
+    return paths
+
+
+def test_make_key():
+    key = ResultCache.make_key('abc', model='htdemucs', two_stems=None)
+    assert key == ResultCache.make_key('abc', two_stems=None, model='htdemucs')
+    assert key != ResultCache.make_key('abc', model='htdemucs', two_stems='vocals')
+    assert key != ResultCache.make_key('abd', model='htdemucs', two_stems=None)
+
+
+def test_commit_and_get(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10_000)
+    assert cache.get('key') is None
+
+    staging, stems = write_stems(cache, {'vocals': 10, 'no_vocals': 20})
+    paths = cache.commit('key', staging, stems, meta={'model': 'htdemucs'})
+    assert paths == {
+        'vocals': os.path.join(cache.path('key'), 'vocals.mp3'),
+        'no_vocals': os.path.join(cache.path('key'), 'no_vocals.mp3')
+    }
+    assert not os.path.exists(staging)
+    manifest = cache.manifest('key')
+    assert manifest['size'] == 30 and manifest['meta'] == {'model': 'htdemucs'}
+    assert cache.get('key') == paths
+
+    # نتيجة ناقصة لا تُعتبر موجودة
+    os.remove(paths['vocals'])
+    assert cache.get('key') is None
+
+
+def test_second_commit_of_same_key_is_discarded(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10_000)
+    first = store(cache, 'key', 10)
+    staging, stems = write_stems(cache, {'vocals': 99})
+    assert cache.commit('key', staging, stems) == first
+    assert not os.path.exists(staging)
+    assert os.path.getsize(first['vocals']) == 10
+
+
+def test_evicts_least_recently_used_over_budget(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=250)
+    store(cache, 'old', 100, used_at=1000)
+    store(cache, 'used', 100, used_at=2000)
+    # القراءة تجدد وقت الاستخدام، فيصبح 'used' الأحدث
+    os.utime(os.path.join(cache.path('old'), MANIFEST), (3000, 3000))
+    store(cache, 'new', 100)
+
+    assert cache.get('used') is None
+    assert cache.get('old') and cache.get('new')
+    assert sum(size for _, size, _ in cache.entries()) <= 250
+
+
+def test_just_committed_result_is_kept(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=50)
+    store(cache, 'small', 10, used_at=1000)
+    store(cache, 'big', 100)
+    assert cache.get('big')
+    assert cache.get('small') is None
+
+
+def test_results_in_use_are_not_evicted(tmp_path):
+    used = set()
+    cache = ResultCache(str(tmp_path), max_bytes=150, in_use=lambda path: os.path.basename(path) in used)
+    store(cache, 'busy', 100, used_at=1000)
+    used.add('busy')
+    store(cache, 'new', 100)
+    assert cache.get('busy') and cache.get('new')
+
+    used.clear()
+    cache.evict()
+    assert cache.get('busy') is None and cache.get('new')
+
+
+def test_refresh_size_counts_added_files(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10_000)
+    store(cache, 'key', 10)
+    with open(os.path.join(cache.path('key'), 'vocals.flac'), 'wb') as f:
+        f.write(b'\0' * 40)
+    manifest_size = os.path.getsize(os.path.join(cache.path('key'), MANIFEST))
+    cache.refresh_size('key')
+    assert cache.manifest('key')['size'] == 50 + manifest_size
+
+
+def test_refresh_size_evicts_other_results(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=200)
+    store(cache, 'old', 100, used_at=1000)
+    store(cache, 'key', 10)
+    with open(os.path.join(cache.path('key'), 'vocals.flac'), 'wb') as f:
+        f.write(b'\0' * 100)
+    cache.refresh_size('key')
+    assert cache.get('old') is None and cache.get('key')
+
+
+def test_key_lock_excludes_other_holders(tmp_path):
+    path = str(tmp_path / '.locks' / 'key')
+    first, second = KeyLock(path), KeyLock(path)
+    assert first.acquire()
+    # نسخة ثانية تفتح الملف من جديد كما تفعل عملية أو عقدة أخرى
+    assert not second.acquire(blocking=False)
+    assert not first.acquire(blocking=False)
+    first.release()
+    assert second.acquire(blocking=False)
+    second.release()
+
+
+def test_key_lock_waits_for_release(tmp_path):
+    path = str(tmp_path / '.locks' / 'key')
+    holder, waiter = KeyLock(path), KeyLock(path)
+    acquired = threading.Event()
+
+    def wait():
+        with waiter:
+            acquired.set()
+
+    with holder:
+        thread = threading.Thread(target=wait)
+        thread.start()
+        assert not acquired.wait(0.1)
+    assert acquired.wait(5)
+    thread.join(5)
+
+
+def test_locked_results_are_not_removed(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=150)
+    store(cache, 'busy', 100, used_at=1000)
+    # عقدة أخرى تحسب أو تقرأ نفس المفتاح
+    other = ResultCache(str(tmp_path), max_bytes=150)
+    with other.lock('busy'):
+        store(cache, 'new', 100)
+        assert cache.get('busy')
+        assert not cache.remove('busy')
+    assert cache.remove('busy')
+    assert cache.get('busy') is None
+
+
+def test_lock_files_are_not_cache_entries(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=150)
+    with cache.lock('key'):
+        pass
+    assert os.path.exists(os.path.join(cache.path(LOCKS), 'key'))
+    assert cache.entries() == []
+    assert cache.remove(LOCKS)
+    assert not os.path.exists(cache.path(LOCKS))
+
+
+def test_entry_removed_during_lookup_is_a_miss(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), max_bytes=10_000)
+    store(cache, 'key', 10)
+
+    def evicted(path, *args, **kwargs):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, 'utime', evicted)
+    assert cache.get('key') is None
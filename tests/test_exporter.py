@@ -0,0 +1,104 @@
+import math
+
+import ffmpeg
+import pytest
+
+from utils.exporter import TARGET_LUFS, build_mix, export_key, mix_gains
+
+SILENT = {'input_i': float('-inf'), 'input_tp': float('-inf')}
+
+
+def stats(lufs, peak):
+    return {'input_i': lufs, 'input_tp': peak}
+
+
+def filters(mixed):
+    args = ffmpeg.output(mixed, 'out.wav').get_args()
+    return args[args.index('-filter_complex') + 1]
+
+
+def test_single_track_is_brought_to_target():
+    coefficients, limit = mix_gains({'vocals': stats(-30.0, -12.0)}, {'vocals': 1.0})
+    assert coefficients['vocals'] == pytest.approx(10 ** (6 / 20))
+    assert not limit
+
+
+def test_uncorrelated_tracks_add_power():
+    loudness = {'vocals': stats(-24.0, -12.0), 'drums': stats(-24.0, -12.0)}
+    coefficients, _ = mix_gains(loudness, {'vocals': 1.0, 'drums': 1.0})
+    assert coefficients['vocals'] == pytest.approx(math.sqrt(0.5))
+    assert coefficients['drums'] == pytest.approx(math.sqrt(0.5))
+
+
+def test_volumes_are_kept_relative():
+    loudness = {'vocals': stats(-24.0, -12.0), 'drums': stats(-24.0, -12.0)}
+    coefficients, _ = mix_gains(loudness, {'vocals': 1.0, 'drums': 0.5})
+    assert coefficients['drums'] == pytest.approx(coefficients['vocals'] * 0.5)
+    mixed_power = sum(c ** 2 * 10 ** (-24.0 / 10) for c in coefficients.values())
+    assert 10 * math.log10(mixed_power) == pytest.approx(TARGET_LUFS)
+
+
+def test_muted_and_silent_tracks_do_not_count():
+    loudness = {'vocals': stats(-30.0, -12.0), 'drums': stats(-10.0, -1.0), 'other': SILENT}
+    coefficients, limit = mix_gains(loudness, {'vocals': 1.0, 'drums': 0.0, 'other': 1.0})
+    assert coefficients['vocals'] == pytest.approx(10 ** (6 / 20))
+    assert coefficients['drums'] == 0.0
+    assert coefficients['other'] == pytest.approx(coefficients['vocals'])
+    assert not limit
+
+
+def test_all_silent_keeps_volumes():
+    coefficients, limit = mix_gains({'vocals': SILENT, 'drums': SILENT}, {'vocals': 0.5, 'drums': 1.0})
+    assert coefficients == {'vocals': 0.5, 'drums': 1.0}
+    assert not limit
+
+
+@pytest.mark.parametrize('peak, expected', [(-5.0, False), (-2.5, False), (-1.0, True), (0.5, True)])
+def test_limiter_for_single_peak(peak, expected):
+    assert mix_gains({'vocals': stats(-24.0, peak)}, {'vocals': 1.0})[1] is expected
+
+
+def test_limiter_assumes_peaks_add_up():
+    # كل مسار وحده تحت حد الذروة بعد التطبيع، لكن مجموع الذروات فوقه
+    loudness = {'vocals': stats(-24.0, -4.0), 'drums': stats(-24.0, -4.0)}
+    coefficients, limit = mix_gains(loudness, {'vocals': 1.0, 'drums': 1.0})
+    assert coefficients['vocals'] * 10 ** (-4.0 / 20) < 10 ** (-2.0 / 20)
+    assert limit
+
+    loudness = {'vocals': stats(-24.0, -8.0), 'drums': stats(-24.0, -8.0)}
+    assert not mix_gains(loudness, {'vocals': 1.0, 'drums': 1.0})[1]
+
+
+def test_build_mix_adds_limiter_only_when_needed():
+    tracks = {'vocals': 'vocals.mp3', 'drums': 'drums.mp3'}
+    coefficients = {'vocals': 0.5, 'drums': 0.25}
+
+    graph = filters(build_mix(tracks, coefficients, limit=False))
+    assert 'volume=0.500000' in graph and 'volume=0.250000' in graph
+    assert 'amix=duration=longest:inputs=2:normalize=0' in graph
+    assert 'alimiter' not in graph
+
+    graph = filters(build_mix(tracks, coefficients, limit=True, target_tp=-2.0))
+    assert f'alimiter=level=0:limit={10 ** (-2.0 / 20)}' in graph
+    # حد أدنى يقبله المرشح
+    assert 'limit=0.0625' in filters(build_mix(tracks, coefficients, limit=True, target_tp=-40.0))
+
+
+def test_build_mix_single_track_skips_amix():
+    graph = filters(build_mix({'vocals': 'vocals.mp3'}, {'vocals': 1.0}, limit=False))
+    assert 'amix' not in graph
+
+
+def test_export_key(tmp_path):
+    video = tmp_path / 'video.mp4'
+    track = tmp_path / 'vocals.mp3'
+    video.write_bytes(b'video')
+    track.write_bytes(b'vocals')
+    tracks = {'vocals': str(track)}
+
+    key = export_key(str(video), tracks, {'vocals': 1.0})
+    assert key == export_key(str(video), tracks, {'vocals': 1.0001})
+    assert key != export_key(str(video), tracks, {'vocals': 0.5})
+
+    track.write_bytes(b'new vocals')
+    assert key != export_key(str(video), tracks, {'vocals': 1.0})
@@ -0,0 +1,29 @@
+import os
+import runpy
+
+import pytest
+
+CONF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')
+
+
+def load(monkeypatch, **env):
+    for name in ('JOB_BROKER', 'WEB_CONCURRENCY'):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return runpy.run_path(CONF)
+
+
+def test_single_worker_without_broker(monkeypatch):
+    assert load(monkeypatch)['workers'] == 1
+
+
+def test_multiple_workers_require_broker(monkeypatch):
+    with pytest.raises(RuntimeError, match='JOB_BROKER'):
+        load(monkeypatch, WEB_CONCURRENCY='4')
+
+
+def test_broker_allows_multiple_workers(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 8)
+    assert load(monkeypatch, JOB_BROKER='sqlite:///jobs.db')['workers'] == 4
+    assert load(monkeypatch, JOB_BROKER='sqlite:///jobs.db', WEB_CONCURRENCY='6')['workers'] == 6
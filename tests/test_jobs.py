@@ -0,0 +1,172 @@
+import threading
+import time
+
+import pytest
+
+from utils.jobs import JobCancelled, JobManager, QueueFullError, job_key
+from utils.metrics import JOBS
+
+
+def cancelled_count(kind):
+    return JOBS._values.get(JOBS._key({'kind': kind, 'status': 'cancelled'}), 0)
+
+
+def wait_finished(job, timeout=5):
+    deadline = time.time() + timeout
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.01)
+    assert job.finished
+
+
+@pytest.fixture
+def manager():
+    manager = JobManager(max_workers=1, max_queue=1)
+    yield manager
+    manager.shutdown(wait=False)
+
+
+@pytest.fixture
+def blocker(manager):
+    """مهمة تشغل العامل الوحيد حتى يُطلق الحدث"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def block(job):
+        started.set()
+        release.wait(5)
+        return 'released'
+
+    job = manager.submit('block', block)
+    assert started.wait(5)
+    yield job
+    release.set()
+
+
+def test_job_key_depends_on_kind_and_args():
+    assert job_key('process', ['a.mp3', {'model': 'x'}]) == job_key('process', ['a.mp3', {'model': 'x'}])
+    assert job_key('process', ['a.mp3']) != job_key('export', ['a.mp3'])
+    assert job_key('process', ['a.mp3']) != job_key('process', ['b.mp3'])
+
+
+def test_resubmit_returns_pending_job(manager, blocker):
+    first = manager.submit('add', lambda job, a, b: a + b, 1, 2)
+    assert manager.submit('add', lambda job, a, b: a + b, 1, 2) is first
+    assert manager.pending() == 2
+
+
+def test_finished_job_is_not_reused(manager):
+    first = manager.submit('add', lambda job, a, b: a + b, 1, 2)
+    wait_finished(first)
+    assert (first.status, first.result, first.progress) == ('done', 3, 100.0)
+    assert manager.submit('add', lambda job, a, b: a + b, 1, 2) is not first
+
+
+def test_queue_full(manager, blocker):
+    manager.submit('add', lambda job, a: a, 1)
+    with pytest.raises(QueueFullError):
+        manager.submit('add', lambda job, a: a, 2)
+
+
+def test_cancel_queued_job(manager, blocker):
+    before = cancelled_count('queued')
+    job = manager.submit('queued', lambda job: 'ran')
+    assert manager.cancel(job.id) is job
+    assert job.status == 'cancelled' and job.finished_at is not None
+    assert cancelled_count('queued') == before + 1
+    assert manager.pending() == 1
+
+    # الإلغاء يحرر مكاناً في الطابور، وإعادة الإرسال تنشئ مهمة جديدة
+    again = manager.submit('queued', lambda job: 'ran')
+    assert again is not job
+
+
+def test_cancel_running_job(manager):
+    before = cancelled_count('loop')
+    stopped = threading.Event()
+
+    def loop(job):
+        job.on_cancel(stopped.set)
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+
+    job = manager.submit('loop', loop)
+    while job.status != 'running':
+        time.sleep(0.01)
+    manager.cancel(job.id)
+    wait_finished(job)
+    assert job.status == 'cancelled' and job.error is None
+    assert stopped.is_set()
+    assert cancelled_count('loop') == before + 1
+    # إلغاء مهمة منتهية لا يغير شيئاً
+    assert manager.cancel(job.id).status == 'cancelled'
+    assert manager.cancel('missing') is None
+
+
+def test_failed_job(manager):
+    def explode(job):
+        raise ValueError("boom")
+
+    job = manager.submit('explode', explode)
+    wait_finished(job)
+    assert (job.status, job.error) == ('failed', 'boom')
+
+
+def test_check_cancelled_raises():
+    manager = JobManager(max_workers=1)
+    job = manager.submit('noop', lambda job: None)
+    job.request_cancel()
+    with pytest.raises(JobCancelled):
+        job.check_cancelled()
+    manager.shutdown()
+
+
+def test_in_use_protects_paths_until_finished(manager, blocker, tmp_path):
+    job = manager.submit('read', lambda job: None, uses=[str(tmp_path / 'a' / 'in.wav')])
+    assert manager.in_use(str(tmp_path / 'a'))
+    assert manager.in_use(str(tmp_path / 'a' / 'in.wav'))
+    assert not manager.in_use(str(tmp_path / 'ab'))
+    manager.cancel(job.id)
+    assert not manager.in_use(str(tmp_path / 'a'))
+
+
+def test_finished_jobs_expire():
+    manager = JobManager(max_workers=1, ttl=0)
+    job = manager.submit('add', lambda job: 1)
+    wait_finished(job)
+    time.sleep(0.01)
+    manager.submit('add', lambda job: 2)
+    assert manager.get(job.id) is None
+    manager.shutdown()
+
+
+
+class FinishedJob:
+    finished = True
+    finished_at = 1.0
+
+
+def test_pending_while_jobs_are_pruned(manager):
+    # مقياس عمق الطابور يقرأ pending من خيط آخر أثناء إضافة المهام وحذفها
+    stop = threading.Event()
+    errors = []
+
+    def scrape():
+        while not stop.is_set():
+            try:
+                manager.pending()
+            except RuntimeError as e:
+                errors.append(e)
+
+    manager.ttl = 0
+    thread = threading.Thread(target=scrape)
+    thread.start()
+    try:
+        for _ in range(200):
+            with manager._lock:
+                manager._jobs.update((str(index), FinishedJob()) for index in range(500))
+                manager._prune()
+    finally:
+        stop.set()
+        thread.join(5)
+    assert errors == []
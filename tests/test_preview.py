@@ -0,0 +1,114 @@
+import os
+import json
+import shutil
+import subprocess
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from utils.preview import PreviewMix, load_pcm
+from utils.stems import SOURCES_INFO, SourceWriter
+
+SAMPLERATE = 8000
+
+
+def write_sources(directory, sources):
+    """مجلد مخرجات نموذج (float16) بنفس صيغة LayoutEncoder"""
+    paths = {}
+    for name, samples in sources.items():
+        writer = SourceWriter(os.path.join(directory, f"{name}.f16.npy"), samples.shape[1])
+        writer.write(samples)
+        writer.close()
+        paths[name] = writer.path
+    with open(os.path.join(directory, SOURCES_INFO), 'w', encoding='utf8') as f:
+        json.dump({'samplerate': SAMPLERATE, 'channels': 2, 'sources': list(sources)}, f)
+    return paths
+
+
+@pytest.fixture
+def mix(tmp_path):
+    rng = np.random.default_rng(0)
+    sources = {name: rng.uniform(-0.4, 0.4, (SAMPLERATE, 2)).astype(np.float32) for name in ('vocals', 'drums', 'bass')}
+    paths = write_sources(str(tmp_path), sources)
+    stems = {
+        'vocals': (str(tmp_path / 'vocals.mp3'), [paths['vocals']]),
+        'no_vocals': (str(tmp_path / 'no_vocals.mp3'), [paths['drums'], paths['bass']])
+    }
+    return PreviewMix(stems, {'vocals': 0.5, 'no_vocals': 1.0}), sources
+
+
+def test_mix_from_sources(mix):
+    mix, sources = mix
+    assert (mix.samplerate, mix.channels, mix.frames) == (SAMPLERATE, 2, SAMPLERATE)
+
+    expected = np.zeros((SAMPLERATE, 2), dtype=np.float32)
+    expected += sources['vocals'].astype(np.float16).astype(np.float32) * 0.5
+    expected += sources['drums'].astype(np.float16).astype(np.float32)
+    expected += sources['bass'].astype(np.float16).astype(np.float32)
+    expected = (np.clip(expected, -1, 1) * 32767).astype(np.int16)
+    assert np.array_equal(mix.render(0, mix.frames), expected)
+
+
+@pytest.mark.parametrize('start, stop', [(0, 44), (0, 45), (3, 1001), (44, 47), (45, 4000), (1000, None), (17, 18)])
+def test_iter_bytes_matches_full_output(mix, start, stop):
+    mix, _ = mix
+    full = b''.join(mix.iter_bytes(0, mix.size))
+    assert len(full) == mix.size
+    assert full[:4] == b'RIFF'
+
+    stop = mix.size if stop is None else stop
+    assert b''.join(mix.iter_bytes(start, stop, chunk_frames=97)) == full[start:stop]
+
+
+def test_render_clips_out_of_range(mix):
+    mix, _ = mix
+    assert mix.render(mix.frames - 10, mix.frames + 100).shape == (10, 2)
+    assert mix.render(-5, 0).shape == (0, 2)
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+def test_decoded_stem_is_reported_once(tmp_path):
+    stem_path = str(tmp_path / 'vocals.wav')
+    subprocess.run([
+        'ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', f"sine=duration=1:sample_rate={SAMPLERATE}",
+        '-ac', '2', stem_path
+    ], check=True)
+
+    decoded = []
+    first = load_pcm(stem_path, SAMPLERATE, 2, on_decoded=decoded.append)
+    second = load_pcm(stem_path, SAMPLERATE, 2, on_decoded=decoded.append)
+    assert decoded == [str(tmp_path / 'vocals.pcm.npy')]
+    assert first.shape == second.shape == (SAMPLERATE, 2)
+
+    mix = PreviewMix({'vocals': (stem_path, None)}, {'vocals': 1.0}, SAMPLERATE, 2)
+    assert np.abs(mix.render(0, mix.frames).astype(np.int32) - first).max() <= 1
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+def test_failed_decode_leaves_no_files(tmp_path):
+    import ffmpeg
+
+    stem_path = tmp_path / 'broken.mp3'
+    stem_path.write_bytes(b'not audio')
+    with pytest.raises(ffmpeg.Error):
+        load_pcm(str(stem_path))
+    assert sorted(os.listdir(tmp_path)) == ['broken.mp3']
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+def test_decode_is_written_in_blocks(tmp_path, monkeypatch):
+    from utils import preview
+
+    stem_path = str(tmp_path / 'vocals.wav')
+    subprocess.run([
+        'ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', f"sine=duration=1:sample_rate={SAMPLERATE}",
+        '-ac', '2', stem_path
+    ], check=True)
+    whole = np.array(load_pcm(stem_path, SAMPLERATE, 2))
+    os.remove(str(tmp_path / 'vocals.pcm.npy'))
+
+    monkeypatch.setattr(preview, 'BLOCK_FRAMES', 1000)
+    blocks = load_pcm(stem_path, SAMPLERATE, 2)
+    assert blocks.dtype == np.int16 and blocks.shape == (SAMPLERATE, 2)
+    np.testing.assert_array_equal(blocks, whole)
@@ -0,0 +1,90 @@
+import os
+import shutil
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('torch')
+wavfile = pytest.importorskip('scipy.io.wavfile')
+
+from utils import separator
+from utils.stems import SOURCE_SUFFIX
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+
+SAMPLERATE = 8000
+# مقاطع من 400 إطار بتداخل 80 إطاراً
+SEGMENT = 0.05
+OVERLAP = 0.01
+HOP, FADE = 400, 80
+
+
+class Model:
+    samplerate = SAMPLERATE
+    audio_channels = 2
+    sources = ['drums', 'bass', 'other', 'vocals']
+
+
+@pytest.fixture
+def streaming(tmp_path, monkeypatch):
+    from utils import ffmpeg_utils
+
+    monkeypatch.setattr(separator, '_get_model', lambda name: Model())
+    monkeypatch.setattr(ffmpeg_utils, 'probe_duration', lambda path: None)
+
+    def run(samples, separate):
+        """فصل samples بنموذج وهمي وإرجاع المسارات الكاملة المحفوظة {اسم: (إطارات، قنوات)}"""
+        calls = []
+
+        def run_model_sparse(model, wav, writer=None):
+            calls.append(wav.shape[-1])
+            return separate(wav.numpy(), len(calls) - 1), wav.shape[-1]
+
+        monkeypatch.setattr(separator, '_run_model_sparse', run_model_sparse)
+        input_path = str(tmp_path / 'input.wav')
+        wavfile.write(input_path, SAMPLERATE, samples)
+        sources_dir = str(tmp_path / 'sources')
+        separator._separate_streaming(
+            input_path, str(tmp_path / 'out'), None, 64,
+            segment=SEGMENT, overlap=OVERLAP, model_name='stub', sources_dir=sources_dir
+        )
+        sources = {
+            name: np.load(os.path.join(sources_dir, f"{name}{SOURCE_SUFFIX}")).astype(np.float32)
+            for name in Model.sources
+        }
+        return sources, calls
+
+    return run
+
+
+@pytest.mark.parametrize('frames, calls', [
+    (50, [50]),
+    (HOP, [HOP, FADE]),
+    (HOP + 1, [HOP, FADE + 1]),
+    (2 * HOP, [HOP, HOP + FADE, FADE]),
+    (2 * HOP + 250, [HOP, HOP + FADE, 250 + FADE]),
+])
+def test_streaming_blocks_cover_input(streaming, frames, calls):
+    # نموذج يحافظ على الصوت: كل مسار جزء ثابت من الأصل، فالدمج يجب أن يعيد الأصل بالضبط
+    weights = np.array([0.1, 0.2, 0.3, 0.4], dtype=np.float32)[:, None, None]
+    samples = np.random.default_rng(0).uniform(-0.5, 0.5, (frames, 2)).astype(np.float32)
+    sources, seen = streaming(samples, lambda wav, index: wav[None] * weights)
+
+    assert seen == calls
+    for weight, name in zip(weights.ravel(), Model.sources):
+        assert sources[name].shape == samples.shape
+        np.testing.assert_allclose(sources[name], samples * weight, atol=1e-3)
+
+
+def test_streaming_crossfades_overlap(streaming):
+    # كل مقطع يعطي قيمة ثابتة = رقمه، فمنطقة التداخل يجب أن تكون انتقالاً خطياً بين المقطعين
+    samples = np.zeros((2 * HOP + 250, 2), dtype=np.float32)
+    sources, _ = streaming(samples, lambda wav, index: np.full((4, *wav.shape), index, dtype=np.float32))
+
+    ramp = np.linspace(0.0, 1.0, FADE)
+    expected = np.concatenate([
+        np.zeros(HOP - FADE), ramp, np.ones(HOP - FADE), 1 + ramp, np.full(250, 2.0)
+    ])
+    for name in Model.sources:
+        np.testing.assert_allclose(sources[name][:, 0], expected, atol=2e-3)
+        np.testing.assert_array_equal(sources[name][:, 0], sources[name][:, 1])
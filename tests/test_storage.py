@@ -0,0 +1,130 @@
+import os
+import time
+
+from utils.storage import STALE_AFTER, StorageManager
+
+NOW = 1_000_000.0
+
+
+def make_file(path, size, mtime):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def names(artifacts):
+    return sorted(os.path.basename(artifact.path) for artifact in artifacts)
+
+
+def test_ttl_per_area(tmp_path):
+    storage = StorageManager(quota=10_000, interval=0)
+    storage.add_area('uploads', tmp_path / 'uploads', ttl=100)
+    storage.add_area('cache', tmp_path / 'cache', ttl=None)
+    make_file(tmp_path / 'uploads' / 'old.mp3', 10, NOW - 200)
+    make_file(tmp_path / 'uploads' / 'new.mp3', 10, NOW - 50)
+    make_file(tmp_path / 'cache' / 'key' / 'vocals.mp3', 10, NOW - 10_000)
+
+    assert names(storage.collect(now=NOW)) == ['old.mp3']
+    assert os.listdir(tmp_path / 'uploads') == ['new.mp3']
+    assert os.path.exists(tmp_path / 'cache' / 'key')
+
+
+def test_directory_age_is_newest_file(tmp_path):
+    storage = StorageManager(quota=10_000, interval=0)
+    storage.add_area('cache', tmp_path / 'cache', ttl=100)
+    make_file(tmp_path / 'cache' / 'key' / 'a.mp3', 10, NOW - 500)
+    make_file(tmp_path / 'cache' / 'key' / 'b.mp3', 20, NOW - 10)
+
+    (artifact,) = storage.artifacts()
+    assert (artifact.size, artifact.last_access) == (30, NOW - 10)
+    assert storage.collect(now=NOW) == []
+
+
+def test_quota_removes_least_recently_used(tmp_path):
+    storage = StorageManager(quota=250, interval=0)
+    storage.add_area('exports', tmp_path / 'exports')
+    for index, name in enumerate(['a', 'b', 'c', 'd']):
+        make_file(tmp_path / 'exports' / f'{name}.mp4', 100, NOW - 100 + index)
+
+    removed = storage.collect(now=NOW)
+    assert names(removed) == ['a.mp4', 'b.mp4']
+    assert all(artifact.last_access < NOW for artifact in removed)
+    assert sorted(os.listdir(tmp_path / 'exports')) == ['c.mp4', 'd.mp4']
+
+
+def test_quota_spans_all_areas(tmp_path):
+    storage = StorageManager(quota=150, interval=0)
+    storage.add_area('uploads', tmp_path / 'uploads')
+    storage.add_area('exports', tmp_path / 'exports')
+    make_file(tmp_path / 'uploads' / 'in.mp3', 100, NOW - 10)
+    make_file(tmp_path / 'exports' / 'out.mp4', 100, NOW - 5)
+    assert names(storage.collect(now=NOW)) == ['in.mp3']
+
+
+def test_touch_and_track_refresh_last_access(tmp_path):
+    storage = StorageManager(quota=10_000, interval=0)
+    storage.add_area('exports', tmp_path / 'exports', ttl=100)
+    touched = make_file(tmp_path / 'exports' / 'touched.mp4', 10, NOW - 500)
+    make_file(tmp_path / 'exports' / 'tracked' / 'a.mp3', 10, NOW - 500)
+    make_file(tmp_path / 'exports' / 'stale.mp4', 10, NOW - 500)
+
+    storage.touch(touched)
+    storage.track(str(tmp_path / 'exports' / 'tracked' / 'a.mp3'), 'job:1')
+    (stale,) = storage.collect(now=time.time())
+    assert os.path.basename(stale.path) == 'stale.mp4'
+    owners = {os.path.basename(artifact.path): artifact.owner for artifact in storage.artifacts()}
+    assert owners == {'touched.mp4': None, 'tracked': 'job:1'}
+
+
+def test_pinned_and_protected_items_are_kept(tmp_path):
+    storage = StorageManager(quota=0, interval=0)
+    storage.add_area('exports', tmp_path / 'exports', ttl=1)
+    pinned = make_file(tmp_path / 'exports' / 'pinned' / 'a.mp3', 10, NOW - 500)
+    guarded = make_file(tmp_path / 'exports' / 'guarded.mp4', 10, NOW - 500)
+    make_file(tmp_path / 'exports' / 'free.mp4', 10, NOW - 500)
+    storage.protect(lambda path: path == os.path.abspath(guarded))
+
+    with storage.pin(pinned):
+        assert names(storage.collect(now=NOW)) == ['free.mp4']
+    assert names(storage.collect(now=NOW)) == ['pinned']
+    assert os.path.exists(guarded)
+
+
+def test_hidden_items_are_only_removed_when_stale(tmp_path):
+    storage = StorageManager(quota=0, interval=0)
+    storage.add_area('cache', tmp_path / 'cache', ttl=10)
+    make_file(tmp_path / 'cache' / '.tmp-writing' / 'vocals.mp3', 10, NOW - 60)
+    make_file(tmp_path / 'cache' / '.tmp-abandoned' / 'vocals.mp3', 10, NOW - STALE_AFTER - 1)
+
+    assert names(storage.collect(now=NOW)) == ['.tmp-abandoned']
+    assert os.listdir(tmp_path / 'cache') == ['.tmp-writing']
+
+
+def test_area_remove_can_refuse(tmp_path):
+    refused = []
+
+    def remove(path):
+        refused.append(path)
+        return False
+
+    storage = StorageManager(quota=10_000, interval=0)
+    storage.add_area('cache', tmp_path / 'cache', ttl=1, remove=remove)
+    make_file(tmp_path / 'cache' / 'key' / 'vocals.mp3', 10, NOW - 500)
+    assert storage.collect(now=NOW) == []
+    assert refused == [str(tmp_path / 'cache' / 'key')]
+
+
+def test_nested_areas_are_counted_once(tmp_path):
+    storage = StorageManager(quota=10_000, interval=0)
+    storage.add_area('separated', tmp_path / 'separated', ttl=100)
+    storage.add_area('cache', tmp_path / 'separated' / 'cache', ttl=None)
+    make_file(tmp_path / 'separated' / 'legacy.mp3', 10, NOW - 500)
+    make_file(tmp_path / 'separated' / 'cache' / 'key' / 'vocals.mp3', 10, NOW - 500)
+
+    assert sorted((artifact.area, os.path.basename(artifact.path)) for artifact in storage.artifacts()) == [
+        ('cache', 'key'), ('separated', 'legacy.mp3')
+    ]
+    assert names(storage.collect(now=NOW)) == ['legacy.mp3']
+    assert os.path.exists(tmp_path / 'separated' / 'cache' / 'key')
@@ -0,0 +1,232 @@
+import io
+
+import pytest
+
+from utils import uploads as uploads_module
+from utils.uploads import (
+    InvalidMediaError, UploadError, UploadManager, UploadNotFoundError, UploadOffsetError, UploadTooLargeError
+)
+
+WAV_HEADER = b'RIFF\x00\x00\x00\x00WAVE'
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    """استبدال ffprobe: كل ملف يحتوي مساراً صوتياً إلا إذا تغيرت القيمة"""
+    calls = []
+    result = {'has_audio': True}
+
+    def probe(path):
+        calls.append(path)
+        return result['has_audio']
+
+    monkeypatch.setattr(uploads_module, 'probe_has_audio', probe)
+    monkeypatch.setattr(uploads_module, 'PROBE_BYTES', 64)
+    return calls, result
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return UploadManager(max_size=1024, state_dir=str(tmp_path / '.sessions'))
+
+
+def start(manager, tmp_path, size=128):
+    return manager.create('song.wav', str(tmp_path / 'song.wav'), size)
+
+
+def body(size):
+    return WAV_HEADER + bytes(range(256)) * (size // 256 + 1)
+
+
+def test_create_validates_size(manager, tmp_path):
+    with pytest.raises(UploadError):
+        manager.create('a.wav', str(tmp_path / 'a.wav'), 0)
+    with pytest.raises(UploadTooLargeError):
+        manager.create('a.wav', str(tmp_path / 'a.wav'), 2048)
+
+
+def test_chunks_are_written_in_order(manager, tmp_path, probes):
+    data = body(128)[:128]
+    upload = start(manager, tmp_path)
+    assert manager.is_pending('song.wav')
+    assert manager.write(upload, 0, io.BytesIO(data[:50])) == 50
+    assert upload.format == 'wav' and not upload.validated
+    assert manager.write(upload, 50, io.BytesIO(data[50:])) == 128
+    assert upload.validated
+
+    assert manager.finalize(upload) is upload
+    assert not manager.is_pending('song.wav')
+    assert (tmp_path / 'song.wav').read_bytes() == data
+    # الملف فُحص أثناء الرفع، فلا يُعاد فحصه عند الإنهاء
+    assert len(probes[0]) == 1
+
+
+def test_gap_is_rejected_with_resume_offset(manager, tmp_path, probes):
+    upload = start(manager, tmp_path)
+    manager.write(upload, 0, io.BytesIO(body(128)[:32]))
+    with pytest.raises(UploadOffsetError) as error:
+        manager.write(upload, 40, io.BytesIO(b'x' * 8))
+    assert error.value.offset == 32
+    with pytest.raises(UploadOffsetError):
+        manager.write(upload, -1, io.BytesIO(b'x'))
+
+
+def test_resent_chunk_does_not_move_offset(manager, tmp_path, probes):
+    data = body(128)[:128]
+    upload = start(manager, tmp_path)
+    manager.write(upload, 0, io.BytesIO(data[:100]))
+    assert manager.write(upload, 64, io.BytesIO(data[64:80])) == 100
+    assert manager.write(upload, 64, io.BytesIO(data[64:])) == 128
+    manager.finalize(upload)
+    assert (tmp_path / 'song.wav').read_bytes() == data
+
+
+class BrokenStream:
+    """تدفق ينقطع بعد عدد محدد من البايتات"""
+
+    def __init__(self, data):
+        self.data = data
+        self.sent = False
+
+    def read(self, size):
+        if self.sent:
+            raise ConnectionError("client disconnected")
+        self.sent = True
+        return self.data
+
+
+def test_interrupted_chunk_keeps_received_bytes(manager, tmp_path, probes, monkeypatch):
+    monkeypatch.setattr(uploads_module, 'COPY_BLOCK', 16)
+    data = body(128)[:128]
+    upload = start(manager, tmp_path)
+    with pytest.raises(ConnectionError):
+        manager.write(upload, 0, BrokenStream(data[:16]))
+    assert upload.received == 16
+    assert manager.write(upload, 16, io.BytesIO(data[16:])) == 128
+
+
+def test_chunk_past_declared_size(manager, tmp_path, probes):
+    upload = start(manager, tmp_path, size=16)
+    with pytest.raises(UploadTooLargeError):
+        manager.write(upload, 0, io.BytesIO(body(32)[:32]))
+
+
+def test_unknown_format_is_rejected_early(manager, tmp_path, probes):
+    upload = start(manager, tmp_path)
+    with pytest.raises(InvalidMediaError):
+        manager.write(upload, 0, io.BytesIO(b'not a media file'))
+    assert not manager.is_pending('song.wav')
+    assert not (tmp_path / 'song.wav').exists()
+
+
+def test_file_without_audio_is_rejected(manager, tmp_path, probes):
+    probes[1]['has_audio'] = False
+    upload = start(manager, tmp_path)
+    with pytest.raises(InvalidMediaError):
+        manager.write(upload, 0, io.BytesIO(body(128)[:128]))
+    assert not (tmp_path / 'song.wav').exists()
+
+
+def test_rewriting_header_revalidates(manager, tmp_path, probes):
+    data = body(128)[:128]
+    upload = start(manager, tmp_path)
+    manager.write(upload, 0, io.BytesIO(data[:100]))
+    assert upload.validated
+
+    # إعادة إرسال بداية الملف بمحتوى مختلف لا تحتفظ بنتيجة الفحص القديمة
+    with pytest.raises(InvalidMediaError):
+        manager.write(upload, 0, io.BytesIO(b'X' * 32))
+    assert not (tmp_path / 'song.wav').exists()
+
+
+def test_rewriting_probe_range_probes_again(manager, tmp_path, probes):
+    data = body(128)[:128]
+    upload = start(manager, tmp_path)
+    manager.write(upload, 0, io.BytesIO(data[:100]))
+    probes[1]['has_audio'] = False
+    with pytest.raises(InvalidMediaError):
+        manager.write(upload, 32, io.BytesIO(data[32:64]))
+    assert len(probes[0]) == 2
+
+
+def test_rewriting_after_probe_range_keeps_validation(manager, tmp_path, probes):
+    data = body(128)[:128]
+    upload = start(manager, tmp_path)
+    manager.write(upload, 0, io.BytesIO(data[:100]))
+    manager.write(upload, 80, io.BytesIO(data[80:]))
+    assert upload.validated and len(probes[0]) == 1
+
+
+def test_finalize_requires_all_bytes(manager, tmp_path, probes):
+    upload = start(manager, tmp_path)
+    manager.write(upload, 0, io.BytesIO(body(128)[:100]))
+    with pytest.raises(UploadOffsetError) as error:
+        manager.finalize(upload)
+    assert error.value.offset == 100
+    assert manager.is_pending('song.wav')
+
+
+def test_finalize_probes_unvalidated_file(manager, tmp_path, probes, monkeypatch):
+    def unreadable(path):
+        probes[0].append(path)
+        raise uploads_module.ffmpeg.Error('ffprobe', b'', b'moov atom not found')
+
+    monkeypatch.setattr(uploads_module, 'probe_has_audio', unreadable)
+    upload = start(manager, tmp_path)
+    manager.write(upload, 0, io.BytesIO(body(128)[:128]))
+    assert not upload.validated
+
+    with pytest.raises(InvalidMediaError):
+        manager.finalize(upload)
+    assert len(probes[0]) == 2
+    assert not (tmp_path / 'song.wav').exists()
+
+
+def test_stale_uploads_are_pruned(tmp_path, probes):
+    manager = UploadManager(max_size=1024, state_dir=str(tmp_path / '.sessions'), ttl=-1)
+    upload = start(manager, tmp_path)
+    manager.create('other.wav', str(tmp_path / 'other.wav'), 10)
+    assert manager.get(upload.id) is None
+    assert not (tmp_path / 'song.wav').exists()
+    assert manager.get(manager._sessions()[0]).filename == 'other.wav'
+
+
+def test_session_is_shared_between_processes(tmp_path, probes):
+    # كل عملية ويب لها UploadManager خاص بها على نفس المجلد
+    first = UploadManager(max_size=1024, state_dir=str(tmp_path / '.sessions'))
+    second = UploadManager(max_size=1024, state_dir=str(tmp_path / '.sessions'))
+    data = body(128)[:128]
+    upload = start(first, tmp_path)
+
+    assert second.is_pending('song.wav')
+    assert second.write(second.get(upload.id), 0, io.BytesIO(data[:100])) == 100
+    assert first.get(upload.id).to_dict() == {
+        'upload_id': upload.id, 'filename': 'song.wav', 'size': 128, 'offset': 100, 'format': 'wav',
+        'validated': True
+    }
+
+    # الكائن القديم في العملية الأولى يُحدَّث من القرص قبل الكتابة
+    with pytest.raises(UploadOffsetError) as error:
+        first.write(upload, 120, io.BytesIO(data[120:]))
+    assert error.value.offset == 100
+    assert first.write(upload, 100, io.BytesIO(data[100:])) == 128
+
+    second.finalize(second.get(upload.id))
+    assert first.get(upload.id) is None
+    assert not first.is_pending('song.wav')
+    assert (tmp_path / 'song.wav').read_bytes() == data
+    with pytest.raises(UploadNotFoundError):
+        first.write(upload, 128, io.BytesIO(b''))
+
+
+def test_offset_is_derived_from_file(manager, tmp_path, probes):
+    upload = start(manager, tmp_path)
+    manager.write(upload, 0, io.BytesIO(body(128)[:40]))
+    with open(tmp_path / 'song.wav', 'ab') as f:
+        f.write(b'x' * 10)
+    assert manager.get(upload.id).received == 50
+
+
+@pytest.mark.parametrize('upload_id', ['..', '../song', 'ABC', '0' * 31])
+def test_invalid_upload_id(manager, upload_id):
+    assert manager.get(upload_id) is None
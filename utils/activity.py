@@ -0,0 +1,74 @@
+import numpy as np
+
+# طول نافذة حساب الطاقة بالثواني
+WINDOW = 0.05
+
+# طول التلاشي عند حدود المناطق التي مرت بالنموذج بالثواني
+FADE = 0.01
+
+
+def rms_envelope(samples, samplerate, window=WINDOW):
+    """
+    طاقة RMS بالديسيبل (dBFS) لكل نافذة في مرور واحد على الإشارة
+
+    :param samples: مصفوفة (قنوات، إطارات)
+    """
+    size = max(1, int(window * samplerate))
+    channels, frames = samples.shape
+    count = -(-frames // size)
+    power = np.zeros(count * size, dtype=np.float32)
+    # مجموع المربعات لكل إطار عبر القنوات دون مصفوفة وسيطة بحجم الإشارة
+    power[:frames] = np.einsum('ct,ct->t', samples, samples) / channels
+    power = power.reshape(count, size).mean(axis=1)
+    return 10.0 * np.log10(power + 1e-12)
+
+
+def active_regions(samples, samplerate, threshold_db=-50.0, min_silence=4.0, margin=0.5, window=WINDOW):
+    """
+    المناطق المسموعة التي يجب تشغيل النموذج عليها
+
+    فترات الصمت الأقصر من min_silence تُعتبر مسموعة (تقسيم النموذج لأجلها لا يوفر شيئاً)،
+    وكل منطقة تُوسّع بـ margin ثانية من الجانبين حتى يرى النموذج بداية الصوت ونهايته.
+
+    :param samples: مصفوفة (قنوات، إطارات)
+    :return: [(البداية، النهاية)] بالإطارات، مرتبة وغير متداخلة ([] إذا كان الملف كله صامتاً)
+    """
+    size = max(1, int(window * samplerate))
+    frames = samples.shape[-1]
+    silent = rms_envelope(samples, samplerate, window) < threshold_db
+
+    # بدايات ونهايات فترات الصمت (بالنوافذ)
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * size
+    ends = np.minimum(np.flatnonzero(edges == -1) * size, frames)
+
+    pad = int(margin * samplerate)
+    regions = []
+    position = 0
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if end - start < min_silence * samplerate:
+            continue
+        # الهامش يُؤخذ من الصمت، إلا عند بداية الملف ونهايته
+        start = start + pad if start > 0 else 0
+        end = end - pad if end < frames else frames
+        if end <= start:
+            continue
+        if start > position:
+            regions.append((position, start))
+        position = end
+    if position < frames:
+        regions.append((position, frames))
+    return regions
+
+
+def edge_weights(length, fade, fade_in=True, fade_out=True):
+    """أوزان بطول المنطقة: 1 في الداخل مع تلاشٍ خطي عند الأطراف المحددة"""
+    weights = np.ones(length, dtype=np.float32)
+    fade = min(fade, length // 2)
+    if fade:
+        ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)
+        if fade_in:
+            weights[:fade] = ramp
+        if fade_out:
+            weights[-fade:] = ramp[::-1]
+    return weights
@@ -1,77 +1,108 @@
 import os
-import librosa
-import soundfile as sf
-from scipy import signal
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import numpy as np
-import noisereduce as nr
-from pydub import AudioSegment
-import tempfile
+from utils.metrics import stage
+
+# librosa و scipy و noisereduce تُستورد داخل الدوال فقط: استيرادها يستغرق ثوانٍ
+# ومئات الميغابايت، ولا تحتاجها إلا عمليات المعالجة الصوتية
+
+# نطاقات الفصل بالترتيب: صوت بشري، آلات موسيقية، أصوات طبيعية، مؤثرات صوتية
+BANDS = ((80, 5000), (100, 10000), (10, 2000), (50, 8000))
+
+# حجم الكتلة عند الترشيح لتقليل الذاكرة المؤقتة
+BLOCK_SIZE = 1 << 18
+
+@lru_cache(maxsize=64)
+def butter_sos(sr, lowcut=None, highcut=None, order=5):
+    """تصميم مرشح Butterworth بصيغة SOS مرة واحدة لكل معدل عينة ونطاق"""
+    from scipy import signal
+
+    if lowcut and highcut:
+        return signal.butter(order, [lowcut, highcut], btype='band', fs=sr, output='sos')
+    if lowcut:
+        return signal.butter(order, lowcut, btype='high', fs=sr, output='sos')
+    return signal.butter(order, highcut, btype='low', fs=sr, output='sos')
+
+def sosfilt_into(sos, x, out, gain=1.0, accumulate=False):
+    """ترشيح على كتل مع حفظ الحالة بين الكتل والكتابة مباشرة في مصفوفة جاهزة"""
+    from scipy import signal
+
+    zi = np.zeros((sos.shape[0], 2))
+    for start in range(0, len(x), BLOCK_SIZE):
+        end = start + BLOCK_SIZE
+        block, zi = signal.sosfilt(sos, x[start:end], zi=zi)
+        if gain != 1.0:
+            block *= gain
+        if accumulate:
+            out[start:end] += block
+        else:
+            out[start:end] = block
+    return out
+
+def filter_bands(y, sr, bands, out=None):
+    """
+    تطبيق كل مرشحات النطاقات على نفس الإشارة بالتوازي
+    (sosfilt يحرر GIL لذلك تعمل الخيوط على أنوية مختلفة)
+
+    :return: مصفوفة (عدد النطاقات × عدد العينات)
+    """
+    if out is None:
+        out = np.empty((len(bands), len(y)), dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=min(len(bands), os.cpu_count() or 1)) as executor:
+        futures = [
+            executor.submit(sosfilt_into, butter_sos(sr, low, high), y, out[i])
+            for i, (low, high) in enumerate(bands)
+        ]
+        for future in futures:
+            future.result()
+    return out
 
 def separate_tracks(input_path, output_dir, original_filename):
+    import librosa
+    import noisereduce as nr
+    import soundfile as sf
+
     try:
         # تحميل الملف الصوتي
-        y, sr = librosa.load(input_path, sr=44100, mono=True)
+        with stage('dsp_load'):
+            y, sr = librosa.load(input_path, sr=44100, mono=True)
         
         # 1. تطبيق فلاتر متقدمة لتحسين الجودة
         # تخفيض الضوضاء باستخدام noisereduce فقط
-        y = nr.reduce_noise(y=y, sr=sr, stationary=True)
+        with stage('dsp_denoise'):
+            y = nr.reduce_noise(y=y, sr=sr, stationary=True)
         
         # تحسين نطاق الترددات
         y = librosa.effects.preemphasis(y)
         
         # 2. فصل المسارات المتقدمة
-        # تصميم المرشحات المتقدمة
-        def butter_bandpass(lowcut, highcut, fs, order=5):
-            nyq = 0.5 * fs
-            low = lowcut / nyq
-            high = highcut / nyq
-            b, a = signal.butter(order, [low, high], btype='band')
-            return b, a
-
-        def butter_highpass(cutoff, fs, order=5):
-            nyq = 0.5 * fs
-            normal_cutoff = cutoff / nyq
-            b, a = signal.butter(order, normal_cutoff, btype='high')
-            return b, a
-
-        def butter_lowpass(cutoff, fs, order=5):
-            nyq = 0.5 * fs
-            normal_cutoff = cutoff / nyq
-            b, a = signal.butter(order, normal_cutoff, btype='low')
-            return b, a
-
+        # كل النطاقات تُحسب بالتوازي في مصفوفة واحدة (نطاقات × عينات)
         # المسارات:
         # - الصوت البشري (80-5000 هرتز)
-        b, a = butter_bandpass(80, 5000, sr)
-        vocals = signal.lfilter(b, a, y)
-        
         # - الآلات الموسيقية (100-10000 هرتز)
-        b, a = butter_bandpass(100, 10000, sr)
-        instruments = signal.lfilter(b, a, y)
-        
         # - الأصوات الطبيعية (10-2000 هرتز)
-        b, a = butter_bandpass(10, 2000, sr)
-        nature = signal.lfilter(b, a, y)
-        
         # - المؤثرات الصوتية (50-8000 هرتز)
-        b, a = butter_bandpass(50, 8000, sr)
-        effects = signal.lfilter(b, a, y)
+        with stage('dsp_filter', bands=len(BANDS)):
+            vocals, instruments, nature, effects = filter_bands(y, sr, BANDS)
         
         # 3. تنقية وتوازن المسارات
-        vocals = nr.reduce_noise(y=vocals, sr=sr)
-        instruments = apply_compressor(instruments, sr)
-        nature = apply_eq(nature, sr, bass_boost=2.0)
-        effects = apply_reverb(effects, sr, room_size=0.5)
+        with stage('dsp_effects'):
+            vocals = nr.reduce_noise(y=vocals, sr=sr)
+            instruments = apply_compressor(instruments, sr)
+            nature = apply_eq(nature, sr, bass_boost=2.0)
+            effects = apply_reverb(effects, sr, room_size=0.5)
         
         # 4. حفظ النتائج باسم معدل
         base_name = os.path.splitext(original_filename)[0] + " (معدله)"
         os.makedirs(output_dir, exist_ok=True)
         
         # إنشاء أسماء الملفات المعدلة
-        sf.write(f"{output_dir}/{base_name} - صوت بشري.wav", vocals, sr)
-        sf.write(f"{output_dir}/{base_name} - آلات موسيقية.wav", instruments, sr)
-        sf.write(f"{output_dir}/{base_name} - أصوات طبيعية.wav", nature, sr)
-        sf.write(f"{output_dir}/{base_name} - مؤثرات صوتية.wav", effects, sr)
+        with stage('dsp_write'):
+            sf.write(f"{output_dir}/{base_name} - صوت بشري.wav", vocals, sr)
+            sf.write(f"{output_dir}/{base_name} - آلات موسيقية.wav", instruments, sr)
+            sf.write(f"{output_dir}/{base_name} - أصوات طبيعية.wav", nature, sr)
+            sf.write(f"{output_dir}/{base_name} - مؤثرات صوتية.wav", effects, sr)
         
         # إرجاع المسارات مع أسمائها المعدلة
         track_names = {
@@ -89,27 +120,29 @@ def separate_tracks(input_path, output_dir, original_filename):
 # === وظائف معالجة إضافية ===
 def apply_compressor(audio, sr, threshold=-20.0, ratio=4.0):
     """تطبيق ضاغط ديناميكي"""
+    import librosa
+
     # حل بديل بسيط للضاغط
     audio = librosa.mu_compress(audio, mu=255)
     return audio
 
 def apply_eq(audio, sr, bass_boost=1.0, treble_boost=1.0):
     """تطبيق معادل ترددي"""
+    out = np.empty_like(audio)
     # تعزيز الترددات المنخفضة
-    sos = signal.butter(4, 100, 'lowpass', fs=sr, output='sos')
-    bass = signal.sosfilt(sos, audio) * bass_boost
+    sosfilt_into(butter_sos(sr, highcut=100, order=4), audio, out, gain=bass_boost)
     
     # تعزيز الترددات العالية
-    sos = signal.butter(4, 5000, 'highpass', fs=sr, output='sos')
-    treble = signal.sosfilt(sos, audio) * treble_boost
+    sosfilt_into(butter_sos(sr, lowcut=5000, order=4), audio, out, gain=treble_boost, accumulate=True)
     
-    return bass + treble
+    return out
 
 def apply_reverb(audio, sr, room_size=0.5):
     """تطبيق صدى صوتي"""
     # حل بديل بسيط للصدى
     D = int(room_size * sr)  # تأخير
     decay = 0.5
-    delayed = np.zeros_like(audio)
-    delayed[D:] = audio[:-D] * decay
-    return audio + delayed
\ No newline at end of file
+    out = audio.copy()
+    if 0 < D < len(audio):
+        out[D:] += audio[:-D] * decay
+    return out
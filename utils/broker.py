@@ -0,0 +1,501 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from utils.jobs import QueueFullError
+from utils.metrics import log_event
+
+# حقول السجل التي تُحفظ كنص JSON
+JSON_FIELDS = ('args', 'uses', 'result', 'partial')
+FLOAT_FIELDS = ('progress', 'lease_until', 'created_at', 'started_at', 'finished_at')
+INT_FIELDS = ('attempts', 'max_attempts')
+
+# سبب الفشل عندما تتوقف العقدة (انتهاء الحجز) في كل المحاولات
+LOST_ERROR = "Job was lost by its worker too many times"
+
+
+def new_record(kind, args, uses, key, max_attempts):
+    return {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'key': key,
+        'args': list(args),
+        'uses': list(uses),
+        'status': 'queued',
+        'stage': None,
+        'progress': 0.0,
+        'result': None,
+        'partial': None,
+        'error': None,
+        'attempts': 0,
+        'max_attempts': max_attempts,
+        'worker': None,
+        'lease_until': None,
+        'cancel': False,
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None
+    }
+
+
+def _encode(record, null=None):
+    encoded = {}
+    for name, value in record.items():
+        if name in JSON_FIELDS:
+            value = json.dumps(value)
+        elif name == 'cancel':
+            value = int(value)
+        elif value is None:
+            value = null
+        encoded[name] = value
+    return encoded
+
+
+def _decode(row):
+    record = {}
+    for name, value in row.items():
+        if value == '':
+            value = None
+        if name in JSON_FIELDS:
+            value = json.loads(value) if value is not None else None
+        elif name in FLOAT_FIELDS and value is not None:
+            value = float(value)
+        elif name in INT_FIELDS:
+            value = int(value)
+        elif name == 'cancel':
+            value = bool(int(value or 0))
+        record[name] = value
+    return record
+
+
+class Broker(ABC):
+    """
+    طابور مهام مشترك بين عقدة الويب وعقد المعالجة
+
+    كل مهمة سجل (dict) بحقول Job.to_dict نفسها مع args و uses و attempts. العقدة التي تسحب
+    مهمة تحجزها لمدة lease ثانية وتجدد الحجز مع كل heartbeat؛ إذا انتهى الحجز دون تجديد
+    (توقفت العقدة) تعود المهمة إلى الطابور، حتى max_attempts محاولات.
+    """
+
+    @abstractmethod
+    def enqueue(self, kind, args, uses=(), key=None, max_attempts=3, max_pending=None):
+        """
+        إضافة مهمة، أو إرجاع المهمة غير المنتهية التي لها نفس key
+
+        :param max_pending: الحد الأقصى للمهام غير المنتهية (يُفحص ذرياً مع الإضافة)
+        :raises QueueFullError: عند الوصول إلى max_pending
+        """
+
+    @abstractmethod
+    def get(self, job_id):
+        """السجل، أو None إذا لم تكن المهمة موجودة (أو حُذفت بعد انتهاء ttl)"""
+
+    @abstractmethod
+    def active(self):
+        """سجلات المهام في الانتظار أو قيد التشغيل"""
+
+    def pending(self):
+        return len(self.active())
+
+    @abstractmethod
+    def claim(self, worker, lease):
+        """حجز أقدم مهمة في الانتظار، أو None إذا كان الطابور فارغاً"""
+
+    @abstractmethod
+    def heartbeat(self, job_id, worker, lease, progress, stage, partial):
+        """
+        تجديد الحجز ونشر التقدم
+
+        :return: None إذا لم تعد العقدة تملك المهمة، وإلا هل طُلب إلغاؤها
+        """
+
+    @abstractmethod
+    def finish(self, job_id, worker, status, result=None, error=None):
+        """:return: False إذا لم تعد العقدة تملك المهمة (انتهى الحجز وأخذتها عقدة أخرى)"""
+
+    @abstractmethod
+    def cancel(self, job_id):
+        """إلغاء مهمة في الانتظار فوراً، أو طلب إيقاف مهمة قيد التشغيل (تراه العقدة في heartbeat)"""
+
+    def close(self):
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT,
+    args TEXT NOT NULL,
+    uses TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    partial TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key);
+"""
+
+
+class SQLiteBroker(Broker):
+    """
+    وسيط محلي في ملف SQLite لعدة عمليات على نفس الجهاز (للتطوير والاختبار)
+
+    أقفال SQLite لا تعمل بشكل موثوق على أنظمة الملفات الشبكية، لذلك للعقد على أجهزة
+    مختلفة يُستخدم RedisBroker.
+
+    :param ttl: مدة الاحتفاظ بالمهام المنتهية بالثواني
+    """
+
+    def __init__(self, path, ttl=3600):
+        self.path = os.path.abspath(path)
+        self.ttl = ttl
+        self._local = threading.local()
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        # اتصال لكل خيط: اتصالات sqlite3 لا تُشارك بين الخيوط
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE يأخذ قفل الكتابة من البداية حتى لا تحجز عمليتان نفس المهمة
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @staticmethod
+    def _get(db, job_id):
+        row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _decode(dict(row)) if row is not None else None
+
+    def enqueue(self, kind, args, uses=(), key=None, max_attempts=3, max_pending=None):
+        with self._transaction() as db:
+            db.execute("DELETE FROM jobs WHERE finished_at < ?", (time.time() - self.ttl,))
+            if key is not None:
+                row = db.execute(
+                    "SELECT * FROM jobs WHERE key = ? AND status IN ('queued', 'running') AND NOT cancel",
+                    (key,)
+                ).fetchone()
+                if row is not None:
+                    return _decode(dict(row))
+            if max_pending is not None:
+                pending = db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+                ).fetchone()[0]
+                if pending >= max_pending:
+                    raise QueueFullError("Job queue is full")
+            record = new_record(kind, args, uses, key, max_attempts)
+            encoded = _encode(record)
+            db.execute(
+                f"INSERT INTO jobs ({', '.join(encoded)}) VALUES ({', '.join('?' * len(encoded))})",
+                tuple(encoded.values())
+            )
+        return record
+
+    def get(self, job_id):
+        return self._get(self._db(), job_id)
+
+    def active(self):
+        rows = self._db().execute(
+            "SELECT * FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        ).fetchall()
+        return [_decode(dict(row)) for row in rows]
+
+    def pending(self):
+        return self._db().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()[0]
+
+    def _expire(self, db, now):
+        """المهام التي انتهى حجزها: تُلغى أو تفشل أو تعود إلى الطابور"""
+        expired = "status = 'running' AND lease_until < ?"
+        db.execute(f"UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE {expired} AND cancel", (now, now))
+        db.execute(
+            f"UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+            f"WHERE {expired} AND attempts >= max_attempts",
+            (LOST_ERROR, now, now)
+        )
+        requeued = db.execute(
+            f"UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL WHERE {expired}", (now,)
+        ).rowcount
+        if requeued:
+            log_event('jobs_requeued', count=requeued, reason='lease_expired')
+
+    def claim(self, worker, lease):
+        now = time.time()
+        with self._transaction() as db:
+            self._expire(db, now)
+            row = db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                "started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (worker, now + lease, now, row['id'])
+            )
+            return self._get(db, row['id'])
+
+    def heartbeat(self, job_id, worker, lease, progress, stage, partial):
+        with self._transaction() as db:
+            updated = db.execute(
+                "UPDATE jobs SET lease_until = ?, progress = ?, stage = ?, partial = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + lease, progress, stage, json.dumps(partial), job_id, worker)
+            ).rowcount
+            if not updated:
+                return None
+            return bool(db.execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+
+    def finish(self, job_id, worker, status, result=None, error=None):
+        return self._db().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL, "
+            "progress = CASE WHEN ? = 'done' THEN 100 ELSE progress END "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (status, json.dumps(result), error, time.time(), status, job_id, worker)
+        ).rowcount > 0
+
+    def cancel(self, job_id):
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET cancel = 1 WHERE id = ? AND status IN ('queued', 'running')", (job_id,))
+            db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            )
+            return self._get(db, job_id)
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+# === سكربتات Redis: كل عملية قراءة ثم كتابة تتم بشكل ذري على الخادم ===
+ENQUEUE_SCRIPT = """
+local prefix, id, key, ttl, max_pending = ARGV[1], ARGV[2], ARGV[3], ARGV[4], tonumber(ARGV[5])
+if key ~= '' then
+    local existing = redis.call('GET', prefix .. 'key:' .. key)
+    if existing then
+        local job = prefix .. 'job:' .. existing
+        local status = redis.call('HGET', job, 'status')
+        if (status == 'queued' or status == 'running') and redis.call('HGET', job, 'cancel') ~= '1' then
+            return existing
+        end
+    end
+end
+-- 0 = بلا حد؛ النتيجة الفارغة تعني أن الطابور ممتلئ
+if max_pending > 0 and redis.call('SCARD', KEYS[2]) >= max_pending then
+    return false
+end
+if key ~= '' then
+    redis.call('SET', prefix .. 'key:' .. key, id, 'EX', ttl)
+end
+redis.call('HSET', prefix .. 'job:' .. id, unpack(ARGV, 6))
+redis.call('RPUSH', KEYS[1], id)
+redis.call('SADD', KEYS[2], id)
+return id
+"""
+
+CLAIM_SCRIPT = """
+local prefix, now, lease_until, worker, ttl = ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5]
+local function finish(job, id, status, err)
+    redis.call('HSET', job, 'status', status, 'error', err, 'finished_at', now, 'lease_until', '')
+    redis.call('SREM', KEYS[3], id)
+    redis.call('EXPIRE', job, ttl)
+end
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', '(' .. now)) do
+    redis.call('ZREM', KEYS[2], id)
+    local job = prefix .. 'job:' .. id
+    if redis.call('HGET', job, 'status') == 'running' then
+        if redis.call('HGET', job, 'cancel') == '1' then
+            finish(job, id, 'cancelled', '')
+        elseif tonumber(redis.call('HGET', job, 'attempts')) >= tonumber(redis.call('HGET', job, 'max_attempts')) then
+            finish(job, id, 'failed', ARGV[6])
+        else
+            redis.call('HSET', job, 'status', 'queued', 'worker', '', 'lease_until', '')
+            redis.call('LPUSH', KEYS[1], id)
+        end
+    end
+end
+while true do
+    local id = redis.call('LPOP', KEYS[1])
+    if not id then
+        return false
+    end
+    local job = prefix .. 'job:' .. id
+    if redis.call('HGET', job, 'status') == 'queued' then
+        redis.call('HINCRBY', job, 'attempts', 1)
+        redis.call('HSET', job, 'status', 'running', 'worker', worker, 'lease_until', lease_until)
+        if redis.call('HGET', job, 'started_at') == '' then
+            redis.call('HSET', job, 'started_at', now)
+        end
+        redis.call('ZADD', KEYS[2], lease_until, id)
+        return id
+    end
+end
+"""
+
+HEARTBEAT_SCRIPT = """
+local job = ARGV[1] .. 'job:' .. ARGV[2]
+if redis.call('HGET', job, 'status') ~= 'running' or redis.call('HGET', job, 'worker') ~= ARGV[3] then
+    return -1
+end
+redis.call('HSET', job, 'lease_until', ARGV[4], 'progress', ARGV[5], 'stage', ARGV[6], 'partial', ARGV[7])
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[2])
+if redis.call('HGET', job, 'cancel') == '1' then
+    return 1
+end
+return 0
+"""
+
+FINISH_SCRIPT = """
+local job = ARGV[1] .. 'job:' .. ARGV[2]
+if redis.call('HGET', job, 'status') ~= 'running' or redis.call('HGET', job, 'worker') ~= ARGV[3] then
+    return 0
+end
+redis.call('HSET', job, 'status', ARGV[4], 'result', ARGV[5], 'error', ARGV[6], 'finished_at', ARGV[7], 'lease_until', '')
+if ARGV[4] == 'done' then
+    redis.call('HSET', job, 'progress', 100)
+end
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('SREM', KEYS[2], ARGV[2])
+redis.call('EXPIRE', job, ARGV[8])
+return 1
+"""
+
+CANCEL_SCRIPT = """
+local job = ARGV[1] .. 'job:' .. ARGV[2]
+local status = redis.call('HGET', job, 'status')
+if status == 'queued' then
+    redis.call('HSET', job, 'status', 'cancelled', 'cancel', '1', 'finished_at', ARGV[3])
+    redis.call('SREM', KEYS[1], ARGV[2])
+    redis.call('EXPIRE', job, ARGV[4])
+elseif status == 'running' then
+    redis.call('HSET', job, 'cancel', '1')
+end
+return 1
+"""
+
+
+class RedisBroker(Broker):
+    """
+    وسيط في Redis (أو خادم متوافق مثل Valkey و KeyDB) للعقد على أجهزة مختلفة
+
+    كل مهمة hash في <prefix>job:<id>، والطابور قائمة، والمهام المحجوزة sorted set بوقت انتهاء الحجز.
+    المهام المنتهية تُحذف تلقائياً بعد ttl عبر EXPIRE.
+
+    :param client: عميل Redis جاهز بـ decode_responses=True (بدلاً من url، مثلاً في الاختبارات)
+    """
+
+    def __init__(self, url=None, ttl=3600, prefix='separator:', client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.queue = prefix + 'queue'
+        self.running = prefix + 'running'
+        self.active_set = prefix + 'active'
+        self._enqueue = self.client.register_script(ENQUEUE_SCRIPT)
+        self._claim = self.client.register_script(CLAIM_SCRIPT)
+        self._heartbeat = self.client.register_script(HEARTBEAT_SCRIPT)
+        self._finish = self.client.register_script(FINISH_SCRIPT)
+        self._cancel = self.client.register_script(CANCEL_SCRIPT)
+
+    def enqueue(self, kind, args, uses=(), key=None, max_attempts=3, max_pending=None):
+        record = new_record(kind, args, uses, key, max_attempts)
+        fields = [item for pair in _encode(record, null='').items() for item in pair]
+        job_id = self._enqueue(
+            keys=[self.queue, self.active_set],
+            args=[self.prefix, record['id'], key or '', self.ttl, max_pending or 0, *fields]
+        )
+        if job_id is None:
+            raise QueueFullError("Job queue is full")
+        return record if job_id == record['id'] else self.get(job_id)
+
+    def get(self, job_id):
+        row = self.client.hgetall(self.prefix + 'job:' + job_id)
+        return _decode(row) if row else None
+
+    def active(self):
+        pipeline = self.client.pipeline(transaction=False)
+        for job_id in self.client.smembers(self.active_set):
+            pipeline.hgetall(self.prefix + 'job:' + job_id)
+        records = [_decode(row) for row in pipeline.execute() if row]
+        return sorted(records, key=lambda record: record['created_at'])
+
+    def pending(self):
+        return self.client.scard(self.active_set)
+
+    def claim(self, worker, lease):
+        now = time.time()
+        job_id = self._claim(
+            keys=[self.queue, self.running, self.active_set],
+            args=[self.prefix, now, now + lease, worker, self.ttl, LOST_ERROR]
+        )
+        return self.get(job_id) if job_id else None
+
+    def heartbeat(self, job_id, worker, lease, progress, stage, partial):
+        cancel = self._heartbeat(
+            keys=[self.running],
+            args=[self.prefix, job_id, worker, time.time() + lease, progress, stage or '', json.dumps(partial)]
+        )
+        return None if cancel < 0 else bool(cancel)
+
+    def finish(self, job_id, worker, status, result=None, error=None):
+        return bool(self._finish(
+            keys=[self.running, self.active_set],
+            args=[self.prefix, job_id, worker, status, json.dumps(result), error or '', time.time(), self.ttl]
+        ))
+
+    def cancel(self, job_id):
+        self._cancel(keys=[self.active_set], args=[self.prefix, job_id, time.time(), self.ttl])
+        return self.get(job_id)
+
+    def close(self):
+        self.client.close()
+
+
+def connect(url, ttl=3600):
+    """
+    إنشاء وسيط من رابط:
+
+    - sqlite:///jobs.db (مسار نسبي) أو sqlite:////var/lib/separator/jobs.db
+    - redis://host:6379/0 أو rediss:// أو unix:///path/redis.sock
+    """
+    if url.startswith('sqlite:///'):
+        return SQLiteBroker(url[len('sqlite:///'):], ttl)
+    if url.split('://', 1)[0] in ('redis', 'rediss', 'unix'):
+        return RedisBroker(url, ttl)
+    raise ValueError(f"Unsupported job broker URL: {url}")
@@ -0,0 +1,232 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import threading
+import time
+import uuid
+from utils.metrics import log_event
+
+MANIFEST = 'manifest.json'
+
+# ملفات أقفال المفاتيح (مخفية: مدير التخزين يحذف المجلد فقط إذا لم يُستخدم أي قفل لساعات)
+LOCKS = '.locks'
+
+
+class KeyLock:
+    """
+    قفل مفتاح بين الخيوط وبين العمليات والعقد التي تشارك نفس المجلد (flock على ملف)
+
+    على نظام ملفات مشترك بدون أقفال قد تحسب عقدتان نفس النتيجة، وهذا آمن لأن commit ذري.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        if not self._lock.acquire(blocking):
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.utime(fd)
+            except BaseException:
+                os.close(fd)
+                raise
+        except BlockingIOError:
+            self._lock.release()
+            return False
+        except BaseException:
+            self._lock.release()
+            raise
+        self._fd = fd
+        return True
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+            self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class ResultCache:
+    """
+    ذاكرة تخزين مؤقت لنتائج الفصل مفهرسة ببصمة الصوت ومعاملات النموذج
+
+    كل نتيجة في مجلد خاص <root>/<key>/ يحتوي على المسارات وملف manifest.json.
+    يتم حذف الأقدم استخداماً عند تجاوز الحجم الأقصى، إلا النتائج قيد الاستخدام.
+
+    :param in_use: دالة in_use(path) تُرجع True إذا كانت مهمة ما زالت تقرأ النتيجة
+    """
+
+    def __init__(self, root, max_bytes, in_use=None):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.in_use = in_use
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(fingerprint, **params):
+        payload = json.dumps({'audio': fingerprint, **params}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def _key_lock(self, key):
+        lock = self._key_locks.get(key)
+        if lock is None:
+            lock = self._key_locks[key] = KeyLock(os.path.join(self.root, LOCKS, key))
+        return lock
+
+    def lock(self, key):
+        """قفل لكل مفتاح حتى لا يتم حساب نفس النتيجة مرتين في نفس الوقت (في أي عقدة)"""
+        with self._lock:
+            return self._key_lock(key)
+
+    def manifest(self, key):
+        try:
+            with open(os.path.join(self.path(key), MANIFEST), encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key):
+        """إرجاع {اسم المسار: مسار الملف} أو None إذا لم تكن النتيجة موجودة"""
+        manifest_path = os.path.join(self.path(key), MANIFEST)
+        manifest = self.manifest(key)
+        if manifest is None:
+            return None
+
+        stems = {name: os.path.join(self.path(key), stem_file) for name, stem_file in manifest['stems'].items()}
+        if not all(os.path.exists(stem_path) for stem_path in stems.values()):
+            return None
+
+        # تحديث وقت آخر استخدام لسياسة LRU
+        try:
+            os.utime(manifest_path)
+        except FileNotFoundError:
+            # حُذفت النتيجة من طلب آخر بعد قراءتها
+            return None
+        return stems
+
+    def staging_dir(self):
+        """مجلد مؤقت داخل الجذر لكتابة النتائج قبل نقلها بشكل ذري"""
+        staging = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(staging)
+        return staging
+
+    def commit(self, key, staging, stems, meta=None):
+        """
+        نقل النتائج من المجلد المؤقت إلى مجلد المفتاح وإرجاع المسارات النهائية
+
+        :param stems: {اسم المسار: مسار الملف داخل staging}
+        :param meta: بيانات إضافية تُحفظ في manifest.json
+        """
+        manifest = {
+            'stems': {name: os.path.basename(stem_path) for name, stem_path in stems.items()},
+            'size': sum(os.path.getsize(stem_path) for stem_path in stems.values()),
+            'created_at': time.time(),
+            'meta': meta or {}
+        }
+        with open(os.path.join(staging, MANIFEST), 'w', encoding='utf8') as f:
+            json.dump(manifest, f)
+
+        try:
+            os.rename(staging, self.path(key))
+        except OSError:
+            # تم حفظ نفس النتيجة من طلب آخر
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict(keep=key)
+        return self.get(key)
+
+    def refresh_size(self, key):
+        """إعادة حساب حجم النتيجة بعد إضافة ملفات إليها (مثل صيغ ترميز جديدة)"""
+        manifest = self.manifest(key)
+        if manifest is None:
+            return
+        directory = self.path(key)
+        size = 0
+        for filename in os.listdir(directory):
+            try:
+                size += os.path.getsize(os.path.join(directory, filename))
+            except OSError:
+                # ملف مؤقت انتهت كتابته أو حُذف أثناء الحساب
+                continue
+        manifest['size'] = size
+        tmp_path = os.path.join(directory, f"{MANIFEST}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(directory, MANIFEST))
+        self.evict(keep=key)
+
+    def discard(self, staging):
+        if staging:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _try_remove(self, key):
+        """حذف نتيجة إذا لم تكن مقفلة أو قيد الاستخدام (يُستدعى مع self._lock)"""
+        if self.in_use is not None and self.in_use(self.path(key)):
+            return False
+        if key == LOCKS:
+            # لا يوجد قفل عليه، ومدير التخزين لا يحذفه إلا بعد ساعات دون استخدام
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            return True
+        # القفل يُؤخذ حتى لو لم تستخدم هذه العملية المفتاح: قد تكون عقدة أخرى تحسبه الآن
+        lock = self._key_lock(key)
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            shutil.rmtree(self.path(key), ignore_errors=True)
+        finally:
+            lock.release()
+        self._key_locks.pop(key, None)
+        return True
+
+    def remove(self, key):
+        """:return: False إذا كانت النتيجة قيد الحساب أو الاستخدام"""
+        with self._lock:
+            return self._try_remove(key)
+
+    def entries(self):
+        """قائمة (آخر استخدام، الحجم، المفتاح) لكل النتائج المحفوظة"""
+        entries = []
+        for key in os.listdir(self.root):
+            manifest_path = os.path.join(self.root, key, MANIFEST)
+            try:
+                with open(manifest_path, encoding='utf8') as f:
+                    size = json.load(f).get('size', 0)
+                entries.append((os.path.getmtime(manifest_path), size, key))
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def evict(self, keep=None):
+        """حذف الأقدم استخداماً حتى يصبح الحجم الكلي أقل من الحد الأقصى"""
+        with self._lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in entries:
+                if total <= self.max_bytes:
+                    break
+                if key == keep or not self._try_remove(key):
+                    continue
+                log_event('cache_evict', key=key, size=size)
+                total -= size
@@ -0,0 +1,134 @@
+import os
+import re
+import json
+import math
+import hashlib
+import threading
+import ffmpeg
+
+# نفس القيم الافتراضية لمرشح loudnorm في ffmpeg
+TARGET_LUFS = -24.0
+TARGET_TRUE_PEAK = -2.0
+
+LOUDNESS_FILE = 'loudness.json'
+
+_sidecar_lock = threading.Lock()
+
+
+def measure_loudness(path):
+    """
+    المرور الأول من loudnorm: قياس الجهارة المتكاملة والذروة الحقيقية للملف
+
+    :return: {'input_i': LUFS, 'input_tp': dBTP, 'input_lra': LU, 'input_thresh': LUFS}
+    """
+    _, stderr = (
+        ffmpeg.input(path)
+        .filter('loudnorm', print_format='json')
+        .output('-', format='null')
+        .global_args('-nostats', '-hide_banner')
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    match = re.search(r'\{[^{}]*"input_i"[^{}]*\}', stderr.decode('utf8', errors='ignore'))
+    if not match:
+        raise ValueError(f"Could not read loudness of {path}")
+    stats = json.loads(match.group(0))
+    return {key: float(stats[key]) for key in ('input_i', 'input_tp', 'input_lra', 'input_thresh')}
+
+
+def stem_loudness(path):
+    """قياس الجهارة مع حفظها في loudness.json بجانب الملف حتى لا تُقاس مرة أخرى"""
+    sidecar = os.path.join(os.path.dirname(path), LOUDNESS_FILE)
+    name = os.path.basename(path)
+    with _sidecar_lock:
+        try:
+            with open(sidecar, encoding='utf8') as f:
+                measurements = json.load(f)
+        except (OSError, ValueError):
+            measurements = {}
+    if name in measurements:
+        return measurements[name]
+
+    stats = measure_loudness(path)
+    with _sidecar_lock:
+        try:
+            with open(sidecar, encoding='utf8') as f:
+                measurements = json.load(f)
+        except (OSError, ValueError):
+            measurements = {}
+        measurements[name] = stats
+        tmp_path = f"{sidecar}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(measurements, f)
+        os.replace(tmp_path, sidecar)
+    return stats
+
+
+def precompute_loudness(stem_paths):
+    """حساب جهارة كل المسارات مرة واحدة عند إنشائها"""
+    return {name: stem_loudness(path) for name, path in stem_paths.items()}
+
+
+def mix_gains(loudness, volumes, target_lufs=TARGET_LUFS, target_tp=TARGET_TRUE_PEAK):
+    """
+    حساب معامل خطي لكل مسار بحيث تقترب جهارة المزيج من الهدف دون loudnorm
+
+    جهارة المزيج تُقدّر بجمع الطاقة (بافتراض عدم ترابط المسارات).
+
+    :return: ({اسم المسار: معامل}, هل يحتاج المزيج إلى محدد ذروة)
+    """
+    power = 0.0
+    for name, stats in loudness.items():
+        if math.isfinite(stats['input_i']):
+            power += volumes[name] ** 2 * 10 ** (stats['input_i'] / 10)
+
+    gain = 10 ** ((target_lufs - 10 * math.log10(power)) / 20) if power > 0 else 1.0
+    coefficients = {name: volumes[name] * gain for name in loudness}
+
+    # أسوأ حالة: تجمع الذروات
+    peak = sum(
+        coefficients[name] * 10 ** (stats['input_tp'] / 20)
+        for name, stats in loudness.items() if math.isfinite(stats['input_tp'])
+    )
+    return coefficients, peak > 10 ** (target_tp / 20)
+
+
+def pcm_input(samplerate=44100, channels=2):
+    """مدخل ffmpeg لمزيج PCM (float32) محسوب مسبقاً ويُرسل عبر stdin"""
+    return ffmpeg.input('pipe:', format='f32le', ac=channels, ar=samplerate)
+
+
+def build_mix(track_paths, coefficients, limit, target_tp=TARGET_TRUE_PEAK, pcm=None):
+    """
+    بناء رسم مرشحات واحد: volume لكل مسار ثم amix بدون تطبيع
+
+    :param pcm: مدخل إضافي (من pcm_input) لمسارات مُزجت مسبقاً بمعاملاتها
+    """
+    inputs = [
+        ffmpeg.input(track_path).filter('volume', f"{coefficients[name]:.6f}")
+        for name, track_path in track_paths.items()
+    ]
+    if pcm is not None:
+        inputs.append(pcm)
+    if len(inputs) == 1:
+        mixed = inputs[0]
+    else:
+        mixed = ffmpeg.filter(inputs, 'amix', inputs=len(inputs), duration='longest', normalize=0)
+    if limit:
+        mixed = mixed.filter('alimiter', limit=max(0.0625, 10 ** (target_tp / 20)), level=0)
+    return mixed
+
+
+def export_key(video_path, track_paths, volumes):
+    """مفتاح ثابت لنفس (الفيديو، المسارات، مستويات الصوت) لإعادة استخدام التصدير السابق"""
+
+    def identity(path):
+        stat = os.stat(path)
+        return [os.path.abspath(path), stat.st_size, int(stat.st_mtime)]
+
+    payload = json.dumps({
+        'video': identity(video_path),
+        'tracks': {name: identity(path) for name, path in track_paths.items()},
+        'volumes': {name: round(volumes[name], 3) for name in track_paths},
+        'target': [TARGET_LUFS, TARGET_TRUE_PEAK]
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf8')).hexdigest()[:32]
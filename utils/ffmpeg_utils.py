@@ -0,0 +1,153 @@
+import hashlib
+import threading
+from multiprocessing import shared_memory
+import ffmpeg
+
+
+def probe_duration(path):
+    """مدة الملف بالثواني (أو None إذا تعذر قراءتها)"""
+    try:
+        return float(ffmpeg.probe(path)['format']['duration'])
+    except (ffmpeg.Error, KeyError, ValueError):
+        return None
+
+
+def run_with_progress(stream, duration=None, progress=None, job=None, feed=None):
+    """
+    تشغيل أمر ffmpeg مع قراءة التقدم من -progress pipe:1
+
+    :param stream: مخرجات ffmpeg-python الجاهزة للتشغيل
+    :param duration: مدة المدخل بالثواني لحساب النسبة المئوية
+    :param progress: دالة تستقبل نسبة التقدم (0-100)
+    :param job: مهمة يمكن إلغاؤها - يتم إيقاف ffmpeg عند الإلغاء
+    :param feed: دفعات بايتات تُكتب في stdin (لمدخل 'pipe:')
+    :raises ffmpeg.Error: عند فشل ffmpeg
+    """
+    process = (
+        stream
+        .global_args('-progress', 'pipe:1', '-nostats', '-loglevel', 'error')
+        .run_async(pipe_stdin=feed is not None, pipe_stdout=True, pipe_stderr=True, overwrite_output=True)
+    )
+    if job is not None:
+        job.on_cancel(process.kill)
+
+    if feed is not None:
+        def write_input():
+            try:
+                for chunk in feed:
+                    process.stdin.write(chunk)
+            except (BrokenPipeError, ValueError):
+                # توقف ffmpeg (خطأ أو إلغاء) - سيظهر السبب في returncode
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+        threading.Thread(target=write_input, daemon=True).start()
+
+    # قراءة stderr في خيط منفصل لتجنب امتلاء الأنبوب
+    stderr_chunks = []
+    reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    reader.start()
+
+    for raw_line in process.stdout:
+        line = raw_line.decode('utf8', errors='ignore').strip()
+        if not progress or not duration or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        if key in ('out_time_us', 'out_time_ms') and value.isdigit():
+            # out_time_ms هو في الحقيقة بالميكروثانية
+            progress(min(100.0, int(value) / 1e6 / duration * 100))
+
+    process.wait()
+    reader.join()
+    stderr = b''.join(stderr_chunks)
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', None, stderr)
+    return stderr
+
+
+def audio_fingerprint(path, samplerate=44100, channels=2, chunk_size=1 << 20):
+    """
+    بصمة sha256 للصوت بعد فك ترميزه، بحيث يعطي نفس المحتوى نفس البصمة
+    مهما كان اسم الملف أو الحاوية
+    """
+    process = (
+        ffmpeg.input(path)
+        .output('pipe:', format='f32le', acodec='pcm_f32le', ac=channels, ar=samplerate)
+        .global_args('-loglevel', 'error', '-nostats')
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+    stderr_chunks = []
+    reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    reader.start()
+
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: process.stdout.read(chunk_size), b''):
+        digest.update(chunk)
+
+    process.wait()
+    reader.join()
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', None, b''.join(stderr_chunks))
+    return digest.hexdigest()
+
+
+def decode_to_shared_memory(path, samplerate=44100, channels=2, progress=None, job=None):
+    """
+    فك ترميز الصوت مرة واحدة إلى ذاكرة مشتركة (float32 متداخل) مع حساب البصمة أثناء القراءة
+
+    نفس البصمة التي تعيدها audio_fingerprint، لكن دون قراءة الملف مرة ثانية.
+    المستدعي مسؤول عن close() و unlink() للذاكرة المشتركة.
+
+    :return: (SharedMemory, عدد الإطارات, البصمة)
+    """
+    frame_bytes = 4 * channels
+    expected = int(((probe_duration(path) or 60) + 1) * samplerate) * frame_bytes
+    shm = shared_memory.SharedMemory(create=True, size=expected)
+
+    process = (
+        ffmpeg.input(path)
+        .output('pipe:', format='f32le', acodec='pcm_f32le', ac=channels, ar=samplerate)
+        .global_args('-loglevel', 'error', '-nostats')
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+    if job is not None:
+        job.on_cancel(process.kill)
+    stderr_chunks = []
+    reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    reader.start()
+
+    digest = hashlib.sha256()
+    offset = 0
+    try:
+        while True:
+            if offset == shm.size:
+                # المدة المقدرة أقل من الحقيقية - مضاعفة الحجم
+                grown = shared_memory.SharedMemory(create=True, size=shm.size * 2)
+                grown.buf[:offset] = shm.buf[:offset]
+                shm.close()
+                shm.unlink()
+                shm = grown
+            view = shm.buf[offset:min(shm.size, offset + (1 << 20))]
+            count = process.stdout.readinto(view)
+            view.release()
+            if not count:
+                break
+            digest.update(shm.buf[offset:offset + count])
+            offset += count
+            if progress:
+                progress(min(100.0, offset / expected * 100))
+
+        process.wait()
+        reader.join()
+        if process.returncode != 0:
+            raise ffmpeg.Error('ffmpeg', None, b''.join(stderr_chunks))
+    except BaseException:
+        process.kill()
+        shm.close()
+        shm.unlink()
+        raise
+
+    return shm, offset // frame_bytes, digest.hexdigest()
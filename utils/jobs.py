@@ -0,0 +1,392 @@
+import os
+import json
+import socket
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import JOBS, STAGE_SECONDS, log_event
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_key(kind, args):
+    """نفس النوع ونفس المعاملات = نفس المهمة (إعادة إرسال الطلب لا تنشئ مهمة ثانية)"""
+    payload = json.dumps([kind, args], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+
+class Job:
+    """
+    مهمة غير متزامنة (فصل أو تصدير) مع حالتها ونسبة تقدمها
+
+    الحالات: queued, running, done, failed, cancelled
+    """
+
+    def __init__(self, kind, uses=(), key=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        # الملفات التي تقرأها المهمة ولا يجب حذفها قبل انتهائها
+        self.uses = tuple(os.path.abspath(path) for path in uses)
+        self.status = 'queued'
+        self.stage = None
+        self.progress = 0.0
+        self.result = None
+        self.partial = None
+        self.error = None
+        self.attempts = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._cancel_callbacks = []
+        self._future = None
+
+    @classmethod
+    def from_record(cls, record):
+        """نسخة من مهمة محفوظة في الوسيط (utils.broker)"""
+        job = cls(record['kind'], record['uses'], record['key'])
+        job.id = record['id']
+        for field in (
+            'status', 'stage', 'progress', 'result', 'partial', 'error',
+            'attempts', 'created_at', 'started_at', 'finished_at'
+        ):
+            setattr(job, field, record[field])
+        if record['cancel']:
+            job._cancel.set()
+        return job
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def update(self, progress=None, stage=None, partial=None):
+        if progress is not None:
+            self.progress = round(min(100.0, max(self.progress, float(progress))), 1)
+        if stage is not None:
+            self.stage = stage
+        if partial is not None:
+            self.partial = partial
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled("Job cancelled")
+
+    def on_cancel(self, callback):
+        """تسجيل دالة تُستدعى عند الإلغاء (مثل إيقاف عملية ffmpeg)"""
+        self._cancel_callbacks.append(callback)
+        if self.cancelled:
+            callback()
+
+    def request_cancel(self):
+        self._cancel.set()
+        for callback in self._cancel_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                log_event('cancel_callback_failed', id=self.id, error=str(e))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'result': self.result,
+            'partial': self.partial,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobManager:
+    """
+    مجموعة عمال محدودة لتشغيل المهام خارج خيط الطلب
+
+    :param max_workers: عدد المهام التي تعمل في نفس الوقت
+    :param max_queue: عدد المهام المسموح بانتظارها قبل رفض الطلبات الجديدة
+    :param ttl: مدة الاحتفاظ بالمهام المنتهية بالثواني
+    """
+
+    def __init__(self, max_workers=2, max_queue=8, ttl=3600):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, *args, uses=(), **kwargs):
+        """
+        إضافة مهمة إلى الطابور. الدالة تستقبل المهمة كأول معامل
+
+        :param uses: الملفات أو المجلدات التي تحتاجها المهمة (محمية من الحذف حتى تنتهي)
+
+        :raises QueueFullError: عند امتلاء الطابور
+        """
+        key = job_key(kind, args)
+        with self._lock:
+            self._prune()
+            existing = next(
+                (job for job in self._jobs.values() if job.key == key and not job.finished and not job.cancelled),
+                None
+            )
+            if existing is not None:
+                return existing
+            if self.pending() >= self.max_workers + self.max_queue:
+                raise QueueFullError("Job queue is full")
+            job = Job(kind, uses, key)
+            self._jobs[job.id] = job
+            job._future = self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        if job.cancelled:
+            self._cancelled_before_start(job)
+            return
+        job.status = 'running'
+        job.attempts = 1
+        job.started_at = time.time()
+        STAGE_SECONDS.observe(job.started_at - job.created_at, stage='queue_wait')
+        try:
+            job.result = func(job, *args, **kwargs)
+            job.check_cancelled()
+            job.status = 'done'
+            job.progress = 100.0
+        except Exception as e:
+            if job.cancelled:
+                job.status = 'cancelled'
+            else:
+                job.status = 'failed'
+                job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            JOBS.inc(kind=job.kind, status=job.status)
+            log_event(
+                'job', id=job.id, kind=job.kind, status=job.status, error=job.error,
+                duration_ms=round((job.finished_at - job.started_at) * 1000, 2)
+            )
+
+    def _cancelled_before_start(self, job):
+        """مهمة أُلغيت وهي في الطابور: تُسجل في المقاييس مثل المهام التي انتهت"""
+        job.status = 'cancelled'
+        job.finished_at = time.time()
+        JOBS.inc(kind=job.kind, status=job.status)
+        log_event('job', id=job.id, kind=job.kind, status=job.status, duration_ms=0.0)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        job._cancel.set()
+        if job._future is not None and job._future.cancel():
+            self._cancelled_before_start(job)
+        job.request_cancel()
+        return job
+
+    def in_use(self, path):
+        """هل تستخدم مهمة غير منتهية هذا الملف أو ملفاً داخل هذا المجلد"""
+        path = os.path.abspath(path)
+        prefix = path + os.sep
+        return any(
+            used == path or used.startswith(prefix)
+            for job in list(self._jobs.values()) if not job.finished
+            for used in job.uses
+        )
+
+    def pending(self):
+        """عدد المهام في الانتظار أو قيد التشغيل"""
+        return sum(1 for job in list(self._jobs.values()) if not job.finished)
+
+    def _prune(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at and now - job.finished_at > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class BrokerJobManager:
+    """
+    نفس واجهة JobManager لكن المهام تُحفظ في وسيط مشترك (utils.broker) وتُشغلها عقد المعالجة (Worker)
+
+    هذه العملية لا تشغل المهام: func يجب أن تكون الدالة المسجلة لنفس النوع في العقد،
+    والمعاملات يجب أن تكون قابلة للتحويل إلى JSON.
+
+    :param max_pending: عدد المهام غير المنتهية المسموح به قبل رفض الطلبات الجديدة
+    :param max_attempts: عدد مرات تشغيل المهمة إذا توقفت عقدتها قبل إنهائها
+    """
+
+    def __init__(self, broker, max_pending=100, max_attempts=3):
+        self.broker = broker
+        self.max_pending = max(1, int(max_pending))
+        self.max_attempts = max(1, int(max_attempts))
+        self._lock = threading.Lock()
+        self._uses = (0.0, ())
+
+    def submit(self, kind, func, *args, uses=()):
+        """:raises QueueFullError: عند وجود max_pending مهمة غير منتهية"""
+        uses = [os.path.abspath(path) for path in uses]
+        record = self.broker.enqueue(kind, args, uses, job_key(kind, args), self.max_attempts, self.max_pending)
+        return Job.from_record(record)
+
+    def get(self, job_id):
+        record = self.broker.get(job_id)
+        return Job.from_record(record) if record is not None else None
+
+    def cancel(self, job_id):
+        record = self.broker.cancel(job_id)
+        return Job.from_record(record) if record is not None else None
+
+    def in_use(self, path):
+        # يُستدعى لكل ملف في دورة التنظيف، لذلك تُقرأ الملفات المستخدمة من الوسيط مرة كل ثانية على الأكثر
+        now = time.monotonic()
+        with self._lock:
+            checked_at, used = self._uses
+            if now - checked_at > 1.0:
+                used = tuple(used_path for record in self.broker.active() for used_path in record['uses'])
+                self._uses = (now, used)
+        path = os.path.abspath(path)
+        prefix = path + os.sep
+        return any(used_path == path or used_path.startswith(prefix) for used_path in used)
+
+    def pending(self):
+        return self.broker.pending()
+
+    def shutdown(self, wait=True):
+        self.broker.close()
+
+
+class Worker:
+    """
+    عقدة معالجة: تسحب المهام من الوسيط وتشغلها بدوال المهام نفسها المستخدمة محلياً
+
+    إذا توقفت العقدة قبل إنهاء مهمة ينتهي حجزها وتعود إلى الطابور لعقدة أخرى،
+    لذلك كل دالة مهمة يجب أن تكون آمنة للإعادة (نتائج ذرية ومفهرسة بالمحتوى).
+    الفشل داخل الدالة نهائي ولا يُعاد.
+
+    :param tasks: {نوع المهمة: الدالة}
+    :param concurrency: عدد المهام التي تعمل في نفس الوقت
+    :param lease: مدة حجز المهمة بالثواني، تُجدد مع كل heartbeat
+    :param poll: الانتظار بين محاولات السحب عندما يكون الطابور فارغاً
+    """
+
+    def __init__(self, broker, tasks, concurrency=1, lease=60, poll=1.0, heartbeat=1.0):
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.broker = broker
+        self.tasks = tasks
+        self.concurrency = max(1, int(concurrency))
+        self.lease = lease
+        self.poll = poll
+        self.heartbeat = min(heartbeat, lease / 3)
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._idle = threading.Event()
+
+    def _beat(self):
+        # نشر التقدم وتجديد الحجز، واستقبال طلبات الإلغاء من عقدة الويب
+        while not self._idle.wait(self.heartbeat):
+            with self._lock:
+                running = list(self._running.values())
+            for job in running:
+                try:
+                    cancel = self.broker.heartbeat(job.id, self.id, self.lease, job.progress, job.stage, job.partial)
+                except Exception as e:
+                    log_event('heartbeat_failed', id=job.id, worker=self.id, error=str(e))
+                    continue
+                if cancel is None:
+                    log_event('lease_lost', id=job.id, worker=self.id)
+                if (cancel is None or cancel) and not job.cancelled:
+                    job.request_cancel()
+
+    def _execute(self, record):
+        job = Job.from_record(record)
+        func = self.tasks.get(job.kind)
+        with self._lock:
+            self._running[job.id] = job
+        if job.attempts == 1:
+            STAGE_SECONDS.observe(time.time() - job.created_at, stage='queue_wait')
+        started = time.time()
+        status, result, error = 'done', None, None
+        try:
+            if func is None:
+                raise ValueError(f"Unknown job kind: {job.kind}")
+            result = func(job, *record['args'])
+            job.check_cancelled()
+        except Exception as e:
+            if job.cancelled:
+                status = 'cancelled'
+            else:
+                status = 'failed'
+                error = str(e)
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+
+        if not self.broker.finish(job.id, self.id, status, result, error):
+            # حجز المهمة انتهى وأخذتها عقدة أخرى: نتيجة هذه المحاولة لا تُحفظ
+            log_event('job_dropped', id=job.id, kind=job.kind, status=status, worker=self.id)
+            return
+        JOBS.inc(kind=job.kind, status=status)
+        log_event(
+            'job', id=job.id, kind=job.kind, status=status, error=error, attempt=job.attempts, worker=self.id,
+            duration_ms=round((time.time() - started) * 1000, 2)
+        )
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                record = self.broker.claim(self.id, self.lease)
+            except Exception as e:
+                log_event('claim_failed', worker=self.id, error=str(e))
+                record = None
+            if record is None:
+                self._stop.wait(self.poll)
+                continue
+            log_event('job_claimed', id=record['id'], kind=record['kind'], attempt=record['attempts'], worker=self.id)
+            self._execute(record)
+
+    def run(self):
+        """تشغيل العقدة حتى stop(): المهام الجارية تكتمل قبل الخروج"""
+        beat = threading.Thread(target=self._beat, name='worker-heartbeat', daemon=True)
+        beat.start()
+        loops = [
+            threading.Thread(target=self._loop, name=f"worker-{index}", daemon=True)
+            for index in range(self.concurrency)
+        ]
+        for thread in loops:
+            thread.start()
+        # join بمهلة حتى تصل الإشارات (SIGTERM) إلى الخيط الرئيسي
+        while any(thread.is_alive() for thread in loops):
+            for thread in loops:
+                thread.join(timeout=0.5)
+        self._idle.set()
+        beat.join()
+
+    def stop(self):
+        self._stop.set()
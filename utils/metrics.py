@@ -0,0 +1,206 @@
+import sys
+import json
+import time
+import resource
+import threading
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """قيمة لحظية، يمكن أن تُحسب عند كل قراءة عبر دالة"""
+    kind = 'gauge'
+
+    def __init__(self, name, description, labels=(), callback=None):
+        super().__init__(name, description, labels)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        if self.callback is not None:
+            self.set(self.callback())
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [c + (value <= bound) for c, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels + ('le',), key + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labels + ('le',), key + ('+Inf',))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def _peak_rss_bytes():
+    # ru_maxrss بالكيلوبايت على لينكس
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'separator_stage_seconds', 'Duration of processing stages', ('stage',)
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    'separator_request_seconds', 'HTTP request latency', ('endpoint',)
+))
+REQUESTS = registry.register(Counter(
+    'separator_requests_total', 'HTTP requests by endpoint and status', ('endpoint', 'status')
+))
+JOBS = registry.register(Counter(
+    'separator_jobs_total', 'Finished jobs by kind and status', ('kind', 'status')
+))
+CACHE_REQUESTS = registry.register(Counter(
+    'separator_cache_requests_total', 'Result cache lookups', ('result',)
+))
+BYTES_PROCESSED = registry.register(Counter(
+    'separator_bytes_processed_total', 'Bytes read or written by processing stages', ('kind',)
+))
+STORAGE_BYTES = registry.register(Gauge(
+    'separator_storage_bytes', 'Bytes on disk per storage area after the last janitor pass', ('area',)
+))
+STORAGE_REMOVED = registry.register(Counter(
+    'separator_storage_removed_total', 'Artifacts removed by the storage janitor', ('area', 'reason')
+))
+PEAK_RSS = registry.register(Gauge(
+    'separator_peak_rss_bytes', 'Peak resident memory of this process', callback=_peak_rss_bytes
+))
+
+
+def log_event(event, **fields):
+    """سطر سجل JSON واحد لكل حدث"""
+    print(json.dumps({'ts': round(time.time(), 3), 'event': event, **fields}, default=str), flush=True)
+
+
+@contextmanager
+def stage(name, **fields):
+    """قياس مدة مرحلة وتسجيلها في المقاييس وفي سجل JSON"""
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield fields
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage=name)
+        log_event('stage', stage=name, status=status, duration_ms=round(duration * 1000, 2), **fields)
+
+
+class SamplingProfiler:
+    """
+    مُحلل أداء بالعينات: يقرأ مكدس خيط معين كل interval ثانية
+    ويكتب النتيجة بصيغة folded stacks (متوافقة مع flamegraph)
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = StackCounter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
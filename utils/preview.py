@@ -0,0 +1,169 @@
+import os
+import struct
+import threading
+import uuid
+import ffmpeg
+from utils.stems import BLOCK_FRAMES, SourceWriter, sources_info
+
+SAMPLERATE = 44100
+CHANNELS = 2
+
+# صيغ المقاطع المضغوطة للمشغل: (الحاوية، خيارات ffmpeg)
+# Opus في Ogg يُفك بلا فجوات عند حدود المقاطع (pre-skip)، وMP3 للمتصفحات التي لا تدعمه
+CHUNK_FORMATS = {
+    'opus': ('ogg', {'acodec': 'libopus', 'audio_bitrate': '96k'}),
+    'mp3': ('mp3', {'acodec': 'libmp3lame', 'audio_bitrate': '128k'}),
+}
+
+# قفل لكل ملف: فك ترميز مسار لا يؤخر معاينة مسارات أخرى
+_decode_locks = {}
+_decode_locks_lock = threading.Lock()
+
+
+def _decode_lock(path):
+    with _decode_locks_lock:
+        return _decode_locks.setdefault(path, threading.Lock())
+
+
+def load_pcm(stem_path, samplerate=SAMPLERATE, channels=CHANNELS, on_decoded=None):
+    """
+    الصوت المفكوك لمسار (int16) محفوظ كـ .npy بجانب الملف ويُقرأ بـ mmap
+
+    يتم فك الترميز مرة واحدة فقط، وبعدها كل معاينة تقرأ الجزء المطلوب مباشرة.
+    يُستخدم فقط للمسارات التي ليس لها مخرجات نموذج محفوظة (float16).
+
+    :param on_decoded: دالة on_decoded(pcm_path) تُستدعى بعد إنشاء الملف (مثلاً لتحديث حجم الذاكرة المؤقتة)
+    """
+    import numpy as np
+
+    pcm_path = f"{os.path.splitext(stem_path)[0]}.pcm.npy"
+    if not os.path.exists(pcm_path):
+        with _decode_lock(pcm_path):
+            if not os.path.exists(pcm_path):
+                tmp_path = f"{pcm_path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+                try:
+                    _decode_to_npy(stem_path, tmp_path, samplerate, channels)
+                    os.replace(tmp_path, pcm_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                if on_decoded is not None:
+                    on_decoded(pcm_path)
+    return np.load(pcm_path, mmap_mode='r')
+
+
+def _decode_to_npy(stem_path, npy_path, samplerate, channels):
+    """فك الترميز على دفعات مباشرة إلى الملف، فالذاكرة ثابتة مهما طال المسار"""
+    import numpy as np
+
+    process = (
+        ffmpeg.input(stem_path)
+        .output('pipe:', format='s16le', acodec='pcm_s16le', ac=channels, ar=samplerate)
+        .global_args('-loglevel', 'error', '-nostats')
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+    writer = SourceWriter(npy_path, channels, dtype='<i2')
+    try:
+        while True:
+            data = process.stdout.read(BLOCK_FRAMES * channels * 2)
+            if not data:
+                break
+            writer.write(np.frombuffer(data, dtype=np.int16).reshape(-1, channels))
+    finally:
+        writer.close()
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        if process.wait() != 0:
+            raise ffmpeg.Error('ffmpeg', None, stderr)
+
+
+def wav_header(frames, samplerate=SAMPLERATE, channels=CHANNELS):
+    data_size = frames * channels * 2
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, channels, samplerate, samplerate * channels * 2, channels * 2, 16,
+        b'data', data_size
+    )
+
+
+class PreviewMix:
+    """
+    مزيج افتراضي لعدة مسارات بمستويات صوت محددة، يُحسب عند الطلب من PCM المحفوظ
+
+    يُعامل كملف WAV كامل الطول بحيث يمكن خدمة أي نطاق بايتات (HTTP Range) دون كتابة ملف.
+    المسارات التي لها مخرجات نموذج محفوظة تُقرأ منها مباشرة (float16 بـ mmap) دون فك ترميز.
+
+    :param stems: {اسم المسار: (مسار الملف, [ملفات float16] أو None)}
+    :param on_decoded: تُمرر إلى load_pcm
+    """
+
+    def __init__(self, stems, volumes, samplerate=SAMPLERATE, channels=CHANNELS, on_decoded=None):
+        import numpy as np
+
+        # معدل العينات وعدد القنوات من مخرجات النموذج إن وجدت، حتى لا يُعاد تحويلها
+        parts = next((parts for _, parts in stems.values() if parts), None)
+        if parts:
+            info = sources_info(os.path.dirname(parts[0]))
+            samplerate, channels = info['samplerate'], info['channels']
+        self.samplerate = samplerate
+        self.channels = channels
+
+        # (مصفوفة (إطارات، قنوات), معامل يحولها إلى [-1, 1] بمستوى الصوت المطلوب)
+        self.sources = []
+        for name, (stem_path, parts) in stems.items():
+            volume = float(volumes.get(name, 1.0))
+            if parts:
+                self.sources.extend((np.load(part, mmap_mode='r'), volume) for part in parts)
+            else:
+                samples = load_pcm(stem_path, samplerate, channels, on_decoded)
+                self.sources.append((samples, volume / 32768))
+        self.frames = min(len(samples) for samples, _ in self.sources)
+        self.duration = self.frames / samplerate
+        self.frame_bytes = channels * 2
+        self.header = wav_header(self.frames, samplerate, channels)
+        self.size = len(self.header) + self.frames * self.frame_bytes
+
+    def render(self, start, end):
+        """مزج الإطارات [start, end) وإرجاعها int16"""
+        import numpy as np
+
+        start, end = max(0, start), min(self.frames, end)
+        mixed = np.zeros((max(0, end - start), self.channels), dtype=np.float32)
+        for samples, gain in self.sources:
+            if gain:
+                mixed += samples[start:end].astype(np.float32) * gain
+        np.clip(mixed, -1.0, 1.0, out=mixed)
+        return (mixed * 32767).astype(np.int16)
+
+    def iter_bytes(self, start, stop, chunk_frames=SAMPLERATE // 4):
+        """توليد البايتات [start, stop) من ملف WAV الافتراضي على دفعات صغيرة"""
+        header_size = len(self.header)
+        if start < header_size:
+            yield self.header[start:min(stop, header_size)]
+            start = header_size
+        while start < stop:
+            offset = start - header_size
+            frame = offset // self.frame_bytes
+            end_frame = min(frame + chunk_frames, -(-(stop - header_size) // self.frame_bytes))
+            data = self.render(frame, end_frame).tobytes()
+            skip = offset - frame * self.frame_bytes
+            data = data[skip:skip + stop - start]
+            if not data:
+                break
+            yield data
+            start += len(data)
+
+    def encode(self, start_seconds, duration, fmt='mp3'):
+        """ترميز مقطع قصير من المزيج في الذاكرة (المشغل يطلب المقاطع المتتالية بالترتيب)"""
+        container, options = CHUNK_FORMATS[fmt]
+        start = int(start_seconds * self.samplerate)
+        pcm = self.render(start, start + int(duration * self.samplerate)).tobytes()
+        out, _ = (
+            ffmpeg.input('pipe:', format='s16le', ac=self.channels, ar=self.samplerate)
+            .output('pipe:', format=container, **options)
+            .global_args('-loglevel', 'error', '-nostats')
+            .run(input=pcm, capture_stdout=True, capture_stderr=True)
+        )
+        return out
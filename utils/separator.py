@@ -0,0 +1,604 @@
+import os
+import re
+import argparse
+import sys
+import time
+import uuid
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from utils.metrics import stage, log_event
+
+# حالة كل عملية عاملة: النماذج المحملة (الأحدث استخداماً في النهاية)
+_models = OrderedDict()
+_model_bytes = {}
+_device = 'cpu'
+_memory_budget = None
+# (عتبة الصمت بالديسيبل، أقل مدة صمت بالثواني) لتخطي النموذج، أو None لتشغيله على كل الملف
+_silence = None
+
+# اسم النموذج البديل الخفيف (بدون أوزان)
+STUB_MODEL = 'stub'
+
+# النماذج المدعومة ومساراتها
+MODELS = {
+    'htdemucs': ('drums', 'bass', 'other', 'vocals'),
+    'htdemucs_ft': ('drums', 'bass', 'other', 'vocals'),
+    'htdemucs_6s': ('drums', 'bass', 'other', 'vocals', 'guitar', 'piano'),
+    STUB_MODEL: ('drums', 'bass', 'other', 'vocals'),
+}
+
+
+class StubModel:
+    """
+    نموذج بديل خفيف بدون أوزان لقياس الأداء والاختبار دون اتصال
+
+    يقسم الطيف إلى نطاقات ثابتة بنفس أسماء مسارات htdemucs.
+    """
+    samplerate = 44100
+    audio_channels = 2
+    sources = ['drums', 'bass', 'other', 'vocals']
+    bands = {'bass': (0, 250), 'vocals': (250, 4000), 'other': (4000, 10000), 'drums': (10000, None)}
+
+    def separate(self, wav):
+        import torch
+
+        spectrum = torch.fft.rfft(wav, dim=-1)
+        freqs = torch.fft.rfftfreq(wav.shape[-1], 1 / self.samplerate)
+        sources = []
+        for name in self.sources:
+            low, high = self.bands[name]
+            mask = freqs >= low
+            if high:
+                mask &= freqs < high
+            sources.append(torch.fft.irfft(spectrum * mask, n=wav.shape[-1], dim=-1))
+        return torch.stack(sources)
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+
+def _model_size(model):
+    """حجم أوزان النموذج بالبايت (تقدير لما يشغله في الذاكرة)"""
+    parameters = getattr(model, 'parameters', None)
+    if parameters is None:
+        return 0
+    return sum(p.numel() * p.element_size() for p in parameters())
+
+
+def _get_model(model_name):
+    """
+    النموذج المطلوب من سجل العملية العاملة، مع تحميله عند الحاجة
+
+    عند تجاوز ميزانية الذاكرة تُحذف النماذج الأقدم استخداماً (ما عدا المطلوب).
+    """
+    from demucs import __version__ as demucs_version
+    from demucs.pretrained import get_model
+
+    if model_name in _models:
+        _models.move_to_end(model_name)
+        return _models[model_name]
+
+    if model_name not in MODELS:
+        raise ValueError(f"Unknown model: {model_name}")
+
+    with stage('model_load', model=model_name):
+        model = StubModel() if model_name == STUB_MODEL else get_model(model_name)
+        model.to(_device)
+        model.eval()
+    _models[model_name] = model
+    _model_bytes[model_name] = _model_size(model)
+    log_event('model_loaded', pid=os.getpid(), model=model_name, demucs=demucs_version, device=str(_device))
+
+    while _memory_budget and len(_models) > 1 and sum(_model_bytes.values()) > _memory_budget:
+        evicted, _ = _models.popitem(last=False)
+        _model_bytes.pop(evicted, None)
+        log_event('model_evicted', pid=os.getpid(), model=evicted)
+    return model
+
+
+def _init_worker(model_names, device, threads, memory_budget=None, silence=None):
+    """تحميل النماذج الأكثر استخداماً داخل العملية العاملة"""
+    global _device, _memory_budget, _silence
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+
+    _device = device
+    _memory_budget = memory_budget
+    _silence = silence
+    for model_name in model_names:
+        _get_model(model_name)
+
+
+def _ping():
+    return os.getpid()
+
+
+class SeparationCancelled(Exception):
+    pass
+
+
+class _ProgressWriter:
+    """
+    يستبدل stderr أثناء تشغيل apply_model ويقرأ النسبة المئوية من شريط tqdm الخاص بـ Demucs
+    """
+    _percent = re.compile(r'(\d+)%\|')
+
+    def __init__(self, state, task_id, bars):
+        self.state = state
+        self.task_id = task_id
+        self.bars = max(1, bars)
+        self.bar = 0
+        self.last = 0
+        self.offset = 0.0
+        self.scale = 1.0
+
+    def region(self, offset, scale):
+        """التقدم التالي يخص جزءاً من الملف: يبدأ عند offset ويمثل scale من الكل (نسب 0-1)"""
+        self.offset = offset * 100
+        self.scale = scale
+        self.bar = 0
+        self.last = 0
+
+    def write(self, text):
+        if self.state.get(f"{self.task_id}:cancel"):
+            raise SeparationCancelled("Separation cancelled")
+        matches = self._percent.findall(text)
+        if matches:
+            percent = int(matches[-1])
+            # BagOfModels يشغل شريطاً لكل نموذج فرعي
+            if percent < self.last:
+                self.bar = min(self.bar + 1, self.bars - 1)
+            self.last = percent
+            self.state[self.task_id] = self.offset + (self.bar * 100 + percent) / self.bars * self.scale
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def _run_model(model, wav, progress=False):
+    """تشغيل النموذج على موجة (channels, time) وإرجاع المسارات (sources, channels, time)"""
+    import torch
+    from demucs.apply import apply_model
+
+    if isinstance(model, StubModel):
+        return model.separate(wav)
+
+    ref = wav.mean(0)
+    mean, std = ref.mean(), ref.std()
+    wav = (wav - mean) / (std + 1e-8)
+    with torch.no_grad():
+        sources = apply_model(
+            model, wav[None], device=_device,
+            shifts=1, split=True, overlap=0.25, progress=progress
+        )[0]
+    return sources * std + mean
+
+
+def _residual_source(model):
+    """المسار الذي يستقبل الصوت الأصلي في المقاطع التي لا تمر بالنموذج"""
+    return model.sources.index('other') if 'other' in model.sources else len(model.sources) - 1
+
+
+def _run_model_sparse(model, wav, writer=None):
+    """
+    تشغيل النموذج على المناطق المسموعة فقط
+
+    فترات الصمت الطويلة لا تمر بالنموذج: الصوت الأصلي يوضع في مسار other وباقي المسارات أصفار،
+    فيبقى مجموع المسارات مساوياً للأصل. حدود كل منطقة تُدمج بتلاشٍ قصير لتجنب النقرات.
+
+    :param writer: _ProgressWriter لتحويل تقدم كل منطقة إلى تقدم الملف كاملاً
+    :return: (مصفوفة numpy (sources, channels, time), عدد الإطارات التي مرت بالنموذج)
+    """
+    import numpy as np
+    from utils.activity import FADE, active_regions, edge_weights
+
+    frames = wav.shape[-1]
+    regions = [(0, frames)]
+    if _silence is not None:
+        threshold_db, min_silence = _silence
+        regions = active_regions(wav.numpy(), model.samplerate, threshold_db, min_silence)
+    if regions == [(0, frames)]:
+        return _run_model(model, wav, progress=writer is not None).cpu().numpy(), frames
+
+    mix = wav.numpy()
+    sources = np.zeros((len(model.sources), *mix.shape), dtype=np.float32)
+    sources[_residual_source(model)] = mix
+    active = sum(end - start for start, end in regions)
+    fade = int(FADE * model.samplerate)
+    done = 0
+    for start, end in regions:
+        if writer is not None:
+            writer.region(done / active, (end - start) / active)
+        separated = _run_model(model, wav[:, start:end], progress=writer is not None).cpu().numpy()
+        region = sources[..., start:end]
+        region += (separated - region) * edge_weights(end - start, fade, start > 0, end < frames)
+        done += end - start
+    return sources, active
+
+
+def _load_shared_pcm(model, pcm):
+    """
+    قراءة الصوت المفكوك مسبقاً من الذاكرة المشتركة
+
+    :param pcm: (اسم الذاكرة المشتركة, عدد الإطارات, معدل العينة, عدد القنوات)
+    """
+    import numpy as np
+    import torch
+    from multiprocessing import shared_memory, resource_tracker
+    from demucs.audio import convert_audio
+
+    name, frames, samplerate, channels = pcm
+    shm = shared_memory.SharedMemory(name=name)
+    # العملية الرئيسية هي المالكة وهي من تحذف الذاكرة
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    try:
+        samples = np.ndarray((frames, channels), dtype=np.float32, buffer=shm.buf)
+        wav = torch.from_numpy(samples.T.copy())
+        del samples
+    finally:
+        shm.close()
+
+    return convert_audio(wav, samplerate, model.samplerate, model.audio_channels)
+
+
+def _separate(input_path, output_dir, two_stems, mp3_bitrate, state=None, task_id=None, pcm=None,
+              model_name='htdemucs', sources_dir=None):
+    """
+    فصل ملف واحد باستخدام النموذج المحمل مسبقاً
+
+    كل مسارات النموذج تُحفظ في sources_dir (float16) والتجميعة المطلوبة تُرمّز منها إلى MP3.
+    """
+    from demucs.audio import AudioFile
+    from utils.stems import LayoutEncoder
+
+    model = _get_model(model_name)
+    if pcm is not None:
+        wav = _load_shared_pcm(model, pcm)
+    else:
+        wav = AudioFile(input_path).read(
+            streams=0,
+            samplerate=model.samplerate,
+            channels=model.audio_channels
+        )
+
+    stderr = sys.stderr
+    writer = None
+    if state is not None:
+        writer = sys.stderr = _ProgressWriter(state, task_id, len(getattr(model, 'models', [model])))
+    try:
+        with stage('model_run', model=model_name, frames=wav.shape[-1]) as fields:
+            sources, fields['active_frames'] = _run_model_sparse(model, wav, writer)
+    finally:
+        sys.stderr = stderr
+
+    with stage('stem_encode', model=model_name, two_stems=two_stems):
+        encoder = LayoutEncoder(
+            model.sources, output_dir, two_stems, model.samplerate, model.audio_channels,
+            mp3_bitrate, sources_dir
+        )
+        try:
+            encoder.write({name: source.T for name, source in zip(model.sources, sources)})
+        finally:
+            output_files = encoder.close()
+
+    return output_files
+
+
+def _read_exact(stream, size):
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _separate_streaming(input_path, output_dir, two_stems, mp3_bitrate, state=None, task_id=None,
+                        segment=60.0, overlap=5.0, model_name='htdemucs', sources_dir=None):
+    """
+    فصل ملف طويل على شكل مقاطع متداخلة بذاكرة ثابتة تقريباً
+
+    يتم فك ترميز الصوت عبر أنبوب ffmpeg، وتشغيل النموذج على كل مقطع، ودمج التداخل
+    بتلاشي خطي، ثم إرسال النتائج مباشرة إلى ملفات المسارات الكاملة ومرمّز MP3 لكل مسار.
+    """
+    import numpy as np
+    import torch
+    import ffmpeg
+    from utils.ffmpeg_utils import probe_duration
+    from utils.stems import LayoutEncoder
+
+    model = _get_model(model_name)
+    samplerate = model.samplerate
+    channels = model.audio_channels
+    hop = int(segment * samplerate)
+    overlap = max(1, min(int(overlap * samplerate), hop - 1))
+    frame_bytes = 4 * channels
+    total = (probe_duration(input_path) or 0) * samplerate
+
+    encoder = LayoutEncoder(
+        model.sources, output_dir, two_stems, samplerate, channels, mp3_bitrate, sources_dir
+    )
+    output_files = encoder.output_files
+
+    decoder = (
+        ffmpeg.input(input_path)
+        .output('pipe:', format='f32le', acodec='pcm_f32le', ac=channels, ar=samplerate)
+        .global_args('-loglevel', 'error', '-nostats')
+        .run_async(pipe_stdout=True)
+    )
+
+    def emit(stems, end):
+        encoder.write({name: stem[:, :end].T for name, stem in stems.items()})
+
+    head = np.zeros((0, channels), dtype=np.float32)
+    tail = None
+    processed = 0
+    try:
+        while True:
+            if state is not None and state.get(f"{task_id}:cancel"):
+                raise SeparationCancelled("Separation cancelled")
+
+            block = np.frombuffer(_read_exact(decoder.stdout, hop * frame_bytes), dtype=np.float32)
+            block = block.reshape(-1, channels)
+            last = len(block) < hop
+            chunk = np.concatenate([head, block])
+            if not len(chunk):
+                break
+
+            sources, _ = _run_model_sparse(model, torch.from_numpy(chunk.T.copy()))
+            stems = dict(zip(model.sources, sources))
+
+            # دمج منطقة التداخل مع نهاية المقطع السابق
+            if tail is not None:
+                fade = np.linspace(0.0, 1.0, overlap, dtype=np.float32)
+                for name, stem in stems.items():
+                    stem[:, :overlap] = tail[name] * (1.0 - fade) + stem[:, :overlap] * fade
+
+            if last:
+                emit(stems, None)
+                break
+
+            emit(stems, -overlap)
+            tail = {name: stem[:, -overlap:].copy() for name, stem in stems.items()}
+            head = chunk[-overlap:]
+            processed += len(block)
+
+            if state is not None:
+                if total:
+                    state[task_id] = min(99.0, processed / total * 100)
+                # يمكن تشغيل المسارات الجزئية قبل انتهاء الملف بالكامل
+                state[f"{task_id}:stems"] = output_files
+    finally:
+        try:
+            encoder.close()
+        finally:
+            decoder.stdout.close()
+            decoder.wait()
+
+    if decoder.returncode != 0:
+        raise RuntimeError("ffmpeg failed while decoding the input")
+
+    return output_files
+
+
+def validate_stems(model_name, two_stems=None):
+    """
+    التحقق من اسم النموذج والمسارات المطلوب عزلها
+
+    :param two_stems: مسار أو عدة مسارات مفصولة بـ + (مثل drums+bass)
+    :return: two_stems بترتيب مسارات النموذج (حتى يكون مفتاح الذاكرة المؤقتة واحداً)
+    :raises ValueError: عند طلب نموذج أو مسار غير مدعوم
+    """
+    if not isinstance(model_name, str) or model_name not in MODELS:
+        raise ValueError(f"Unknown model: {model_name} (available: {', '.join(MODELS)})")
+    if not two_stems:
+        return None
+    if not isinstance(two_stems, str):
+        raise ValueError("stems must be a string such as 'vocals' or 'drums+bass'")
+
+    sources = MODELS[model_name]
+    selected = set(two_stems.split('+'))
+    unknown = selected.difference(sources)
+    if unknown:
+        raise ValueError(
+            f"Model {model_name} has no '{'+'.join(sorted(unknown))}' stem (available: {', '.join(sources)})"
+        )
+    if len(selected) == len(sources):
+        raise ValueError("Cannot isolate every stem; use all stems instead")
+    return '+'.join(name for name in sources if name in selected)
+
+
+class SeparationEngine:
+    """
+    مجموعة عمليات دائمة تحتفظ بنماذج Demucs في الذاكرة
+
+    كل عملية عاملة تحمل النماذج عند أول طلب لها وتحتفظ بالأحدث استخداماً ضمن memory_budget.
+
+    :param model_name: النموذج الافتراضي (مثل htdemucs)
+    :param workers: عدد العمليات العاملة
+    :param device: cpu أو cuda
+    :param warm_models: النماذج التي تُحمّل عند بدء كل عملية (الافتراضي: model_name)
+    :param memory_budget: أقصى حجم لأوزان النماذج في كل عملية بالبايت (None = بلا حد)
+    :param silence: (عتبة الصمت بالديسيبل، أقل مدة صمت بالثواني) لتخطي النموذج في الصمت الطويل،
+                    أو None لتشغيله على كل الملف
+    """
+
+    def __init__(self, model_name='htdemucs', workers=1, device='cpu', warm_models=None, memory_budget=None,
+                 silence=None):
+        self.model_name = model_name
+        self.workers = max(1, int(workers))
+        self.device = device
+        self.warm_models = tuple(warm_models) if warm_models is not None else (model_name,)
+        self.memory_budget = memory_budget
+        self.silence = tuple(silence) if silence else None
+        self._executor = None
+        self._manager = None
+        self._state = None
+
+    def _create_executor(self):
+        # spawn بدلاً من fork لأن torch لا يتعامل جيداً مع fork
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.warm_models, self.device, threads, self.memory_budget, self.silence)
+        )
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = self._create_executor()
+        return self._executor
+
+    @property
+    def state(self):
+        # قاموس مشترك بين العمليات لنقل نسبة التقدم وطلبات الإلغاء
+        if self._state is None:
+            self._manager = multiprocessing.get_context('spawn').Manager()
+            self._state = self._manager.dict()
+        return self._state
+
+    def warmup(self):
+        """تشغيل جميع العمليات العاملة وتحميل النماذج قبل أول طلب"""
+        futures = [self.executor.submit(_ping) for _ in range(self.workers)]
+        return [future.result() for future in futures]
+
+    def separate(self, input_path, output_dir, two_stems='vocals', mp3_bitrate=192,
+                 timeout=None, progress=None, cancelled=None, segment=None, overlap=5.0,
+                 partial=None, pcm=None, model=None, sources_dir=None):
+        """
+        فصل ملف صوتي وإرجاع قاموس {اسم المسار: مسار الملف}
+
+        :param two_stems: المسار المطلوب عزله عن الباقي، أو None لكل مسارات النموذج
+        :param progress: دالة تستقبل نسبة التقدم (0-100)
+        :param cancelled: دالة تعيد True عند طلب الإلغاء
+        :param segment: طول المقطع بالثواني لتفعيل الفصل المتدفق للملفات الطويلة
+        :param overlap: طول التداخل بين المقاطع بالثواني
+        :param partial: دالة تستقبل مسارات الملفات الجزئية بعد كتابة أول مقطع
+        :param pcm: صوت مفكوك مسبقاً في ذاكرة مشتركة بدلاً من قراءة input_path
+                    (اسم الذاكرة, عدد الإطارات, معدل العينة, عدد القنوات)
+        :param model: اسم النموذج (الافتراضي: model_name)
+        :param sources_dir: مجلد لحفظ كل مسارات النموذج (float16) لاشتقاق تجميعات أخرى لاحقاً دون فصل جديد
+        :raises ValueError: عند طلب نموذج أو مسار غير مدعوم
+        :raises concurrent.futures.TimeoutError: عند تجاوز المهلة
+        :raises SeparationCancelled: عند الإلغاء
+        """
+        model = model or self.model_name
+        two_stems = validate_stems(model, two_stems)
+
+        state = self.state
+        task_id = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            if segment:
+                future = self.executor.submit(
+                    _separate_streaming, input_path, output_dir, two_stems, mp3_bitrate,
+                    state, task_id, segment, overlap, model, sources_dir
+                )
+            else:
+                future = self.executor.submit(
+                    _separate, input_path, output_dir, two_stems, mp3_bitrate, state, task_id, pcm, model,
+                    sources_dir
+                )
+            partial_sent = False
+            while True:
+                try:
+                    return future.result(timeout=0.5)
+                except FutureTimeoutError:
+                    pass
+                if progress:
+                    progress(state.get(task_id, 0))
+                if partial and not partial_sent and f"{task_id}:stems" in state:
+                    partial(state[f"{task_id}:stems"])
+                    partial_sent = True
+                if cancelled and cancelled():
+                    state[f"{task_id}:cancel"] = True
+                    future.cancel()
+                if deadline and time.monotonic() > deadline:
+                    state[f"{task_id}:cancel"] = True
+                    future.cancel()
+                    raise FutureTimeoutError()
+        except BrokenProcessPool:
+            # توقف أحد العمليات (مثلاً نفاد الذاكرة) - إعادة إنشاء المجموعة للطلبات القادمة
+            log_event('pool_crashed', pool='separation')
+            self.shutdown(wait=False)
+            raise
+        finally:
+            for key in (task_id, f"{task_id}:cancel", f"{task_id}:stems"):
+                state.pop(key, None)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+
+def main(argv=None):
+    """
+    فصل عدة ملفات من سطر الأوامر مع تحميل النموذج مرة واحدة لكل عملية عاملة
+
+    python -m utils.separator song1.mp3 song2.mp4 --out static/separated --workers 2
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    parser = argparse.ArgumentParser(description="Batch stem separation with a resident Demucs model")
+    parser.add_argument('inputs', nargs='+', help="Audio or video files to separate")
+    parser.add_argument('--out', default='static/separated', help="Output folder")
+    parser.add_argument('-n', '--model', default='htdemucs', help="Demucs model name")
+    parser.add_argument('--workers', type=int, default=1, help="Number of model worker processes")
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--two-stems', default='vocals', help="Stem to isolate, or 'none' for all stems")
+    parser.add_argument('--mp3-bitrate', type=int, default=192)
+    parser.add_argument('--silence-db', type=float, default=-50.0,
+                        help="Skip the model on silence quieter than this (dBFS)")
+    parser.add_argument('--min-silence', type=float, default=4.0,
+                        help="Only skip silent stretches at least this long (seconds, 0 disables skipping)")
+    args = parser.parse_args(argv)
+
+    two_stems = None if args.two_stems == 'none' else args.two_stems
+    silence = (args.silence_db, args.min_silence) if args.min_silence > 0 else None
+    engine = SeparationEngine(args.model, args.workers, args.device, silence=silence)
+    engine.warmup()
+
+    failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=engine.workers) as executor:
+            futures = {
+                executor.submit(
+                    engine.separate,
+                    os.path.abspath(input_path),
+                    os.path.join(os.path.abspath(args.out), args.model,
+                                 os.path.splitext(os.path.basename(input_path))[0]),
+                    two_stems,
+                    args.mp3_bitrate
+                ): input_path
+                for input_path in args.inputs
+            }
+            for future in as_completed(futures):
+                input_path = futures[future]
+                try:
+                    for name, stem_path in future.result().items():
+                        print(f"[BATCH] {input_path}: {name} -> {stem_path}")
+                except Exception as e:
+                    failed += 1
+                    print(f"[BATCH ERROR] {input_path}: {str(e)}")
+    finally:
+        engine.shutdown()
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import os
+import mimetypes
+from urllib.parse import quote
+from flask import Response, send_file
+
+# طرق تسليم الملفات: بايثون مباشرة (sendfile عبر wsgi.file_wrapper)، أو عبر الخادم الأمامي
+OFFLOAD_MODES = ('', 'x-accel', 'x-sendfile')
+
+
+class MediaSender:
+    """
+    تسليم الملفات الكبيرة دون إبقاء خيط بايثون مشغولاً طوال التحميل
+
+    - '' : send_file مع ETag و Range والطلبات الشرطية (gunicorn يستخدم sendfile بدون نسخ)
+    - 'x-accel' : ترويسة X-Accel-Redirect و nginx يرسل الملف من موقع internal
+    - 'x-sendfile' : ترويسة X-Sendfile لـ Apache/lighttpd (USE_X_SENDFILE في Flask)
+
+    :param offload: إحدى OFFLOAD_MODES
+    :param root: المجلد الذي يقابل accel_prefix في إعدادات nginx
+    :param accel_prefix: مسار الموقع internal في nginx
+    """
+
+    def __init__(self, offload='', root='static', accel_prefix='/_protected/static/'):
+        if offload not in OFFLOAD_MODES:
+            raise ValueError(f"Unknown static offload mode: {offload}")
+        self.offload = offload
+        self.root = os.path.abspath(root)
+        self.accel_prefix = accel_prefix.rstrip('/') + '/'
+
+    @staticmethod
+    def cache_control(max_age=None, immutable=False):
+        if not max_age:
+            # يُعاد التحقق في كل مرة عبر ETag (رد 304 بدون جسم إذا لم يتغير الملف)
+            return 'no-cache'
+        return f"public, max-age={max_age}" + (", immutable" if immutable else "")
+
+    def send(self, path, mimetype=None, as_attachment=False, download_name=None, max_age=None, immutable=False):
+        """
+        :param max_age: مدة تخزين المتصفح للملف بالثواني (None = إعادة التحقق دائماً)
+        :param immutable: محتوى الملف لا يتغير أبداً تحت نفس الرابط
+        """
+        path = os.path.abspath(path)
+        if self.offload == 'x-accel':
+            response = self._accel_redirect(path, mimetype, as_attachment, download_name)
+        else:
+            response = send_file(
+                path,
+                mimetype=mimetype,
+                as_attachment=as_attachment,
+                download_name=download_name,
+                conditional=True,
+                etag=True,
+                max_age=max_age
+            )
+            # werkzeug يضيفها لردود 206 فقط، والمتصفح يحتاجها ليعرف أن التقديم في الملف ممكن
+            response.headers.setdefault('Accept-Ranges', 'bytes')
+        response.headers['Cache-Control'] = self.cache_control(max_age, immutable)
+        return response
+
+    def _accel_redirect(self, path, mimetype, as_attachment, download_name):
+        # nginx يتولى Range و ETag و If-None-Match بنفسه لأنه يرسل الملف كملف ثابت
+        rel_path = os.path.relpath(path, self.root)
+        if rel_path.startswith(os.pardir):
+            raise ValueError(f"{path} is outside {self.root}")
+
+        response = Response(mimetype=mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = quote(self.accel_prefix + rel_path.replace(os.sep, '/'))
+        if as_attachment:
+            filename = download_name or os.path.basename(path)
+            response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+        return response
@@ -0,0 +1,325 @@
+import os
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import ffmpeg
+from utils.metrics import log_event
+
+# numpy يُستورد داخل الدوال حتى لا تحمّله عملية الويب التي تحتاج الثوابت فقط
+
+# مخرجات النموذج الكاملة لكل مسار: float16 بشكل (إطارات، قنوات)
+SOURCE_SUFFIX = '.f16.npy'
+SOURCES_INFO = 'sources.json'
+
+# عدد الإطارات في كل دفعة عند الجمع والترميز
+BLOCK_FRAMES = 1 << 18
+
+# صيغ التسليم وخيارات ffmpeg لكل منها (الامتداد هو اسم الصيغة)
+FORMATS = {
+    'mp3': {'acodec': 'libmp3lame', 'audio_bitrate': '192k'},
+    'm4a': {'acodec': 'aac', 'audio_bitrate': '192k', 'movflags': 'faststart'},
+    'flac': {'acodec': 'flac', 'sample_fmt': 's16'},
+    'opus': {'acodec': 'libopus', 'audio_bitrate': '128k'},
+}
+
+MIMETYPES = {
+    'mp3': 'audio/mpeg',
+    'm4a': 'audio/mp4',
+    'flac': 'audio/flac',
+    'opus': 'audio/ogg',
+}
+
+# حجم ترويسة npy ثابت حتى يمكن إعادة كتابتها بعد معرفة عدد الإطارات الحقيقي
+_HEADER_SIZE = 128
+_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+def stem_layout(source_names, two_stems=None):
+    """
+    المسارات الناتجة وما يُجمع لكل منها
+
+    two_stems: مسار واحد أو عدة مسارات مفصولة بـ + (مثل drums+bass) تُعزل عن الباقي،
+    أو None لكل مسار على حدة.
+
+    :return: {اسم المسار الناتج: [أسماء مسارات النموذج]}
+    """
+    if not two_stems:
+        return {name: [name] for name in source_names}
+    selected = two_stems.split('+')
+    return {
+        two_stems: selected,
+        f"no_{two_stems}": [name for name in source_names if name not in selected]
+    }
+
+
+def _pcm_encoder(output_path, samplerate, channels, options):
+    """عملية ffmpeg تستقبل float32 متداخل على stdin وتكتب الملف بالصيغة المطلوبة"""
+    return (
+        ffmpeg.input('pipe:', format='f32le', ac=channels, ar=samplerate)
+        .output(output_path, **options)
+        .global_args('-loglevel', 'error', '-nostats')
+        .run_async(pipe_stdin=True, overwrite_output=True)
+    )
+
+
+def _npy_header(frames, channels, descr='<f2'):
+    header = repr({'descr': descr, 'fortran_order': False, 'shape': (frames, channels)}).encode('latin1')
+    header = header.ljust(_HEADER_SIZE - len(_MAGIC) - 2 - 1) + b'\n'
+    return _MAGIC + len(header).to_bytes(2, 'little') + header
+
+
+class SourceWriter:
+    """
+    كتابة مسار على دفعات إلى ملف .npy دون معرفة طوله مسبقاً
+
+    :param dtype: نوع العينات في الملف (float16 لمخرجات النموذج، int16 لـ PCM المعاينة)
+    """
+
+    def __init__(self, path, channels, dtype='<f2'):
+        self.path = path
+        self.channels = channels
+        self.dtype = dtype
+        self.frames = 0
+        self._file = open(path, 'wb')
+        self._file.write(_npy_header(0, channels, dtype))
+
+    def write(self, block):
+        """:param block: مصفوفة (إطارات، قنوات)"""
+        import numpy as np
+
+        self._file.write(np.ascontiguousarray(block, dtype=self.dtype).tobytes())
+        self.frames += len(block)
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(_npy_header(self.frames, self.channels, self.dtype))
+        self._file.close()
+
+
+class LayoutEncoder:
+    """
+    حفظ مسارات النموذج الكاملة (float16) وترميز التجميعة المطلوبة منها إلى MP3 في نفس المرور
+
+    التجميعة تُحسب دائماً من القيم بعد تحويلها إلى float16، لذلك تعطي نفس النتيجة
+    سواء رُمّزت مباشرة بعد الفصل أو لاحقاً من المسارات المحفوظة.
+
+    :param sources_dir: مجلد حفظ المسارات الكاملة (None = بدون حفظ)
+    """
+
+    def __init__(self, source_names, output_dir, two_stems, samplerate, channels, mp3_bitrate,
+                 sources_dir=None):
+        self.source_names = list(source_names)
+        self.layout = stem_layout(self.source_names, two_stems)
+        self.samplerate = samplerate
+        self.channels = channels
+        self.sources_dir = sources_dir
+
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_files = {name: os.path.join(output_dir, f"{name}.mp3") for name in self.layout}
+        self.writers = {}
+        if sources_dir:
+            os.makedirs(sources_dir, exist_ok=True)
+            self.writers = {
+                name: SourceWriter(os.path.join(sources_dir, f"{name}{SOURCE_SUFFIX}"), channels)
+                for name in self.source_names
+            }
+        self.encoders = {
+            name: _pcm_encoder(stem_path, samplerate, channels, {**FORMATS['mp3'], 'audio_bitrate': f"{mp3_bitrate}k"})
+            for name, stem_path in self.output_files.items()
+        }
+
+    def write(self, sources):
+        """:param sources: {اسم مسار النموذج: مصفوفة (إطارات، قنوات)}"""
+        import numpy as np
+
+        sources = {name: np.asarray(block, dtype=np.float16) for name, block in sources.items()}
+        for name, writer in self.writers.items():
+            writer.write(sources[name])
+
+        frames = len(next(iter(sources.values())))
+        for name, parts in self.layout.items():
+            mixed = np.zeros((frames, self.channels), dtype=np.float32)
+            for part in parts:
+                mixed += sources[part]
+            np.clip(mixed, -1.0, 1.0, out=mixed)
+            self.encoders[name].stdin.write(mixed.tobytes())
+
+    def close(self):
+        """إنهاء الترميز وإرجاع {اسم المسار الناتج: مسار MP3}"""
+        for writer in self.writers.values():
+            writer.close()
+        for encoder in self.encoders.values():
+            encoder.stdin.close()
+        for encoder in self.encoders.values():
+            encoder.wait()
+
+        if self.sources_dir:
+            with open(os.path.join(self.sources_dir, SOURCES_INFO), 'w', encoding='utf8') as f:
+                json.dump({'samplerate': self.samplerate, 'channels': self.channels, 'sources': self.source_names}, f)
+
+        failed = [name for name, encoder in self.encoders.items() if encoder.returncode != 0]
+        if failed:
+            raise RuntimeError(f"ffmpeg failed while encoding stems: {failed}")
+        return self.output_files
+
+
+def source_paths(sources_dir):
+    """{اسم مسار النموذج: مسار ملف float16} لكل المسارات المحفوظة في المجلد"""
+    return {
+        filename[:-len(SOURCE_SUFFIX)]: os.path.join(sources_dir, filename)
+        for filename in sorted(os.listdir(sources_dir))
+        if filename.endswith(SOURCE_SUFFIX)
+    }
+
+
+def sources_info(sources_dir):
+    with open(os.path.join(sources_dir, SOURCES_INFO), encoding='utf8') as f:
+        return json.load(f)
+
+
+def load_sources(paths):
+    """فتح المسارات المحفوظة بـ mmap دون قراءتها في الذاكرة"""
+    import numpy as np
+
+    return {name: np.load(path, mmap_mode='r') for name, path in paths.items()}
+
+
+def encode_layout(paths, output_dir, two_stems, mp3_bitrate=192):
+    """
+    ترميز تجميعة جديدة من المسارات المحفوظة بالجمع فقط، دون تشغيل النموذج مرة أخرى
+
+    :param paths: {اسم مسار النموذج: مسار ملف float16} (من نفس المجلد)
+    """
+    info = sources_info(os.path.dirname(next(iter(paths.values()))))
+    sources = load_sources(paths)
+    frames = min(len(source) for source in sources.values())
+
+    encoder = LayoutEncoder(
+        info['sources'], output_dir, two_stems, info['samplerate'], info['channels'], mp3_bitrate
+    )
+    try:
+        for start in range(0, frames, BLOCK_FRAMES):
+            end = min(frames, start + BLOCK_FRAMES)
+            encoder.write({name: source[start:end] for name, source in sources.items()})
+    finally:
+        stems = encoder.close()
+    return stems
+
+
+def iter_mix(parts, block_frames=BLOCK_FRAMES):
+    """
+    جمع عدة مسارات محفوظة على دفعات float32 (إطارات، قنوات)
+
+    :param parts: [(مسار ملف float16, معامل)]
+    """
+    import numpy as np
+
+    sources = [(np.load(path, mmap_mode='r'), gain) for path, gain in parts]
+    frames = min(len(source) for source, _ in sources)
+    channels = sources[0][0].shape[1]
+    for start in range(0, frames, block_frames):
+        end = min(frames, start + block_frames)
+        mixed = np.zeros((end - start, channels), dtype=np.float32)
+        for source, gain in sources:
+            if gain == 1.0:
+                mixed += source[start:end]
+            elif gain:
+                mixed += source[start:end].astype(np.float32) * gain
+        yield mixed
+
+
+def _encode_stem(parts, fallback_path, output_path, fmt):
+    """
+    ترميز مسار واحد بالصيغة المطلوبة (تعمل داخل عملية من مجموعة الترميز)
+
+    :param parts: ملفات float16 التي يُجمع منها المسار، أو None للتحويل من fallback_path
+    """
+    import numpy as np
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp.{fmt}"
+    try:
+        if parts:
+            info = sources_info(os.path.dirname(parts[0]))
+            encoder = _pcm_encoder(tmp_path, info['samplerate'], info['channels'], FORMATS[fmt])
+            try:
+                for mixed in iter_mix([(path, 1.0) for path in parts]):
+                    np.clip(mixed, -1.0, 1.0, out=mixed)
+                    encoder.stdin.write(mixed.tobytes())
+            finally:
+                encoder.stdin.close()
+                encoder.wait()
+            if encoder.returncode != 0:
+                raise RuntimeError(f"ffmpeg failed while encoding {output_path}")
+        else:
+            try:
+                (
+                    ffmpeg.input(fallback_path)
+                    .output(tmp_path, **FORMATS[fmt])
+                    .global_args('-loglevel', 'error', '-nostats')
+                    .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+                )
+            except ffmpeg.Error as e:
+                # ffmpeg.Error لا يمكن إعادة بنائه في العملية الأم (pickle) فتتعطل المجموعة كلها
+                raise RuntimeError(
+                    f"ffmpeg failed while encoding {output_path}: "
+                    f"{e.stderr.decode('utf8', 'replace').strip() if e.stderr else e}"
+                ) from None
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output_path
+
+
+class StemEncoder:
+    """
+    ترميز المسارات إلى صيغ التسليم عند أول طلب لكل صيغة، بالتوازي على مجموعة عمليات
+
+    :param workers: عدد عمليات الترميز
+    """
+
+    def __init__(self, workers=2):
+        self.workers = max(1, int(workers))
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def encode(self, stems, fmt):
+        """
+        ترميز كل مسارات التجميعة بالصيغة fmt بجانب ملفات MP3 الأصلية
+
+        :param stems: {اسم المسار: (مسار ملف MP3, [ملفات float16] أو None)}
+        :return: {اسم المسار: مسار الملف المرمّز}
+        :raises ValueError: عند طلب صيغة غير مدعومة
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format: {fmt} (available: {', '.join(FORMATS)})")
+
+        outputs = {name: f"{os.path.splitext(mp3_path)[0]}.{fmt}" for name, (mp3_path, _) in stems.items()}
+        futures = {
+            name: self.executor.submit(_encode_stem, parts, mp3_path, outputs[name], fmt)
+            for name, (mp3_path, parts) in stems.items()
+            if not os.path.exists(outputs[name])
+        }
+        try:
+            for future in futures.values():
+                future.result()
+        except BrokenProcessPool:
+            # توقف إحدى العمليات - إعادة إنشاء المجموعة للطلبات القادمة
+            log_event('pool_crashed', pool='encoder')
+            self.shutdown(wait=False)
+            raise
+        return outputs
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
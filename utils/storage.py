@@ -0,0 +1,258 @@
+import os
+import stat
+import shutil
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from utils.metrics import STORAGE_BYTES, STORAGE_REMOVED, log_event
+
+# الملفات المخفية (مجلدات staging وملفات .tmp) كتابة قيد التنفيذ: لا تُحذف بسبب الحصة،
+# وتُعتبر متروكة فقط إذا لم تتغير طوال هذه المدة
+STALE_AFTER = 6 * 3600
+
+
+class Artifact:
+    """ملف أو مجلد في المستوى الأول من منطقة تخزين"""
+
+    def __init__(self, path, area, size, last_access, owner=None):
+        self.path = path
+        self.area = area
+        self.size = size
+        self.last_access = last_access
+        self.owner = owner
+
+    @property
+    def hidden(self):
+        return os.path.basename(self.path).startswith('.')
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'area': self.area,
+            'size': self.size,
+            'last_access': self.last_access,
+            'owner': self.owner
+        }
+
+
+class Area:
+    """
+    مجلد تُدار محتوياته
+
+    :param ttl: مدة الاحتفاظ بعد آخر استخدام بالثواني (None = الحصة فقط)
+    :param remove: دالة حذف خاصة (مثل ResultCache.remove) تُرجع False إذا كان العنصر مشغولاً
+    """
+
+    def __init__(self, name, root, ttl=None, remove=None):
+        self.name = name
+        self.root = os.path.abspath(root)
+        self.ttl = ttl
+        self.remove = remove
+
+
+def _entry_stats(path):
+    """
+    (الحجم، آخر تعديل) - للمجلدات المجموع والأحدث للملفات بداخلها
+
+    وقت تعديل المجلد نفسه يتغير عند النسخ أو الاستنساخ، لذلك يُستخدم فقط للمجلد الفارغ.
+    """
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        return info.st_size, info.st_mtime
+
+    size, mtime, dir_mtime = 0, None, info.st_mtime
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                info = os.lstat(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            size += info.st_size
+            mtime = info.st_mtime if mtime is None else max(mtime, info.st_mtime)
+    return size, dir_mtime if mtime is None else mtime
+
+
+class StorageManager:
+    """
+    دورة حياة الملفات الناتجة: مدة صلاحية لكل منطقة وحصة كلية بالبايت مع حذف الأقدم استخداماً
+
+    المالك ووقت آخر استخدام يُسجلان في الذاكرة؛ بعد إعادة التشغيل يُعتمد على وقت التعديل.
+    لا يُحذف أي عنصر مثبت (pin) أو تستخدمه مهمة قيد التشغيل (protect).
+
+    :param quota: الحد الأقصى لمجموع أحجام كل المناطق
+    :param interval: الفاصل بين دورات التنظيف بالثواني (0 = بدون خيط تنظيف)
+    """
+
+    def __init__(self, quota, interval=300):
+        self.quota = quota
+        self.interval = interval
+        self.areas = {}
+        self._owners = {}
+        self._access = {}
+        self._pins = Counter()
+        self._guards = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_area(self, name, root, ttl=None, remove=None):
+        area = Area(name, root, ttl, remove)
+        self.areas[name] = area
+        return area
+
+    def protect(self, guard):
+        """تسجيل دالة guard(path) تُرجع True إذا كان العنصر قيد الاستخدام"""
+        self._guards.append(guard)
+
+    def _locate(self, path):
+        """(المنطقة، مسار العنصر في مستواها الأول) لأي ملف داخلها، أو (None, None)"""
+        path = os.path.abspath(path)
+        area = max(
+            (area for area in self.areas.values() if path.startswith(area.root + os.sep)),
+            key=lambda area: len(area.root),
+            default=None
+        )
+        if area is None:
+            return None, None
+        top = os.path.relpath(path, area.root).split(os.sep)[0]
+        return area, os.path.join(area.root, top)
+
+    def track(self, path, owner):
+        """تسجيل مالك عنصر جديد (مثل job:<id> أو client:<ip>)"""
+        _, artifact = self._locate(path)
+        if artifact is not None:
+            with self._lock:
+                self._owners[artifact] = owner
+                self._access[artifact] = time.time()
+
+    def touch(self, path):
+        """تحديث وقت آخر استخدام (مثلاً عند تحميل الملف)"""
+        _, artifact = self._locate(path)
+        if artifact is not None:
+            with self._lock:
+                self._access[artifact] = time.time()
+
+    @contextmanager
+    def pin(self, *paths):
+        """منع حذف هذه الملفات (أو المجلدات التي تحتويها) طوال الكتلة"""
+        paths = [os.path.abspath(path) for path in paths if path]
+        with self._lock:
+            self._pins.update(paths)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pins.subtract(paths)
+                for path in paths:
+                    if self._pins[path] <= 0:
+                        del self._pins[path]
+
+    def in_use(self, path):
+        path = os.path.abspath(path)
+        prefix = path + os.sep
+        with self._lock:
+            pinned = any(pin == path or pin.startswith(prefix) for pin in self._pins)
+        return pinned or any(guard(path) for guard in self._guards)
+
+    def artifacts(self):
+        """كل العناصر في كل المناطق (المناطق المتداخلة لا تُحسب مرتين)"""
+        roots = {area.root for area in self.areas.values()}
+        artifacts = []
+        for area in self.areas.values():
+            try:
+                names = os.listdir(area.root)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(area.root, name)
+                if path in roots:
+                    continue
+                try:
+                    size, mtime = _entry_stats(path)
+                except OSError:
+                    continue
+                with self._lock:
+                    last_access = max(mtime, self._access.get(path, 0))
+                    owner = self._owners.get(path)
+                artifacts.append(Artifact(path, area.name, size, last_access, owner))
+        return artifacts
+
+    def _remove(self, artifact, reason):
+        if self.in_use(artifact.path):
+            return False
+        area = self.areas[artifact.area]
+        try:
+            if area.remove is not None:
+                if not area.remove(artifact.path):
+                    return False
+            elif os.path.isdir(artifact.path) and not os.path.islink(artifact.path):
+                shutil.rmtree(artifact.path)
+            else:
+                os.remove(artifact.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log_event('storage_remove_failed', reason=reason, path=artifact.path, error=str(e))
+            return False
+
+        with self._lock:
+            self._owners.pop(artifact.path, None)
+            self._access.pop(artifact.path, None)
+        STORAGE_REMOVED.inc(area=artifact.area, reason=reason)
+        log_event('storage_remove', reason=reason, **artifact.to_dict())
+        return True
+
+    def collect(self, now=None):
+        """
+        دورة تنظيف واحدة: حذف المنتهية صلاحيتها ثم الأقدم استخداماً حتى النزول تحت الحصة
+
+        :return: العناصر المحذوفة
+        """
+        now = now or time.time()
+        removed = []
+        remaining = []
+        for artifact in self.artifacts():
+            ttl = STALE_AFTER if artifact.hidden else self.areas[artifact.area].ttl
+            if ttl is not None and now - artifact.last_access > ttl and self._remove(artifact, 'ttl'):
+                removed.append(artifact)
+            else:
+                remaining.append(artifact)
+
+        total = sum(artifact.size for artifact in remaining)
+        for artifact in sorted(remaining, key=lambda artifact: artifact.last_access):
+            if total <= self.quota:
+                break
+            if not artifact.hidden and self._remove(artifact, 'quota'):
+                removed.append(artifact)
+                total -= artifact.size
+
+        removed_paths = {artifact.path for artifact in removed}
+        sizes = dict.fromkeys(self.areas, 0)
+        for artifact in remaining:
+            if artifact.path not in removed_paths:
+                sizes[artifact.area] += artifact.size
+        for name, size in sizes.items():
+            STORAGE_BYTES.set(size, area=name)
+        return removed
+
+    def _run(self):
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                log_event('storage_janitor_failed', error=str(e))
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='storage-janitor', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,311 @@
+import os
+import re
+import json
+import time
+import uuid
+import ffmpeg
+from utils.cache import KeyLock
+
+# الحجم المقترح لكل جزء يرسله المتصفح
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# عدد البايتات التي تكفي لفحص الملف بـ ffprobe قبل اكتمال الرفع
+PROBE_BYTES = 1024 * 1024
+
+# عدد البايتات اللازمة للتعرف على نوع الملف من ترويسته
+SNIFF_BYTES = 12
+
+COPY_BLOCK = 1024 * 1024
+
+
+class UploadError(Exception):
+    status = 400
+
+
+class UploadOffsetError(UploadError):
+    """الجزء لا يبدأ من آخر موضع مستلم (يجب على العميل الاستئناف منه)"""
+    status = 409
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+class UploadNotFoundError(UploadError):
+    """الجلسة انتهت أو أُنهيت من عملية أخرى"""
+    status = 404
+
+
+class UploadTooLargeError(UploadError):
+    status = 413
+
+
+class InvalidMediaError(UploadError):
+    status = 415
+
+
+def sniff_format(header):
+    """التعرف على الحاوية من أول البايتات: wav أو mp4 أو mp3"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        return 'wav'
+    if header[4:8] == b'ftyp':
+        return 'mp4'
+    if header[:3] == b'ID3' or (len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    return None
+
+
+def probe_has_audio(path):
+    """
+    فحص الملف بـ ffprobe
+
+    :return: True إذا وُجد مسار صوتي، False إذا لم يوجد
+    :raises ffmpeg.Error: إذا تعذرت قراءة الملف (قد يكون ناقصاً)
+    """
+    info = ffmpeg.probe(path)
+    return any(stream.get('codec_type') == 'audio' for stream in info.get('streams', []))
+
+
+class Upload:
+    """
+    رفع مجزأ قيد التنفيذ: الأجزاء تُكتب مباشرة في الملف النهائي
+
+    received لا يُحفظ: هو حجم الملف على القرص، لأن الأجزاء تُكتب متصلة من بدايته.
+    """
+    _fields = ('id', 'filename', 'path', 'size', 'format', 'probed', 'validated', 'created_at', 'updated_at')
+
+    def __init__(self, filename, path, size):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.received = 0
+        self.format = None
+        self.probed = False
+        self.validated = False
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.received,
+            'format': self.format,
+            'validated': self.validated
+        }
+
+
+class UploadManager:
+    """
+    جلسات الرفع المجزأ القابل للاستئناف
+
+    حالة كل جلسة ملف JSON في state_dir وقفلها flock على ملف بجانبه، فيمكن لأي عملية ويب
+    (أو عقدة تشارك نفس المجلد) استقبال الأجزاء التالية أو إنهاء الرفع.
+
+    :param max_size: أقصى حجم للملف بالبايت
+    :param state_dir: مجلد ملفات الجلسات (مشترك بين العمليات)
+    :param ttl: مدة الاحتفاظ بالرفع غير المكتمل بعد آخر جزء (بالثواني)
+    """
+    _id_pattern = re.compile(r'[0-9a-f]{32}')
+
+    def __init__(self, max_size, state_dir, ttl=24 * 3600):
+        self.max_size = max_size
+        self.state_dir = os.path.abspath(state_dir)
+        self.ttl = ttl
+
+    def _state_path(self, upload_id):
+        return os.path.join(self.state_dir, f"{upload_id}.json")
+
+    def _lock(self, upload_id):
+        return KeyLock(os.path.join(self.state_dir, f"{upload_id}.lock"))
+
+    def _save(self, upload):
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = f"{self._state_path(upload.id)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump({field: getattr(upload, field) for field in Upload._fields}, f)
+        os.replace(tmp_path, self._state_path(upload.id))
+
+    def _load(self, upload_id, upload=None):
+        """قراءة حالة الجلسة من القرص (في upload إذا أُعطي)، أو None إذا لم تعد موجودة"""
+        try:
+            with open(self._state_path(upload_id), encoding='utf8') as f:
+                state = json.load(f)
+            received = os.path.getsize(state['path'])
+        except (FileNotFoundError, ValueError):
+            return None
+        if upload is None:
+            upload = Upload(state['filename'], state['path'], state['size'])
+        for field in Upload._fields:
+            setattr(upload, field, state[field])
+        upload.received = received
+        return upload
+
+    def _reload(self, upload):
+        if self._load(upload.id, upload) is None:
+            raise UploadNotFoundError("Upload not found")
+
+    def _sessions(self):
+        try:
+            names = os.listdir(self.state_dir)
+        except FileNotFoundError:
+            return []
+        return [name[:-5] for name in names if name.endswith('.json') and self._id_pattern.fullmatch(name[:-5])]
+
+    def create(self, filename, path, size):
+        if size <= 0:
+            raise UploadError("File is empty")
+        if size > self.max_size:
+            raise UploadTooLargeError(f"File is too large (max {self.max_size} bytes)")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb'):
+            pass
+
+        self._prune()
+        upload = Upload(filename, path, size)
+        self._save(upload)
+        return upload
+
+    def get(self, upload_id):
+        if not self._id_pattern.fullmatch(upload_id):
+            return None
+        return self._load(upload_id)
+
+    def is_pending(self, filename):
+        """هل الملف ما زال قيد الرفع (لا يجب معالجته بعد)"""
+        for upload_id in self._sessions():
+            upload = self._load(upload_id)
+            if upload is not None and upload.filename == filename:
+                return True
+        return False
+
+    def write(self, upload, offset, stream):
+        """
+        كتابة جزء يبدأ من offset مباشرة من تدفق الطلب إلى الملف
+
+        إعادة إرسال جزء سبق استلامه مسموحة (بعد انقطاع الاتصال)، لكن لا يُسمح بترك فجوة.
+
+        :return: عدد البايتات المستلمة بشكل متصل من بداية الملف
+        """
+        with self._lock(upload.id):
+            # عملية أخرى قد تكون استقبلت أجزاء منذ قراءة الجلسة
+            self._reload(upload)
+            if offset < 0 or offset > upload.received:
+                raise UploadOffsetError(f"Expected offset {upload.received}", upload.received)
+
+            if offset < PROBE_BYTES:
+                # إعادة كتابة بداية الملف تُبطل نتيجة الفحص السابق، فيُعاد من جديد بعد الكتابة
+                upload.format = None
+                upload.probed = False
+                upload.validated = False
+                self._save(upload)
+
+            position = offset
+            try:
+                with open(upload.path, 'r+b') as f:
+                    f.seek(offset)
+                    while True:
+                        block = stream.read(COPY_BLOCK)
+                        if not block:
+                            break
+                        if position + len(block) > upload.size:
+                            raise UploadTooLargeError("Chunk exceeds the declared file size")
+                        f.write(block)
+                        position += len(block)
+                        # ما كُتب حتى الآن يبقى محسوباً حتى لو انقطع الاتصال في منتصف الجزء
+                        upload.received = max(upload.received, position)
+            finally:
+                upload.updated_at = time.time()
+                self._save(upload)
+
+            try:
+                self._validate_early(upload)
+            except InvalidMediaError:
+                self._discard(upload)
+                raise
+            self._save(upload)
+            return upload.received
+
+    def _validate_early(self, upload):
+        """رفض الملفات غير الصالحة من أول الأجزاء بدل انتظار اكتمال الرفع"""
+        if upload.format is None and upload.received >= min(SNIFF_BYTES, upload.size):
+            with open(upload.path, 'rb') as f:
+                upload.format = sniff_format(f.read(SNIFF_BYTES))
+            if upload.format is None:
+                raise InvalidMediaError("Unsupported or unrecognized media file")
+
+        if not upload.probed and upload.received >= min(PROBE_BYTES, upload.size):
+            upload.probed = True
+            try:
+                has_audio = probe_has_audio(upload.path)
+            except ffmpeg.Error:
+                # بعض الحاويات (mp4 مع moov في النهاية) لا تُقرأ قبل الاكتمال - الفحص يُعاد عند الإنهاء
+                return
+            if not has_audio:
+                raise InvalidMediaError("File has no audio stream")
+            upload.validated = True
+
+    def finalize(self, upload):
+        """التحقق من اكتمال الملف وصلاحيته ثم إنهاء الجلسة"""
+        with self._lock(upload.id):
+            self._reload(upload)
+            if upload.received != upload.size:
+                raise UploadOffsetError(
+                    f"Upload incomplete ({upload.received} of {upload.size} bytes)", upload.received
+                )
+            if not upload.validated:
+                try:
+                    has_audio = probe_has_audio(upload.path)
+                except ffmpeg.Error:
+                    has_audio = False
+                if not has_audio:
+                    self._discard(upload)
+                    raise InvalidMediaError("File is not a valid audio or video file")
+                upload.validated = True
+
+            self._end(upload.id)
+        return upload
+
+    def abort(self, upload):
+        with self._lock(upload.id):
+            self._discard(upload)
+
+    def _discard(self, upload):
+        """حذف الجلسة والملف (القفل مأخوذ)"""
+        self._end(upload.id)
+        if os.path.exists(upload.path):
+            os.remove(upload.path)
+
+    def _end(self, upload_id):
+        # حذف ملف الحالة أولاً: من ينتظر القفل يجد الجلسة منتهية عند إعادة القراءة
+        for suffix in ('.json', '.lock'):
+            try:
+                os.remove(os.path.join(self.state_dir, f"{upload_id}{suffix}"))
+            except FileNotFoundError:
+                pass
+
+    def _prune(self):
+        now = time.time()
+        for upload_id in self._sessions():
+            upload = self._load(upload_id)
+            if upload is None:
+                # ملف الرفع حُذف: تبقى حالة الجلسة فقط
+                try:
+                    if now - os.path.getmtime(self._state_path(upload_id)) > self.ttl:
+                        self._end(upload_id)
+                except FileNotFoundError:
+                    pass
+                continue
+            if now - upload.updated_at <= self.ttl:
+                continue
+            # جلسة تستقبل جزءاً الآن في عملية أخرى ليست منتهية
+            lock = self._lock(upload_id)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                self._discard(upload)
+            finally:
+                lock.release()
@@ -1,53 +1,105 @@
 import os
-from moviepy.editor import VideoFileClip, AudioFileClip, CompositeAudioClip
+import ffmpeg
+from utils.metrics import stage
+
+# ترميزات الفيديو التي يمكن نسخها كما هي في كل حاوية (None = أي ترميز)
+CONTAINER_VIDEO_CODECS = {
+    '.mp4': {'h264', 'hevc', 'mpeg4', 'av1', 'vp9'},
+    '.m4v': {'h264', 'hevc', 'mpeg4'},
+    '.mov': {'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg'},
+    '.mkv': None,
+    '.webm': {'vp8', 'vp9', 'av1'},
+}
+
+# ترميز الصوت المناسب لكل حاوية
+CONTAINER_AUDIO_CODECS = {
+    '.webm': 'libopus',
+    '.mkv': 'aac',
+}
+
+def probe_video(video_path):
+    """ترميز الفيديو ومدته بالثواني"""
+    info = ffmpeg.probe(video_path)
+    codec = next(
+        (stream.get('codec_name') for stream in info['streams'] if stream.get('codec_type') == 'video'),
+        None
+    )
+    return codec, float(info['format']['duration'])
+
+def can_copy_video(codec, output_path):
+    """هل يمكن نسخ مسار الفيديو دون إعادة ترميز إلى حاوية الملف الناتج"""
+    allowed = CONTAINER_VIDEO_CODECS.get(os.path.splitext(output_path)[1].lower(), set())
+    return codec is not None and (allowed is None or codec in allowed)
+
+def mux(video_path, audio_tracks, output_path, duration, copy_video=True):
+    """
+    تشغيل ffmpeg مرة واحدة: نسخ الفيديو (أو إعادة ترميزه) ومزج المسارات الصوتية في رسم مرشحات واحد
+    """
+    audio_inputs = [ffmpeg.input(track_path) for track_path in audio_tracks]
+    if len(audio_inputs) == 1:
+        mixed = audio_inputs[0].audio
+    else:
+        # جمع المسارات دون تطبيع مثل CompositeAudioClip
+        mixed = ffmpeg.filter(audio_inputs, 'amix', inputs=len(audio_inputs), duration='longest', normalize=0)
+    # إكمال الصوت بالصمت حتى نهاية الفيديو، ثم القص على طول الفيديو
+    mixed = mixed.filter('apad', whole_dur=duration)
+
+    if copy_video:
+        video_options = {'vcodec': 'copy'}
+    else:
+        video_options = {'vcodec': 'libx264', 'preset': 'fast', 'crf': 23}
+
+    extension = os.path.splitext(output_path)[1].lower()
+    with stage('merge', copy_video=copy_video, tracks=len(audio_tracks)):
+        (
+            ffmpeg.output(
+                ffmpeg.input(video_path).video,
+                mixed,
+                output_path,
+                acodec=CONTAINER_AUDIO_CODECS.get(extension, 'aac'),
+                t=duration,
+                **video_options
+            )
+            .global_args('-loglevel', 'error', '-nostats')
+            .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+        )
 
 def merge_tracks(video_path, audio_tracks, output_dir):
     """
     دمج مسارات صوتية مع فيديو
-    
+
     :param video_path: مسار ملف الفيديو
     :param audio_tracks: قائمة بمسارات الملفات الصوتية
     :param output_dir: مجلد الحفظ
     :return: مسار الملف الناتج
     """
     try:
-        # تحميل الفيديو
-        video = VideoFileClip(video_path)
-        
-        # تحميل المسارات الصوتية
-        audio_clips = []
-        for track_path in audio_tracks:
-            if os.path.exists(track_path):
-                audio_clips.append(AudioFileClip(track_path))
-        
-        if not audio_clips:
+        # المسارات الصوتية الموجودة فقط
+        audio_tracks = [track_path for track_path in audio_tracks if os.path.exists(track_path)]
+
+        if not audio_tracks:
             raise ValueError("No valid audio tracks provided")
-        
-        # دمج المسارات الصوتية
-        final_audio = CompositeAudioClip(audio_clips)
-        
-        # تطبيق الصوت على الفيديو
-        video = video.set_audio(final_audio)
-        
+
         # إنشاء مجلد الإخراج إذا لم يكن موجوداً
         os.makedirs(output_dir, exist_ok=True)
-        
+
         # إنشاء اسم الملف الناتج
         output_filename = f"merged_{os.path.basename(video_path)}"
         output_path = os.path.join(output_dir, output_filename)
-        
-        # حفظ الفيديو النهائي
-        video.write_videofile(
-            output_path,
-            codec="libx264",
-            audio_codec="aac",
-            threads=4,
-            preset='fast',
-            ffmpeg_params=['-crf', '23']
-        )
-        
+
+        # نسخ الفيديو كما هو عندما تسمح الحاوية، وإلا إعادة الترميز
+        codec, duration = probe_video(video_path)
+        if can_copy_video(codec, output_path):
+            try:
+                mux(video_path, audio_tracks, output_path, duration, copy_video=True)
+                return output_path
+            except ffmpeg.Error as e:
+                error_msg = e.stderr.decode('utf8') if e.stderr else str(e)
+                print(f"Stream copy failed, re-encoding video: {error_msg}")
+
+        mux(video_path, audio_tracks, output_path, duration, copy_video=False)
         return output_path
-        
+
     except Exception as e:
         print(f"Error merging tracks: {e}")
-        raise
\ No newline at end of file
+        raise
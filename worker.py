@@ -0,0 +1,48 @@
+"""
+نقطة الدخول لعقد المعالجة: تسحب المهام (فصل، دفعات، تصدير) من الوسيط المشترك
+
+    JOB_BROKER=redis://queue:6379/0 python worker.py
+
+عقدة الويب (wsgi.py) وكل العقد تستخدم نفس JOB_BROKER وتشارك مجلد static/ على نفس المسار
+(مثلاً NFS مثبت في <المشروع>/static)، فتزيد السعة بإضافة عقد. sqlite:///jobs.db يكفي لعدة
+عمليات على جهاز واحد.
+"""
+import os
+import signal
+import sys
+
+# كل المسارات في إعدادات التطبيق نسبية لمجلد المشروع
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, jobs, TASKS, warmup, shutdown  # noqa: E402
+from utils.jobs import BrokerJobManager, Worker  # noqa: E402
+from utils.metrics import log_event  # noqa: E402
+
+
+def main():
+    if not isinstance(jobs, BrokerJobManager):
+        log_event('worker_failed', error="JOB_BROKER is not set")
+        return 1
+
+    worker = Worker(
+        jobs.broker,
+        TASKS,
+        concurrency=app.config['JOB_WORKERS'],
+        lease=app.config['JOB_LEASE']
+    )
+    # الإيقاف ينتظر المهام الجارية؛ إذا قُتلت العملية قبل ذلك تعود مهامها إلى الطابور بعد انتهاء الحجز
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+
+    if os.environ.get('WARMUP', '1') == '1':
+        warmup()
+    log_event('worker_started', worker=worker.id, concurrency=worker.concurrency)
+    try:
+        worker.run()
+    finally:
+        shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,20 @@
+"""
+نقطة الدخول للتشغيل في الإنتاج:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+يتم تحميل النماذج وتشغيل عمليات الفصل هنا، قبل أن يبدأ الخادم بقبول الطلبات.
+"""
+import os
+
+# كل المسارات في إعدادات التطبيق نسبية لمجلد المشروع
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, storage, warmup  # noqa: E402
+
+storage.start()
+# مع JOB_BROKER يتم الفصل في عقد المعالجة (worker.py) وليس في عملية الويب
+if os.environ.get('WARMUP', '1') == '1' and not app.config['JOB_BROKER']:
+    warmup()
+
+application = app